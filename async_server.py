@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - asyncio サーバーエンジン
+http.server と同じルートを asyncio で提供する(アイドル接続にOSスレッドを割り当てない)
+
+    python server.py --engine asyncio
+"""
+
+import asyncio
+import json
+import html
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import DEFAULT_ERROR_MESSAGE
+from urllib.parse import urlparse, parse_qs
+
+from server import (
+    MeaningDiversityServer, ApiError, cors_headers, parse_submission_batch, KEEPALIVE_TIMEOUT,
+    MAX_BODY_BYTES
+)
+from db_pool import storage_diagnostics
+from write_queue import writer_stats
+from static_cache import get_static_cache
+from response_encoding import encode_json_response, response_stats, JSON_CONTENT_TYPE
+from response_cache import response_cache_stats
+from submission_schema import MEANING_SCHEMA
+import simple_server
+
+# 接続・リクエストの上限値
+MAX_REQUEST_LINE = 8192       # リクエスト行の最大長
+MAX_HEADERS = 100             # ヘッダーの最大個数
+DEFAULT_EXECUTOR_WORKERS = 8  # SQLite処理用スレッド数
+
+
+class HTTPRequest:
+    """パース済みHTTPリクエスト"""
+
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+        parsed = urlparse(target)
+        self.path = parsed.path
+        self.query = parsed.query
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def keep_alive(self):
+        """レスポンス後も接続を維持するか"""
+        connection = self.header('Connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+
+class HTTPResponse:
+    """送信前のHTTPレスポンス"""
+
+    def __init__(self, status=200, body=b'', content_type=None, headers=None, data=None):
+        self.status = status
+        self.body = body
+        # JSONレスポンスは送信時にリクエストに合わせてエンコードする
+        self.data = data
+        self.headers = list(headers or [])
+        if content_type:
+            self.headers.append(('Content-Type', content_type))
+
+
+class BadRequest(Exception):
+    """HTTPリクエストとして解釈できない入力"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def json_response(data, status=200):
+    """JSONレスポンスを生成(ボディは write_response でエンコードする)"""
+    return HTTPResponse(status, data=data)
+
+
+def error_response(status, message):
+    """http.server の send_error と同じ形式のエラーページを生成"""
+    status = HTTPStatus(status)
+    body = (DEFAULT_ERROR_MESSAGE % {
+        'code': status.value,
+        'message': html.escape(message, quote=False),
+        'explain': html.escape(status.description, quote=False),
+    }).encode('utf-8', 'replace')
+    return HTTPResponse(status.value, body, 'text/html;charset=utf-8')
+
+
+def api_error_response(status, message, errors=None):
+    """simple_server の /api/* と同じ形式のエラーJSONを生成"""
+    data = {"status": "error", "message": message}
+    if errors:
+        data["errors"] = errors
+    return json_response(data, status=status)
+
+
+class AsyncDiaryServer:
+    """asyncio ベースのHTTP/1.1サーバー(keep-alive・パイプライン対応)"""
+
+    def __init__(self, db_path='kotoiminiki.db', executor_workers=DEFAULT_EXECUTOR_WORKERS,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT):
+        self.db_path = db_path
+        self.keepalive_timeout = keepalive_timeout
+        # SQLite・ファイルI/Oはイベントループを塞がないようスレッドプールで実行
+        self.executor = ThreadPoolExecutor(
+            max_workers=executor_workers,
+            thread_name_prefix='kotoimi-async-db'
+        )
+        self.db_manager = simple_server.DatabaseManager.shared(db_path)
+        self.analyzer = simple_server.MeaningDiversityAnalyzer(db_path)
+
+    async def run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    # --- 接続処理 ---
+
+    async def handle_connection(self, reader, writer):
+        """1接続分の処理(パイプラインされたリクエストも順番に処理する)"""
+        peer = writer.get_extra_info('peername')
+        client_ip = peer[0] if peer else ''
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self.read_request(reader), self.keepalive_timeout
+                    )
+                except asyncio.TimeoutError:
+                    break
+                except BadRequest as e:
+                    await self.write_response(writer, error_response(e.status, e.message),
+                                              None, keep_alive=False)
+                    break
+
+                if request is None:
+                    break
+
+                try:
+                    response = await self.dispatch(request, client_ip)
+                except Exception as e:
+                    print(f"Async handler error: {e}")
+                    response = error_response(500, 'Internal server error')
+
+                keep_alive = request.keep_alive
+                await self.write_response(writer, response, request, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def read_request(self, reader):
+        """ストリームから1リクエストを読み取る(接続終了ならNone)"""
+        request_line = await self.read_line(reader, 414, 'Request-URI Too Long')
+        if not request_line:
+            return None
+        if len(request_line) > MAX_REQUEST_LINE:
+            raise BadRequest(414, 'Request-URI Too Long')
+
+        parts = request_line.decode('iso-8859-1').rstrip('\r\n').split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise BadRequest(400, 'Bad request syntax')
+        method, target, version = parts
+
+        headers = {}
+        while True:
+            line = await self.read_line(reader, 431, 'Request Header Fields Too Large')
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise BadRequest(431, 'Too many headers')
+            name, sep, value = line.decode('iso-8859-1').partition(':')
+            if not sep:
+                raise BadRequest(400, 'Bad header line')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise BadRequest(411, 'Length Required')
+
+        try:
+            content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequest(400, 'Bad Content-Length')
+        if content_length < 0:
+            raise BadRequest(400, 'Bad Content-Length')
+        if content_length > MAX_BODY_BYTES:
+            raise BadRequest(413, 'Payload Too Large')
+
+        body = await reader.readexactly(content_length) if content_length else b''
+        return HTTPRequest(method.upper(), target, version, headers, body)
+
+    @staticmethod
+    async def read_line(reader, status, message):
+        """1行読み取る(ストリームの上限を超える行は status のエラーにする)"""
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            # readline は上限超過の LimitOverrunError を ValueError にして送出する
+            raise BadRequest(status, message)
+
+    async def write_response(self, writer, response, request, keep_alive):
+        """ステータス行・ヘッダー・ボディを1回で書き出す"""
+        status = HTTPStatus(response.status)
+        origin = request.header('Origin') if request else None
+
+        if response.data is not None:
+            # 集計はルートが存在するレスポンスのみ(404 などで任意のパスを数えない)
+            response.body, encoding_headers = encode_json_response(
+                response.data,
+                route=request.path if request is not None and status < 400 else None,
+                query_string=request.query if request is not None else None,
+                accept_encoding=request.header('Accept-Encoding') if request is not None else None
+            )
+            response.headers.extend(encoding_headers)
+
+        headers = dict(cors_headers(origin))
+        if status != HTTPStatus.NOT_MODIFIED:
+            # 304 はボディを持たないので表現に関するヘッダーは付けない
+            if response.data is not None:
+                headers['Content-Type'] = JSON_CONTENT_TYPE
+            headers['Content-Length'] = str(len(response.body))
+        headers.update(response.headers)
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        if keep_alive:
+            headers['Keep-Alive'] = f'timeout={self.keepalive_timeout}'
+
+        lines = [f'HTTP/1.1 {status.value} {status.phrase}']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1')
+
+        body = b'' if request is not None and request.method == 'HEAD' else response.body
+        writer.write(head + body)
+        await writer.drain()
+
+    # --- ルーティング ---
+
+    async def dispatch(self, request, client_ip):
+        """メソッド・パスに応じてルート処理を呼び出す"""
+        if request.method == 'OPTIONS':
+            # CORS プリフライト
+            return HTTPResponse(200)
+        if request.method in ('GET', 'HEAD'):
+            return await self.handle_get(request)
+        if request.method == 'POST':
+            # レート制限チェック
+            if not MeaningDiversityServer.check_client_rate_limit(client_ip):
+                return error_response(429, 'Too Many Requests')
+            return await self.handle_post(request)
+        return error_response(501, f'Unsupported method ({request.method!r})')
+
+    async def handle_get(self, request):
+        path = request.path
+
+        if path == '/':
+            # Railwayヘルスチェック対応 + index.html
+            user_agent = request.header('User-Agent', '').lower()
+            if 'curl' in user_agent or 'railway' in user_agent or request.header('Accept') == 'text/plain':
+                return HTTPResponse(200, b'OK', 'text/plain')
+            return await self.serve_static_file(request, 'index.html', 'text/html')
+        elif path == '/research_dashboard':
+            return await self.serve_static_file(request, 'research_dashboard.html', 'text/html')
+        elif path == '/health':
+            return HTTPResponse(200, b'OK', 'text/plain; charset=utf-8')
+        elif path == '/fetch':
+            return await self.call_route(
+                MeaningDiversityServer.process_fetch, request.query,
+                error_label='Fetch error')
+        elif path == '/research':
+            return await self.call_route(
+                MeaningDiversityServer.process_research, request.query, self.db_path,
+                error_label='Research request error', error_message='Analysis error')
+        elif path == '/diagnostics':
+            return await self.call_route(
+                MeaningDiversityServer.process_diagnostics,
+                error_label='Diagnostics error')
+        elif path == '/api/diagnostics':
+            storage = await self.run_in_executor(storage_diagnostics)
+            return json_response({"status": "success", "storage": storage, "write_queue": writer_stats(),
+                                  "responses": response_stats(), "response_cache": response_cache_stats()})
+        elif path == '/api/entries':
+            exclude_samples = self.exclude_samples(request)
+            entries = await self.run_in_executor(self.db_manager.list_entries, exclude_samples)
+            return json_response(entries)
+        elif path == '/api/analysis':
+            exclude_samples = self.exclude_samples(request)
+            analysis = await self.run_in_executor(self.analyzer.cached_event_diversity, exclude_samples)
+            return json_response(analysis)
+
+        return error_response(404, 'Not Found')
+
+    async def handle_post(self, request):
+        path = request.path
+
+        if path == '/api/entries':
+            try:
+                data = json.loads(request.body.decode('utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                return api_error_response(400, "Invalid JSON")
+            errors = MEANING_SCHEMA.validate(data)
+            if errors:
+                return api_error_response(400, "Invalid data", errors)
+            entry_id = await self.run_in_executor(self.db_manager.insert_entry, data)
+            return json_response({"status": "success", "id": entry_id, "message": "エントリが保存されました"})
+
+        if path == '/submit/batch':
+            try:
+                items = parse_submission_batch(request.body)
+            except ApiError as e:
+                return error_response(e.status, e.message)
+            return await self.call_route(MeaningDiversityServer.process_submission_batch, items,
+                                         error_label='Submit batch error')
+
+        if path == '/submit':
+            route, label = MeaningDiversityServer.process_submission, 'Submit error'
+        elif path == '/update_saw_alt_meanings':
+            route, label = MeaningDiversityServer.process_update_saw_alt_meanings, 'Update saw_alt_meanings error'
+        else:
+            return error_response(404, 'Not Found')
+
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return error_response(400, 'Invalid JSON')
+        return await self.call_route(route, data, error_label=label)
+
+    async def call_route(self, route, *args, error_label, error_message='Internal server error'):
+        """共通ルート処理をスレッドプールで実行してレスポンスに変換"""
+        try:
+            result = await self.run_in_executor(route, *args)
+        except ApiError as e:
+            if e.errors:
+                return json_response(e.to_json(), status=e.status)
+            return error_response(e.status, e.message)
+        except Exception as e:
+            print(f"{error_label}: {e}")
+            return error_response(500, error_message)
+        return json_response(result)
+
+    async def serve_static_file(self, request, filename, content_type):
+        result = await self.run_in_executor(
+            get_static_cache().respond, filename, content_type + '; charset=utf-8',
+            request.header('If-None-Match'), request.header('Accept-Encoding'))
+        if result is None:
+            return error_response(404, 'File not found')
+        status, headers, body = result
+        return HTTPResponse(status, body, headers=headers)
+
+    @staticmethod
+    def exclude_samples(request):
+        query_params = parse_qs(request.query)
+        return query_params.get('exclude_samples', ['false'])[0].lower() == 'true'
+
+    # --- 起動・停止 ---
+
+    async def serve(self, host, port, reuse_port=False):
+        server = await asyncio.start_server(self.handle_connection, host, port,
+                                            reuse_port=reuse_port or None)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_async_server(port=8000, host='0.0.0.0', executor_workers=DEFAULT_EXECUTOR_WORKERS,
+                     reuse_port=False):
+    """asyncio エンジンでサーバーを起動"""
+    app = AsyncDiaryServer(executor_workers=executor_workers)
+
+    print(f"ことイミ日記サーバーを起動しました (asyncio エンジン)")
+    print(f"URL: http://{host}:{port}")
+    print(f"データベース: {app.db_path}")
+    print(f"DB処理スレッド数: {executor_workers}")
+    print("Ctrl+C で停止できます")
+
+    try:
+        asyncio.run(app.serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        print("\nサーバーを停止しています...")
+    finally:
+        app.close()
+        print("サーバーが停止しました")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - SQLite 接続プール
+リクエスト毎の sqlite3.connect を避け、長寿命の接続をプロセス内で共有する
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# プールの既定値(環境変数で上書き可能)
+DEFAULT_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DEFAULT_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# 接続毎に保持するプリペアドステートメント数(sqlite3 の statement cache)
+DEFAULT_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
+
+# 接続時に適用するストレージ設定のプリセット
+#   legacy:     従来どおりのロールバックジャーナル
+#   durable:    WAL + synchronous=FULL(コミット毎にfsync、電源断でも失わない)
+#   throughput: WAL + synchronous=NORMAL(チェックポイント時のみfsync、mmap・大きめのキャッシュ)
+STORAGE_PROFILES = {
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -2000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -16000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+}
+DEFAULT_STORAGE_PROFILE = os.environ.get('SQLITE_PROFILE', 'durable')
+
+# PRAGMA synchronous / temp_store の数値表現
+_SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+_TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+
+def resolve_storage_profile(profile):
+    """プロファイル名(または設定の辞書)から設定値を得る"""
+    if isinstance(profile, dict):
+        return dict(profile)
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f'Unknown storage profile: {profile}')
+    return dict(STORAGE_PROFILES[profile])
+
+
+def apply_storage_profile(conn, settings):
+    """接続にストレージ設定を適用"""
+    # journal_mode はDBファイルに永続化されるが、他の接続が使用中だと切り替えられない
+    try:
+        conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}").fetchone()
+    except sqlite3.OperationalError:
+        pass
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+
+
+def read_storage_settings(conn):
+    """接続に実際に適用されているストレージ設定を読み出す"""
+    synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+    temp_store = conn.execute('PRAGMA temp_store').fetchone()[0]
+    mmap_row = conn.execute('PRAGMA mmap_size').fetchone()
+    return {
+        'journal_mode': conn.execute('PRAGMA journal_mode').fetchone()[0].upper(),
+        'synchronous': _SYNCHRONOUS_NAMES.get(synchronous, synchronous),
+        'mmap_size': mmap_row[0] if mmap_row else 0,
+        'cache_size': conn.execute('PRAGMA cache_size').fetchone()[0],
+        'temp_store': _TEMP_STORE_NAMES.get(temp_store, temp_store),
+        'busy_timeout': conn.execute('PRAGMA busy_timeout').fetchone()[0],
+    }
+
+
+class PoolTimeout(Exception):
+    """プールから接続を取得できなかった"""
+
+
+class ConnectionPool:
+    """上限付きSQLite接続プール
+
+    接続は必要になった時点で最大 size 本まで作成し、使い終わったら再利用する。
+    sqlite3 は接続単位でプリペアドステートメントをキャッシュするため、
+    接続を使い回すことでSQLの再コンパイルも省ける。
+    """
+
+    def __init__(self, db_path, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 cached_statements=DEFAULT_CACHED_STATEMENTS, profile=DEFAULT_STORAGE_PROFILE):
+        if size < 1:
+            raise ValueError('size must be >= 1')
+        self.db_path = db_path
+        self.profile_name = profile if isinstance(profile, str) else 'custom'
+        self.storage_settings = resolve_storage_profile(profile)
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self._stats = {
+            'created': 0,
+            'acquired': 0,
+            'reused': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'discarded': 0,
+        }
+
+    def _connect(self):
+        """新しい接続を作成"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        try:
+            apply_storage_profile(conn, self.storage_settings)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def acquire(self):
+        """接続を取得(空きがなく上限に達していれば返却を待つ)"""
+        if self._closed:
+            raise PoolTimeout('pool is closed')
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats['acquired'] += 1
+                self._stats['reused'] += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._stats['errors'] += 1
+                raise
+            with self._lock:
+                self._stats['created'] += 1
+                self._stats['acquired'] += 1
+            return conn
+
+        with self._lock:
+            self._stats['waits'] += 1
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f'no connection available within {self.timeout}s')
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['reused'] += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        """接続をプールに返却(壊れた接続は破棄)"""
+        if not broken:
+            try:
+                # 未確定のトランザクションを次の利用者に持ち越さない
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+
+        if broken or self._closed:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+            self._stats['discarded'] += 1
+
+    @contextmanager
+    def connection(self):
+        """with文で接続を借りる"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def health_check(self):
+        """プールの接続で SELECT 1 が実行できるか確認"""
+        try:
+            with self.connection() as conn:
+                conn.execute('SELECT 1').fetchone()
+            return True
+        except Exception:
+            return False
+
+    def storage_report(self):
+        """設定したストレージプロファイルと実際の値(診断用)"""
+        with self.connection() as conn:
+            effective = read_storage_settings(conn)
+        return {
+            'profile': self.profile_name,
+            'configured': dict(self.storage_settings),
+            'effective': effective,
+        }
+
+    def stats(self):
+        """統計カウンタを返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._created
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        return stats
+
+    def close(self):
+        """全ての空き接続を閉じる(使用中の接続は返却時に閉じる)"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, size=None, profile=None):
+    """DBファイル毎に共有される接続プールを取得
+
+    size / profile は最初にプールを作成する呼び出しでのみ有効。
+    """
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                db_path,
+                size=size or DEFAULT_POOL_SIZE,
+                profile=profile or DEFAULT_STORAGE_PROFILE
+            )
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    """全プールの統計(診断用)"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {path: pool.stats() for path, pool in pools}
+
+
+def storage_diagnostics():
+    """全プールのストレージ設定と統計(診断エンドポイント用)"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    report = {}
+    for path, pool in pools:
+        entry = pool.storage_report()
+        entry['pool'] = pool.stats()
+        entry['healthy'] = pool.health_check()
+        report[path] = entry
+    return report
+
+
+def close_all_pools():
+    """全プールを閉じる"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
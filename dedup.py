@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 重複投稿の検出
+(ユーザー, 出来事, 正規化した意味づけ) のハッシュを records.content_hash に持ち、
+直近24時間分はメモリ上のスライディングウィンドウで判定する
+"""
+
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import deque
+
+# 重複とみなす期間(秒)とメモリに保持する最大件数(環境変数で上書き可能)
+DEDUP_WINDOW_SECONDS = float(os.environ.get('DEDUP_WINDOW_SECONDS', 24 * 60 * 60))
+DEDUP_MAX_ENTRIES = int(os.environ.get('DEDUP_MAX_ENTRIES', 200000))
+
+
+def normalize_text(text):
+    """比較用に正規化(NFKC・大文字小文字の同一視・空白の統一)"""
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+
+def content_hash(user_id_hash, event_tag, meaning_text):
+    """重複判定に使うハッシュ"""
+    key = '\x1f'.join((user_id_hash or '', event_tag or '', normalize_text(meaning_text)))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+class DuplicateWindow:
+    """直近 window 秒の content_hash を保持するスライディングウィンドウ
+
+    見つかった場合は常に重複と判定できる。見つからない場合に「重複なし」と
+    言い切れるのは、このプロセスがDBへの書き込みを全て見ている(authoritative)
+    ときだけなので、それ以外は None を返してSQLiteでの確認に回す。
+    """
+
+    def __init__(self, window=DEDUP_WINDOW_SECONDS, max_entries=DEDUP_MAX_ENTRIES,
+                 authoritative=False):
+        self.window = window
+        self.max_entries = max_entries
+        self.authoritative = authoritative
+        self._last_seen = {}
+        self._order = deque()
+        # この時刻以降の書き込みは全てウィンドウに入っている(None は不明)
+        self._complete_since = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'fallbacks': 0,
+            'evictions': 0,
+        }
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self._order and self._order[0][0] <= cutoff:
+            seen_at, key = self._order.popleft()
+            if self._last_seen.get(key) == seen_at:
+                del self._last_seen[key]
+
+    def _append(self, key, seen_at):
+        if seen_at > self._last_seen.get(key, float('-inf')):
+            self._last_seen[key] = seen_at
+        self._order.append((seen_at, key))
+        while len(self._order) > self.max_entries:
+            evicted_at, evicted = self._order.popleft()
+            if self._last_seen.get(evicted) == evicted_at:
+                del self._last_seen[evicted]
+            # 押し出した時刻までの記録は欠けている可能性がある
+            self._complete_since = max(self._complete_since or evicted_at, evicted_at)
+            self._stats['evictions'] += 1
+
+    def load(self, rows, complete_since):
+        """DBから読み込んだ (content_hash, received_at) で初期化する(古い順)"""
+        with self._lock:
+            self._last_seen.clear()
+            self._order.clear()
+            self._complete_since = complete_since
+            for key, seen_at in rows:
+                self._append(key, seen_at)
+
+    def add(self, key, seen_at):
+        """挿入した記録を追加"""
+        with self._lock:
+            self._append(key, seen_at)
+
+    def lookup(self, key, now):
+        """True: 重複 / False: 重複なし / None: ウィンドウだけでは判定できない"""
+        with self._lock:
+            self._expire(now)
+            seen_at = self._last_seen.get(key)
+            if seen_at is not None and seen_at > now - self.window:
+                self._stats['hits'] += 1
+                return True
+            if (self.authoritative and self._complete_since is not None
+                    and self._complete_since <= now - self.window):
+                self._stats['misses'] += 1
+                return False
+            self._stats['fallbacks'] += 1
+            return None
+
+    def stats(self):
+        """統計カウンタ(診断用)"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._order)
+        stats['authoritative'] = self.authoritative
+        stats['window_seconds'] = self.window
+        return stats
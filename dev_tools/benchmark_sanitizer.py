@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+入力サニタイザーのマイクロベンチマーク
+従来の sanitize_input(フィールド毎に re.sub を十数回)と sanitizer.sanitize_text を
+長い日本語入力で比較し、出力が一致することも確認する
+
+    python dev_tools/benchmark_sanitizer.py [繰り返し回数]
+"""
+
+import html
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sanitizer import sanitize_text
+
+
+def legacy_sanitize_input(text):
+    """変更前の実装(比較用)"""
+    if not isinstance(text, str):
+        return str(text)
+    sanitized = html.escape(text)
+    sanitized = re.sub(r'<script[^>]*>.*?</script>', '', sanitized, flags=re.DOTALL | re.IGNORECASE)
+    dangerous_tags = ['iframe', 'object', 'embed', 'form', 'input', 'button']
+    for tag in dangerous_tags:
+        sanitized = re.sub(f'<{tag}[^>]*>.*?</{tag}>', '', sanitized, flags=re.DOTALL | re.IGNORECASE)
+        sanitized = re.sub(f'<{tag}[^>]*/?>', '', sanitized, flags=re.IGNORECASE)
+    sanitized = re.sub(r'javascript:', '', sanitized, flags=re.IGNORECASE)
+    if len(sanitized) > 10000:
+        sanitized = sanitized[:10000]
+    return sanitized.strip()
+
+
+JAPANESE = '今日は仕事で遅くまで残業したけれど、同僚に助けてもらって新しい学びもあった。'
+MARKUP = '<b>疲れた</b>けど "学び" もあった & <script>alert(1)</script> JavaScript:void(0) '
+
+
+def build_inputs():
+    return [
+        ('日本語 1,000文字', (JAPANESE * 100)[:1000]),
+        ('日本語 10,000文字', (JAPANESE * 400)[:10000]),
+        ('日本語 50,000文字', (JAPANESE * 2000)[:50000]),
+        ('日本語+マークアップ 10,000文字', ((JAPANESE + MARKUP) * 200)[:10000]),
+        ('javascript: だらけ 20,000文字', ('javascript:' * 2000)[:20000] + JAPANESE),
+    ]
+
+
+def check_equivalence(inputs):
+    edge_cases = [
+        '', '   ', 123, None, '  <p>前後の空白</p>  ', 'JAVAſCRIPT:x', 'javajavascript:script:',
+        'あ' * 9999 + 'javascript:' + 'い' * 100,
+        'x' * 9995 + '"' * 20,
+        ' ' * 10050 + 'a',
+    ]
+    for _, text in inputs:
+        edge_cases.append(text)
+    for text in edge_cases:
+        if legacy_sanitize_input(text) != sanitize_text(text):
+            raise AssertionError(f'出力が一致しません: {str(text)[:40]!r}')
+    print(f"✅ 出力の一致を確認しました({len(edge_cases)}件)")
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    inputs = build_inputs()
+    check_equivalence(inputs)
+
+    print(f"\n{'入力':<32}{'従来 (µs)':>12}{'新 (µs)':>12}{'倍率':>8}")
+    for label, text in inputs:
+        legacy = min(timeit.repeat(lambda: legacy_sanitize_input(text), number=number, repeat=3))
+        current = min(timeit.repeat(lambda: sanitize_text(text), number=number, repeat=3))
+        legacy_us = legacy / number * 1e6
+        current_us = current / number * 1e6
+        print(f"{label:<32}{legacy_us:>12.1f}{current_us:>12.1f}{legacy_us / current_us:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
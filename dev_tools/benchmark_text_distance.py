@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+編集距離エンジンのベンチマーク
+従来の純Python DP(simple_text_distance)と text_distance のビット並列版を比べ、
+1組あたりの処理速度と /research?type=diversity 相当の全組計算の時間を表示する
+(組を抽出する推定モードの時間と信頼区間、複数プロセスでの全組計算の時間も表示する)
+
+    python dev_tools/benchmark_text_distance.py [意味づけの件数] [プロセス数]
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from text_distance import (
+    estimate_mean_pairwise_distance, mean_pairwise_distance, normalized_distance,
+    parallel_mean_pairwise_distance,
+)
+
+
+def legacy_text_distance(text1, text2):
+    """変更前の実装(比較用)"""
+    def levenshtein_distance(s1, s2):
+        if len(s1) < len(s2):
+            return levenshtein_distance(s2, s1)
+        if len(s2) == 0:
+            return len(s1)
+        previous_row = list(range(len(s2) + 1))
+        for i, c1 in enumerate(s1):
+            current_row = [i + 1]
+            for j, c2 in enumerate(s2):
+                insertions = previous_row[j + 1] + 1
+                deletions = current_row[j] + 1
+                substitutions = previous_row[j] + (c1 != c2)
+                current_row.append(min(insertions, deletions, substitutions))
+            previous_row = current_row
+        return previous_row[-1]
+
+    distance = levenshtein_distance(text1.lower(), text2.lower())
+    max_len = max(len(text1), len(text2))
+    return distance / max_len if max_len > 0 else 0
+
+
+def legacy_mean_distance(meanings):
+    distances = []
+    for i in range(len(meanings)):
+        for j in range(i + 1, len(meanings)):
+            distances.append(legacy_text_distance(meanings[i], meanings[j]))
+    return statistics.mean(distances) if distances else 0
+
+
+PHRASES = [
+    '次に活かせる良い経験になった', '疲れたけど学びがあった', '自分の成長の機会だと思う',
+    '仕方がないので気にしない', '周りの人に感謝したい', 'もう少し準備をすればよかった',
+    'Good lesson for next time', '運が悪かっただけ', '休息が必要というサイン',
+]
+
+
+def make_meaning(rng, length):
+    text = ''
+    while len(text) < length:
+        text += rng.choice(PHRASES) + rng.choice(['。', '、', ' '])
+    return text[:length]
+
+
+def pairs_per_second(function, pairs, min_time=0.5):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for text1, text2 in pairs:
+            function(text1, text2)
+        count += len(pairs)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return count / elapsed
+
+
+def main():
+    meanings_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    rng = random.Random(42)
+
+    print(f"{'文字数':>8}{'従来 (組/秒)':>16}{'新 (組/秒)':>16}{'倍率':>8}")
+    for length in (10, 30, 64, 100, 300, 1000):
+        pairs = [(make_meaning(rng, length), make_meaning(rng, length)) for _ in range(20)]
+        for text1, text2 in pairs:
+            if legacy_text_distance(text1, text2) != normalized_distance(text1, text2):
+                raise AssertionError(f'距離が一致しません: {text1!r} {text2!r}')
+        legacy = pairs_per_second(legacy_text_distance, pairs[:5] if length >= 300 else pairs)
+        current = pairs_per_second(normalized_distance, pairs)
+        print(f"{length:>8}{legacy:>16,.0f}{current:>16,.0f}{current / legacy:>7.1f}x")
+
+    meanings = [make_meaning(rng, rng.randint(10, 120)) for _ in range(meanings_count)]
+    pairs_count = meanings_count * (meanings_count - 1) // 2
+    print(f"\n意味づけ {meanings_count} 件({pairs_count:,} 組)の平均距離")
+    start = time.perf_counter()
+    current = mean_pairwise_distance(meanings)
+    current_time = time.perf_counter() - start
+    start = time.perf_counter()
+    legacy = legacy_mean_distance(meanings)
+    legacy_time = time.perf_counter() - start
+    if legacy != current:
+        raise AssertionError(f'平均距離が一致しません: {legacy} != {current}')
+    print(f"  従来: {legacy_time:.2f} 秒 / 新: {current_time:.3f} 秒 "
+          f"({legacy_time / current_time:.0f}x、結果 {current:.6f} は一致)")
+
+    start = time.perf_counter()
+    parallel = parallel_mean_pairwise_distance(meanings, workers)
+    parallel_time = time.perf_counter() - start
+    if parallel != current:
+        raise AssertionError(f'並列計算の平均距離が一致しません: {parallel} != {current}')
+    print(f"  {workers} プロセス: {parallel_time:.3f} 秒 ({current_time / parallel_time:.1f}x、結果は一致)")
+
+    for max_pairs in (1000, 10000):
+        start = time.perf_counter()
+        summary = estimate_mean_pairwise_distance(meanings, max_pairs=max_pairs, rng=random.Random(1))
+        elapsed = time.perf_counter() - start
+        print(f"  推定 ({summary['pairs_used']:,} 組): {elapsed:.3f} 秒、{summary['estimate']:.6f} "
+              f"[{summary['ci_low']:.6f}, {summary['ci_high']:.6f}]")
+
+
+if __name__ == '__main__':
+    main()
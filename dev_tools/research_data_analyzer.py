@@ -4,17 +4,45 @@
 データベースから直接研究データを取得・分析
 """
 
+import os
+import sys
 import sqlite3
 import json
 import datetime
 from collections import Counter, defaultdict
 import statistics
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db_pool import get_pool
+from schema import bootstrap_schema
+from server import RECORDS_MIGRATIONS
+
+# quality_flags に spam / duplicate / too_short 以外の真のフラグがあるか
+# (Python の真偽値と同じく false・null・0・空文字列・空の配列/オブジェクトは偽)
+OTHER_FLAG_CONDITION = """
+    EXISTS (
+        SELECT 1 FROM json_each(CASE WHEN json_valid(quality_flags) THEN quality_flags ELSE '{}' END)
+        WHERE key NOT IN ('spam', 'duplicate', 'too_short')
+          AND CASE type
+                  WHEN 'true' THEN 1
+                  WHEN 'integer' THEN value != 0
+                  WHEN 'real' THEN value != 0
+                  WHEN 'text' THEN value != ''
+                  WHEN 'array' THEN value != '[]'
+                  WHEN 'object' THEN value != '{}'
+                  ELSE 0
+              END
+    )
+"""
+
 class ResearchDataAnalyzer:
     """研究データ分析クラス"""
     
     def __init__(self, db_path='kotoiminiki.db'):
         self.db_path = db_path
+        # 品質フラグ列・タグ索引(record_tags)を参照するので、先に records のスキーマを最新化する
+        bootstrap_schema(get_pool(db_path), 'records', RECORDS_MIGRATIONS)
     
     def get_basic_stats(self):
         """基本統計情報を取得"""
@@ -63,20 +91,35 @@ class ResearchDataAnalyzer:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # 品質フラグ分析
-        cursor.execute("SELECT quality_flags FROM records WHERE consent = TRUE")
-        quality_data = []
+        # 品質フラグ分析（整数列をSQLiteで集計）
+        # 高品質は quality_flags に真のフラグが1つも無いこと。3列以外のキーは3列が全て0の行だけ JSON で確認する
+        cursor.execute(f"""
+            SELECT COUNT(*),
+                   COALESCE(SUM(is_spam), 0),
+                   COALESCE(SUM(is_duplicate), 0),
+                   COALESCE(SUM(is_too_short), 0),
+                   COALESCE(SUM(CASE WHEN is_spam = 0 AND is_duplicate = 0 AND is_too_short = 0
+                                     THEN NOT {OTHER_FLAG_CONDITION} ELSE 0 END), 0)
+            FROM records WHERE consent = TRUE AND is_spam IS NOT NULL
+        """)
+        total_analyzed, spam, duplicate, too_short, high_quality = cursor.fetchone()
         
+        # バックフィル待ち（列が未設定）のレコードのみJSONで判定
+        cursor.execute("SELECT quality_flags FROM records WHERE is_spam IS NULL AND consent = TRUE")
         for row in cursor.fetchall():
             flags = json.loads(row[0] or '{}')
-            quality_data.append(flags)
+            total_analyzed += 1
+            spam += bool(flags.get('spam', False))
+            duplicate += bool(flags.get('duplicate', False))
+            too_short += bool(flags.get('too_short', False))
+            high_quality += not any(flags.values())
         
         # 各品質問題の集計
         quality_issues = {
-            'spam': sum(1 for q in quality_data if q.get('spam', False)),
-            'duplicate': sum(1 for q in quality_data if q.get('duplicate', False)),
-            'too_short': sum(1 for q in quality_data if q.get('too_short', False)),
-            'high_quality': sum(1 for q in quality_data if not any(q.values()))
+            'spam': spam,
+            'duplicate': duplicate,
+            'too_short': too_short,
+            'high_quality': high_quality
         }
         
         # 反応時間分析
@@ -98,7 +141,7 @@ class ResearchDataAnalyzer:
         return {
             'quality_issues': quality_issues,
             'reaction_time_stats': rt_stats,
-            'total_analyzed': len(quality_data)
+            'total_analyzed': total_analyzed
         }
     
     def get_meaning_diversity_analysis(self):
@@ -106,44 +149,54 @@ class ResearchDataAnalyzer:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # 出来事ごとの意味づけ分析
+        # 出来事ごとの意味づけ数・ユニーク数（2件以上の出来事のみ）
         cursor.execute("""
-            SELECT event_tag, meaning_text, meaning_tag 
+            SELECT event_tag, COUNT(*), COUNT(DISTINCT meaning_text)
             FROM records 
             WHERE consent = TRUE
+            GROUP BY event_tag
+            HAVING COUNT(*) >= 2
         """)
+        event_counts = cursor.fetchall()
         
-        event_meanings = defaultdict(list)
-        for event_tag, meaning_text, meaning_tag in cursor.fetchall():
-            event_meanings[event_tag].append({
-                'text': meaning_text,
-                'tags': meaning_tag.split(',') if meaning_tag else []
-            })
+        # タグの出現数・種類数（タグ索引 record_tags を集計）
+        cursor.execute("""
+            SELECT event_tag, COUNT(*), COUNT(DISTINCT tag)
+            FROM record_tags 
+            WHERE consent = 1
+            GROUP BY event_tag
+        """)
+        tag_stats = {event_tag: (total, distinct) for event_tag, total, distinct in cursor.fetchall()}
+        
+        # 各出来事の先頭3件の意味づけ
+        cursor.execute("""
+            SELECT event_tag, meaning_text FROM (
+                SELECT event_tag, meaning_text,
+                       ROW_NUMBER() OVER (PARTITION BY event_tag ORDER BY rowid) AS n
+                FROM records 
+                WHERE consent = TRUE
+            ) WHERE n <= 3
+        """)
+        samples = defaultdict(list)
+        for event_tag, meaning_text in cursor.fetchall():
+            samples[event_tag].append(meaning_text)
         
         # 各出来事の多様性計算
         diversity_results = {}
-        for event_tag, meanings in event_meanings.items():
-            if len(meanings) < 2:
-                continue
-                
+        for event_tag, total_meanings, unique_texts in event_counts:
             # 意味づけテキストの多様性（ユニーク率）
-            texts = [m['text'] for m in meanings]
-            unique_texts = len(set(texts))
-            diversity_rate = unique_texts / len(texts)
+            diversity_rate = unique_texts / total_meanings
             
             # タグの多様性
-            all_tags = []
-            for m in meanings:
-                all_tags.extend([tag.strip() for tag in m['tags'] if tag.strip()])
-            
-            tag_diversity = len(set(all_tags)) / len(all_tags) if all_tags else 0
+            total_tags, distinct_tags = tag_stats.get(event_tag, (0, 0))
+            tag_diversity = distinct_tags / total_tags if total_tags else 0
             
             diversity_results[event_tag] = {
-                'total_meanings': len(meanings),
+                'total_meanings': total_meanings,
                 'unique_meanings': unique_texts,
                 'diversity_rate': diversity_rate,
                 'tag_diversity': tag_diversity,
-                'sample_meanings': texts[:3]
+                'sample_meanings': samples[event_tag]
             }
         
         conn.close()
@@ -248,7 +301,7 @@ def main():
         print("\n🔍 データ品質分析")
         print("-" * 40)
         quality_stats = analyzer.get_quality_analysis()
-        print(f"高品質データ: {quality_stats['quality_issues']['high_quality']}")
+        print(f"高品質データ(品質フラグ無し): {quality_stats['quality_issues']['high_quality']}")
         print(f"スパム検出: {quality_stats['quality_issues']['spam']}")
         print(f"重複検出: {quality_stats['quality_issues']['duplicate']}")
         print(f"短文検出: {quality_stats['quality_issues']['too_short']}")
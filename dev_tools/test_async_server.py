@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - asyncio エンジンテスト
+server.py --engine asyncio のリクエスト行・ヘッダー・ボディの上限(414 / 431 / 411 / 413)、
+keep-alive とパイプライン、HEAD と、http.server エンジンと同じ応答を返すことを確認します
+
+    python dev_tools/test_async_server.py
+"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from server import MAX_BODY_BYTES, SUBMIT_BATCH_MAX_ITEMS
+
+# ルートが返す静的ファイル
+STATIC_FILES = ('index.html', 'research_dashboard.html')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, port, *args):
+    """workdir をカレントディレクトリにしてサーバーを起動し、応答するまで待つ"""
+    for filename in STATIC_FILES:
+        shutil.copy(os.path.join(ROOT, filename), workdir)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), str(port), '127.0.0.1', *args],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=10).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('サーバーが起動しませんでした')
+
+
+def stop_server(process):
+    process.terminate()
+    process.wait(10)
+
+
+def read_response(stream, method='GET'):
+    """ストリームから1レスポンスを読む((ステータス, ヘッダー, ボディ)、切断ならNone)"""
+    status_line = stream.readline()
+    if not status_line:
+        return None
+    headers = {}
+    while True:
+        line = stream.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('iso-8859-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = b'' if method == 'HEAD' else stream.read(length)
+    return int(status_line.split()[1]), headers, body
+
+
+def exchange(port, raw, methods=('GET',)):
+    """raw をそのまま送り、methods の数だけレスポンスを読む(残りはサーバーが閉じたかどうか)"""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        sock.sendall(raw)
+        stream = sock.makefile('rb')
+        responses = [read_response(stream, method) for method in methods]
+        sock.settimeout(2)
+        try:
+            closed = stream.read(1) == b''
+        except socket.timeout:
+            closed = False
+    return responses, closed
+
+
+def request(method, path, headers=None, body=b''):
+    """HTTP/1.1 のリクエストを組み立てる"""
+    lines = [f'{method} {path} HTTP/1.1', 'Host: 127.0.0.1']
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    if body:
+        lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1') + body
+
+
+def submission(i, text='非同期エンジンでの意味づけです'):
+    return {
+        'user_id_hash': f'anon_async_{i}',
+        'timestamp': '2025-09-21T10:30:00Z',
+        'consent': True,
+        'mode': 'solo',
+        'event_tag': 'work_late',
+        'meaning_text': f'{text}{i}',
+        'rt_ms': 2000,
+    }
+
+
+def test_request_limits():
+    """リクエスト行・ヘッダー・ボディの上限を超えたら対応するエラーを返して切断するか"""
+    print("=== リクエストの上限テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        process = start_server(workdir, port, '--engine', 'asyncio')
+        try:
+            cases = [
+                ('長すぎるリクエスト行', 414,
+                 request('GET', '/health?' + 'a' * 9000)),
+                ('多すぎるヘッダー', 431,
+                 request('GET', '/health', {f'X-Test-{i}': 'x' for i in range(101)})),
+                ('長すぎるヘッダー行', 431,
+                 request('GET', '/health', {'X-Test': 'x' * 70000})),
+                ('chunked', 411,
+                 request('POST', '/submit', {'Transfer-Encoding': 'chunked'}) + b'0\r\n\r\n'),
+                ('大きすぎるボディ', 413,
+                 request('POST', '/submit', {'Content-Length': MAX_BODY_BYTES + 1})),
+                ('不正な Content-Length', 400,
+                 request('POST', '/submit', {'Content-Length': 'abc'})),
+                ('不正なリクエスト行', 400, b'GARBAGE\r\n\r\n'),
+            ]
+            for label, expected, raw in cases:
+                (response,), closed = exchange(port, raw)
+                if response is None or response[0] != expected or not closed:
+                    failures.append(f"{label}: {response and response[0]}{'' if closed else '(切断されない)'}")
+                elif response[1].get('content-length') != str(len(response[2])):
+                    failures.append(f'{label}: Content-Length')
+
+            # 上限件数のバッチは(1件が大きくても)ボディの上限に収まる
+            text = '長い意味づけ' * 2000
+            batch = json.dumps([submission(i, text) for i in range(SUBMIT_BATCH_MAX_ITEMS)],
+                               ensure_ascii=False).encode('utf-8')
+            (response,), _ = exchange(port, request('POST', '/submit/batch', {
+                'Content-Type': 'application/json', 'Connection': 'close'}, batch))
+            result = json.loads(response[2]) if response and response[0] == 200 else {}
+            if len(batch) <= 1024 * 1024 or result.get('inserted') != SUBMIT_BATCH_MAX_ITEMS:
+                failures.append(f'{len(batch)}バイトの{SUBMIT_BATCH_MAX_ITEMS}件のバッチ: '
+                                f'{response and response[0]}')
+        finally:
+            stop_server(process)
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 414 / 431 / 411 / 413 / 400 を返して切断、{SUBMIT_BATCH_MAX_ITEMS}件のバッチは受け付ける")
+    return True
+
+
+def test_keep_alive_and_pipelining():
+    """1接続で複数のリクエストを処理し、パイプラインの応答を順番どおりに返すか"""
+    print("\n=== keep-alive・パイプラインテスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        process = start_server(workdir, port, '--engine', 'asyncio')
+        try:
+            # 3つのリクエストを1回で送る(最後は Connection: close)
+            raw = (request('GET', '/health') + request('GET', '/missing')
+                   + request('GET', '/fetch', {'Connection': 'close'}))
+            responses, closed = exchange(port, raw, ('GET', 'GET', 'GET'))
+            statuses = [response and response[0] for response in responses]
+            if statuses != [200, 404, 400] or not closed:
+                failures.append(f'パイプライン {statuses} 切断={closed}')
+            elif responses[0][1].get('connection') != 'keep-alive' or responses[2][1].get('connection') != 'close':
+                failures.append('Connection ヘッダー')
+
+            # HTTP/1.1 は既定で接続を維持する
+            (response,), closed = exchange(port, request('GET', '/health'))
+            if response[0] != 200 or closed or 'timeout=' not in response[1].get('keep-alive', ''):
+                failures.append('HTTP/1.1 の既定の keep-alive')
+            # HTTP/1.0 は Connection: keep-alive が無ければ閉じる
+            (response,), closed = exchange(port, b'GET /health HTTP/1.0\r\n\r\n')
+            if response[0] != 200 or not closed:
+                failures.append('HTTP/1.0 は1リクエストで切断')
+            (response,), closed = exchange(port, b'GET /health HTTP/1.0\r\nConnection: keep-alive\r\n\r\n')
+            if response[0] != 200 or closed:
+                failures.append('HTTP/1.0 の Connection: keep-alive')
+        finally:
+            stop_server(process)
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ パイプラインの3件を順に返し、Connection に従って接続を維持・切断")
+    return True
+
+
+def test_head():
+    """HEAD は GET と同じヘッダー(Content-Length を含む)でボディを返さないか"""
+    print("\n=== HEAD テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        process = start_server(workdir, port, '--engine', 'asyncio')
+        try:
+            for path in ('/health', '/', '/fetch?event_tag=work_late'):
+                # HEAD の直後の GET の応答がずれずに読めれば、HEAD はボディを送っていない
+                raw = request('HEAD', path) + request('GET', path, {'Connection': 'close'})
+                (head, get), closed = exchange(port, raw, ('HEAD', 'GET'))
+                if head is None or get is None or head[0] != get[0] or head[2] != b'':
+                    failures.append(f'{path}: {head and head[0]} / {get and get[0]}')
+                elif head[1].get('content-length') != get[1].get('content-length'):
+                    failures.append(f'{path}: Content-Length が GET と異なる')
+                elif not closed:
+                    failures.append(f'{path}: HEAD のボディが送られている')
+        finally:
+            stop_server(process)
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ HEAD は GET と同じ Content-Length でボディなし")
+    return True
+
+
+# 両エンジンで比較するリクエスト(メソッド, パス, ヘッダー, ボディ)
+PARITY_REQUESTS = [
+    ('GET', '/health', {}, b''),
+    ('GET', '/', {'User-Agent': 'curl/8.0'}, b''),
+    ('GET', '/', {'Accept-Encoding': 'gzip'}, b''),
+    ('GET', '/research_dashboard', {}, b''),
+    ('GET', '/missing', {}, b''),
+    ('GET', '/fetch', {}, b''),
+    ('GET', '/fetch?event_tag=work_late', {}, b''),
+    ('GET', '/research?type=bogus', {}, b''),
+    ('GET', '/research?type=diversity&distance=bogus', {}, b''),
+    ('OPTIONS', '/submit', {'Origin': 'http://localhost:8000'}, b''),
+    ('POST', '/submit', {}, b'{not json'),
+    ('POST', '/submit', {}, json.dumps({'consent': True}).encode('utf-8')),
+    ('POST', '/submit', {}, json.dumps(submission(1)).encode('utf-8')),
+    ('POST', '/submit', {'Content-Length': MAX_BODY_BYTES + 1}, b''),
+    ('POST', '/submit/batch', {}, b'[]'),
+    ('POST', '/submit/batch', {}, b'\n'.join(
+        json.dumps(submission(i)).encode('utf-8') for i in (2, 2, 3)) + b'\n{bad'),
+    ('POST', '/update_saw_alt_meanings', {}, json.dumps({'record_id': 'rec_missing'}).encode('utf-8')),
+    ('POST', '/missing', {}, b'{}'),
+]
+# 比較するヘッダー
+PARITY_HEADERS = ('content-type', 'content-encoding', 'etag', 'access-control-allow-origin', 'vary')
+# 実行毎に変わる値
+VOLATILE_KEYS = ('timestamp', 'record_id', 'generated_at')
+
+
+def normalize_json(value):
+    if isinstance(value, dict):
+        return {key: '*' if key in VOLATILE_KEYS else normalize_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize_json(item) for item in value]
+    return value
+
+
+def summarize(response):
+    """比較用に、ステータス・主なヘッダー・(JSON なら実行毎に変わる値を除いた)ボディにする"""
+    status, headers, body = response
+    summary = {'status': status}
+    summary.update({name: headers.get(name) for name in PARITY_HEADERS})
+    if headers.get('content-type', '').startswith('application/json'):
+        summary['body'] = normalize_json(json.loads(body))
+    elif headers.get('content-type', '').startswith('text/html') and status >= 400:
+        # エラーページはメッセージまで同じ
+        summary['body'] = body
+    else:
+        summary['body_length'] = len(body)
+    return summary
+
+
+def test_route_parity():
+    """同じリクエストに http.server エンジンと同じステータス・ヘッダー・ボディを返すか"""
+    print("\n=== http.server エンジンとの一致テスト ===")
+    summaries = {}
+    for engine in ('http.server', 'asyncio'):
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(workdir, port, '--engine', engine)
+            try:
+                summaries[engine] = []
+                for method, path, headers, body in PARITY_REQUESTS:
+                    headers = dict(headers, Connection='close')
+                    (response,), _ = exchange(port, request(method, path, headers, body))
+                    summaries[engine].append(summarize(response) if response else None)
+            finally:
+                stop_server(process)
+
+    mismatches = [
+        f'{method} {path}: {legacy} != {actual}'
+        for (method, path, _, _), legacy, actual in zip(
+            PARITY_REQUESTS, summaries['http.server'], summaries['asyncio'])
+        if legacy != actual
+    ]
+    if mismatches:
+        print(f"❌ {', '.join(mismatches)}")
+        return False
+    print(f"✅ {len(PARITY_REQUESTS)}通りのリクエストで両エンジンの応答が一致")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - asyncio エンジンテスト")
+    print("=" * 50)
+
+    results = [
+        ("リクエストの上限", test_request_limits()),
+        ("keep-alive・パイプライン", test_keep_alive_and_pipelining()),
+        ("HEAD", test_head()),
+        ("http.server との一致", test_route_parity()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 接続プールテスト
+ConnectionPool の接続数の上限・空き待ちのタイムアウト・統計カウンタと、
+ストレージプロファイル(legacy / durable / throughput)の PRAGMA の適用を一時DBで確認します
+
+    python dev_tools/test_db_pool.py
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from db_pool import (
+    STORAGE_PROFILES, ConnectionPool, PoolTimeout, close_all_pools, get_pool, read_storage_settings
+)
+
+
+def test_size_limit():
+    """size 本を超えて接続を作らず、返却された接続を使い回すか"""
+    print("=== 接続数の上限テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = ConnectionPool(os.path.join(workdir, 'pool.db'), size=3, timeout=5)
+        try:
+            held = [pool.acquire() for _ in range(3)]
+            if len({id(conn) for conn in held}) != 3 or pool.stats()['open'] != 3:
+                failures.append('size 本までは新しい接続')
+
+            # 上限に達したら返却を待ち、返却された接続を受け取る
+            acquired = {}
+            waiter = threading.Thread(target=lambda: acquired.setdefault('conn', pool.acquire()))
+            waiter.start()
+            time.sleep(0.2)
+            if 'conn' in acquired:
+                failures.append('上限に達しても待たずに取得した')
+            pool.release(held[0])
+            waiter.join(5)
+            if acquired.get('conn') is not held[0]:
+                failures.append('返却された接続を待っていた側が受け取る')
+            held[0] = acquired.get('conn')
+
+            for conn in held:
+                pool.release(conn)
+            stats = pool.stats()
+            if (stats['open'], stats['idle'], stats['in_use'], stats['created']) != (3, 3, 0, 3):
+                failures.append(f'返却後の統計 {stats}')
+
+            with pool.connection() as conn:
+                if conn not in held:
+                    failures.append('空き接続を使い回す')
+        finally:
+            pool.close()
+        if pool.stats()['open'] != 0:
+            failures.append('close で空き接続を閉じる')
+        try:
+            pool.acquire()
+            failures.append('close 後の acquire は PoolTimeout')
+        except PoolTimeout:
+            pass
+        try:
+            ConnectionPool(os.path.join(workdir, 'pool.db'), size=0)
+            failures.append('size=0 は ValueError')
+        except ValueError:
+            pass
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 上限3本で待ち合わせ、返却した接続を使い回す")
+    return True
+
+
+def test_checkout_timeout():
+    """空きが無いまま timeout 秒経ったら PoolTimeout になるか"""
+    print("\n=== 取得待ちのタイムアウトテスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = ConnectionPool(os.path.join(workdir, 'pool.db'), size=1, timeout=0.2)
+        try:
+            conn = pool.acquire()
+            started = time.monotonic()
+            try:
+                pool.acquire()
+                failures.append('空きが無ければ PoolTimeout')
+            except PoolTimeout:
+                elapsed = time.monotonic() - started
+                if not 0.15 <= elapsed < 2:
+                    failures.append(f'timeout 秒だけ待つ({elapsed:.2f}秒)')
+            pool.release(conn)
+            stats = pool.stats()
+            if (stats['waits'], stats['timeouts'], stats['acquired']) != (1, 1, 1):
+                failures.append(f'統計 {stats}')
+        finally:
+            pool.close()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ timeout 秒で PoolTimeout、待ち・タイムアウトを集計")
+    return True
+
+
+def test_broken_connections():
+    """未確定のトランザクションを巻き戻し、壊れた接続は破棄して作り直すか"""
+    print("\n=== 返却時の後始末テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = ConnectionPool(os.path.join(workdir, 'pool.db'), size=2, timeout=5)
+        try:
+            with pool.connection() as conn:
+                conn.execute('CREATE TABLE t (x INTEGER UNIQUE)')
+                conn.commit()
+                conn.execute('INSERT INTO t VALUES (1)')
+            with pool.connection() as conn:
+                if conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] != 0:
+                    failures.append('未確定の INSERT が次の利用者に残っている')
+
+            # 制約違反・ロック待ちでは接続を使い続け、それ以外のDBエラーでは破棄する
+            for error, discarded in ((sqlite3.IntegrityError, 0), (sqlite3.DatabaseError, 1)):
+                try:
+                    with pool.connection():
+                        raise error('test')
+                except error:
+                    pass
+                if pool.stats()['discarded'] != discarded:
+                    failures.append(f'{error.__name__} 後の破棄数')
+            with pool.connection() as conn:
+                conn.execute('SELECT 1')
+            stats = pool.stats()
+            if stats['errors'] != 2 or stats['created'] != 2 or stats['open'] != 1:
+                failures.append(f'統計 {stats}')
+        finally:
+            pool.close()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 返却時に巻き戻し、壊れた接続だけを作り直す")
+    return True
+
+
+def test_storage_profiles():
+    """各プロファイルの PRAGMA が接続に実際に適用されるか"""
+    print("\n=== ストレージプロファイルテスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, settings in STORAGE_PROFILES.items():
+            pool = ConnectionPool(os.path.join(workdir, f'{name}.db'), size=1, profile=name)
+            try:
+                with pool.connection() as conn:
+                    effective = read_storage_settings(conn)
+                # mmap を使えない環境では mmap_size が 0 のままになる
+                if effective['mmap_size'] == 0:
+                    effective['mmap_size'] = settings['mmap_size']
+                if effective != settings:
+                    failures.append(f'{name}: {effective}')
+                report = pool.storage_report()
+                if report['profile'] != name or report['configured'] != settings:
+                    failures.append(f'{name} の storage_report')
+            finally:
+                pool.close()
+        try:
+            ConnectionPool(os.path.join(workdir, 'bogus.db'), profile='bogus')
+            failures.append('未知のプロファイルは ValueError')
+        except ValueError:
+            pass
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ {', '.join(STORAGE_PROFILES)} の PRAGMA が適用された")
+    return True
+
+
+def test_shared_pools():
+    """get_pool が同じDBファイルには同じプールを返し、close_all_pools で作り直すか"""
+    print("\n=== 共有プールテスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'shared.db')
+        try:
+            pool = get_pool(path, size=2, profile='legacy')
+            if get_pool(os.path.join(workdir, '.', 'shared.db'), size=5) is not pool or pool.size != 2:
+                failures.append('同じファイルには最初に作ったプール')
+            close_all_pools()
+            if get_pool(path) is pool:
+                failures.append('close_all_pools 後は新しいプール')
+        finally:
+            close_all_pools()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ DBファイル毎に1つのプールを共有")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - 接続プールテスト")
+    print("=" * 50)
+
+    results = [
+        ("接続数の上限", test_size_limit()),
+        ("取得待ちのタイムアウト", test_checkout_timeout()),
+        ("返却時の後始末", test_broken_connections()),
+        ("ストレージプロファイル", test_storage_profiles()),
+        ("共有プール", test_shared_pools()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 重複投稿検出テスト
+DuplicateWindow の判定(重複 / 重複なし / SQLite で確認)と、DatabaseManager の
+check_duplicate が一時DBで正しく判定すること、一括インポートが timestamp の順序を
+検査することを確認します
+
+    python dev_tools/test_dedup.py
+"""
+
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from dedup import DuplicateWindow, content_hash
+
+
+def test_content_hash():
+    """正規化(NFKC・大文字小文字・空白)後に同じ意味づけは同じハッシュになるか"""
+    print("=== content_hash テスト ===")
+    base = content_hash('anon_a', 'work_late', 'Ｔｉｒｅｄ  but OK')
+    same = [
+        content_hash('anon_a', 'work_late', 'tired but ok'),
+        content_hash('anon_a', 'work_late', '  TIRED\tbut\nOK '),
+    ]
+    different = [
+        content_hash('anon_b', 'work_late', 'tired but ok'),
+        content_hash('anon_a', 'rainy_day', 'tired but ok'),
+        content_hash('anon_a', 'work_late', 'tired but fine'),
+    ]
+    if any(h != base for h in same):
+        print("❌ 正規化後に同じ意味づけのハッシュが異なります")
+        return False
+    if any(h == base for h in different):
+        print("❌ ユーザー・出来事・意味づけが違うのにハッシュが一致します")
+        return False
+    print("✅ 正規化して同じものだけが一致")
+    return True
+
+
+def test_window_lookup():
+    """ヒット・期限切れ・authoritative の有無による判定"""
+    print("\n=== DuplicateWindow 判定テスト ===")
+    failures = []
+
+    window = DuplicateWindow(window=100, max_entries=10, authoritative=True)
+    window.load([('a', 10.0)], complete_since=0.0)
+    if window.lookup('a', 50.0) is not True:
+        failures.append('窓内の同じハッシュは重複')
+    if window.lookup('b', 100.0) is not False:
+        failures.append('authoritative で全期間が揃っていれば重複なし')
+    if window.lookup('b', 50.0) is not None:
+        failures.append('揃っている期間が窓より短ければ SQLite で確認')
+    if window.lookup('a', 110.0) is not False:
+        failures.append('期限切れのハッシュは重複なし')
+
+    shared = DuplicateWindow(window=100, max_entries=10, authoritative=False)
+    shared.load([('a', 10.0)], complete_since=0.0)
+    if shared.lookup('a', 50.0) is not True:
+        failures.append('非 authoritative でもヒットは重複')
+    if shared.lookup('b', 200.0) is not None:
+        failures.append('非 authoritative の未ヒットは SQLite で確認')
+
+    stats = window.stats()
+    if (stats['hits'], stats['misses'], stats['fallbacks']) != (1, 2, 1):
+        failures.append(f"統計カウンタ {stats}")
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 重複 / 重複なし / SQLite で確認 を正しく返す")
+    return True
+
+
+def test_window_eviction():
+    """max_entries を超えて押し出したら、その時刻までは判定を SQLite に任せるか"""
+    print("\n=== DuplicateWindow 上限テスト ===")
+    window = DuplicateWindow(window=100, max_entries=3, authoritative=True)
+    window.load([], complete_since=0.0)
+    for i in range(5):
+        window.add(f'h{i}', 10.0 + i)
+    stats = window.stats()
+    failures = []
+    if stats['entries'] != 3 or stats['evictions'] != 2:
+        failures.append(f"entries={stats['entries']}, evictions={stats['evictions']}")
+    if window.lookup('h0', 50.0) is not None:
+        failures.append('押し出したハッシュは SQLite で確認')
+    if window.lookup('h4', 50.0) is not True:
+        failures.append('残っているハッシュは重複')
+    if window.lookup('h0', 111.5) is not False:
+        failures.append('押し出した時刻が窓の外に出れば重複なし')
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 押し出した期間だけ SQLite に任せる")
+    return True
+
+
+def test_check_duplicate():
+    """DatabaseManager.check_duplicate が挿入済みの記録を重複と判定するか"""
+    print("\n=== check_duplicate テスト ===")
+    from server import DatabaseManager
+    from db_pool import close_all_pools
+    from write_queue import close_all_writers
+
+    data = {
+        'user_id_hash': 'anon_dedup',
+        'timestamp': '2025-09-21T10:30:00Z',
+        'consent': True,
+        'mode': 'solo',
+        'event_tag': 'work_late',
+        'meaning_text': '残業のおかげで集中できた',
+        'rt_ms': 2000,
+    }
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        try:
+            db = DatabaseManager(db_path)
+            if db.check_duplicate(data['user_id_hash'], data['event_tag'], data['meaning_text']):
+                failures.append('挿入前は重複なし')
+            db.insert_record(data)
+            if not db.check_duplicate(data['user_id_hash'], data['event_tag'], ' 残業のおかげで集中できた\n'):
+                failures.append('挿入後は重複(前後の空白違い)')
+            if db.check_duplicate('anon_other', data['event_tag'], data['meaning_text']):
+                failures.append('別ユーザーは重複なし')
+
+            # 別プロセス相当: 起動後に他から書き込まれた記録は SQLite で見つける
+            other = DatabaseManager(db_path)
+            other.dedup.load([], complete_since=None)
+            if not other.check_duplicate(data['user_id_hash'], data['event_tag'], data['meaning_text']):
+                failures.append('ウィンドウに無い記録も SQLite で重複と判定')
+            elif other.dedup.stats()['fallbacks'] != 1:
+                failures.append('SQLite での確認が行われていない')
+            # 起動時にDBから読み込んだウィンドウだけで判定できる
+            fresh = DatabaseManager(db_path)
+            if not fresh.check_duplicate(data['user_id_hash'], data['event_tag'], data['meaning_text']):
+                failures.append('起動時に読み込んだウィンドウで重複と判定')
+            elif fresh.dedup.stats()['hits'] != 1:
+                failures.append('起動時のウィンドウ読み込みでヒットしていない')
+        finally:
+            close_all_writers()
+            close_all_pools()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 挿入済み・他プロセス書き込み・起動時読み込みのいずれも重複と判定")
+    return True
+
+
+def write_import_file(workdir, name, timestamps, fmt='ndjson'):
+    """同じ意味づけを timestamps の時刻で並べた取り込み用ファイルを作る"""
+    path = os.path.join(workdir, name)
+    records = [{
+        'user_id_hash': 'anon_import',
+        'timestamp': timestamp,
+        'consent': True,
+        'mode': 'solo',
+        'event_tag': 'work_late',
+        'meaning_text': '取り込んだ意味づけ',
+        'rt_ms': 2000,
+    } for timestamp in timestamps]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'ndjson':
+            f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        else:
+            # エクスポートと同じく user_id_hash 列の無い CSV
+            writer = csv.DictWriter(f, fieldnames=[key for key in records[0] if key != 'user_id_hash'])
+            writer.writeheader()
+            writer.writerows({key: value for key, value in record.items() if key != 'user_id_hash'}
+                             for record in records)
+    return path
+
+
+def run_import(*argv):
+    """import_records.main を実行し、(終了コード, 統計, 標準エラー出力) を返す"""
+    from import_records import main
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        exit_code = main(['--quiet', *argv])
+    stats = json.loads(stdout.getvalue()) if stdout.getvalue() else None
+    return exit_code, stats, stderr.getvalue()
+
+
+def test_import_order():
+    """一括インポートが timestamp の昇順で重複を判定し、時刻を遡る入力で中止するか"""
+    print("\n=== 取り込みの timestamp 順テスト ===")
+    from db_pool import close_all_pools
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        try:
+            # 同じ時刻は遡りではない。ウィンドウ内の2件目・3件目が重複
+            ordered = write_import_file(workdir, 'ordered.ndjson', [
+                '2025-09-21T10:00:00Z', '2025-09-21T10:00:00Z', '2025-09-21T10:01:00Z',
+            ])
+            exit_code, stats, _ = run_import(ordered, '--db', db_path)
+            if exit_code != 0 or (stats['inserted'], stats['duplicates']) != (3, 2):
+                failures.append(f'昇順の入力 {stats}')
+
+            unordered = write_import_file(workdir, 'unordered.ndjson', [
+                '2025-09-22T10:00:00Z', '2025-09-22T12:00:00Z', '2025-09-22T11:00:00Z',
+            ])
+            exit_code, stats, error = run_import(unordered, '--db', db_path)
+            if exit_code != 1 or stats is not None:
+                failures.append(f'時刻を遡る入力は中止(終了コード {exit_code})')
+            elif '3 件目' not in error or '2025-09-22T11:00:00Z' not in error:
+                failures.append(f'エラーに行と timestamp を示す: {error!r}')
+
+            # user_id_hash の無い CSV は保存時の判定を引き継ぐので順序を問わない
+            exported = write_import_file(workdir, 'exported.csv', [
+                '2025-09-23T12:00:00Z', '2025-09-23T10:00:00Z',
+            ], fmt='csv')
+            exit_code, stats, _ = run_import(exported, '--db', db_path)
+            if exit_code != 0 or stats['inserted'] != 2:
+                failures.append(f'user_id_hash の無い CSV {stats}')
+        finally:
+            close_all_pools()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 昇順の入力で重複を判定し、時刻を遡る入力はその行で中止")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - 重複投稿検出テスト")
+    print("=" * 50)
+
+    results = [
+        ("content_hash", test_content_hash()),
+        ("ウィンドウ判定", test_window_lookup()),
+        ("ウィンドウ上限", test_window_eviction()),
+        ("check_duplicate", test_check_duplicate()),
+        ("取り込みの順序", test_import_order()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - http.server エンジンテスト
+並行処理モード(thread / pool / single)で同時に届いたリクエストを正しく処理すること、
+応答の途中で止まった接続が他のクライアントを待たせないこと、不正なモードを拒否すること、
+全ての応答がステータス行1つと Content-Length を持つこと、アイドル接続を閉じることを確認します
+
+    python dev_tools/test_http_server.py
+"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from server import (
+    CONCURRENCY_MODES, MAX_BODY_BYTES, MeaningDiversityServer, SingleConnectionServer,
+    WorkerPoolHTTPServer, create_http_server
+)
+
+EVENT_TAG = 'work_late'
+CLIENTS = 8
+REQUESTS_PER_CLIENT = 6
+# レート制限(1分間に30件)に掛からない件数だけ投稿する
+POSTS_PER_CLIENT = 2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, port, *args, env=None):
+    """workdir をカレントディレクトリにしてサーバーを起動し、応答するまで待つ(env: 追加の環境変数)"""
+    shutil.copy(os.path.join(ROOT, 'index.html'), workdir)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), str(port), '127.0.0.1', *args],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env=dict(os.environ, **env) if env else None,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=10).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('サーバーが起動しませんでした')
+
+
+def stop_server(process):
+    process.terminate()
+    process.wait(10)
+
+
+def submission(client, i):
+    return {
+        'user_id_hash': f'anon_http_{client}_{i}',
+        'timestamp': '2025-09-21T10:30:00Z',
+        'consent': True,
+        'mode': 'solo',
+        'event_tag': EVENT_TAG,
+        'meaning_text': f'同時に送った意味づけ{client}-{i}',
+        'rt_ms': 2000,
+    }
+
+
+def run_client(port, client, errors):
+    """GET(テキスト・HTML・JSON)と投稿を順に送り、想定外の応答を errors に記録する"""
+    base = f'http://127.0.0.1:{port}'
+    try:
+        for i in range(REQUESTS_PER_CLIENT):
+            with urllib.request.urlopen(f'{base}/health', timeout=20) as response:
+                if response.status != 200 or response.read() != b'OK':
+                    errors.append(f'{client}: /health')
+            with urllib.request.urlopen(f'{base}/', timeout=20) as response:
+                if response.status != 200 or b'<html' not in response.read().lower():
+                    errors.append(f'{client}: /')
+            with urllib.request.urlopen(f'{base}/fetch?event_tag={EVENT_TAG}', timeout=20) as response:
+                if 'total_count' not in json.loads(response.read()):
+                    errors.append(f'{client}: /fetch')
+            if i < POSTS_PER_CLIENT:
+                req = urllib.request.Request(
+                    f'{base}/submit', data=json.dumps(submission(client, i)).encode('utf-8'),
+                    headers={'Content-Type': 'application/json'}, method='POST')
+                with urllib.request.urlopen(req, timeout=20) as response:
+                    if not json.loads(response.read()).get('success'):
+                        errors.append(f'{client}: /submit')
+    except Exception as e:
+        errors.append(f'{client}: {e!r}')
+
+
+def test_concurrent_requests():
+    """各モードで複数のクライアントから同時に送ったリクエストが全て正しく返るか"""
+    print("=== 同時リクエストテスト ===")
+    success = True
+    for mode in CONCURRENCY_MODES:
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(workdir, port, '--concurrency', mode, '--pool-size', '4')
+            try:
+                errors = []
+                clients = [threading.Thread(target=run_client, args=(port, client, errors))
+                           for client in range(CLIENTS)]
+                for client in clients:
+                    client.start()
+                for client in clients:
+                    client.join(120)
+                with urllib.request.urlopen(
+                        f'http://127.0.0.1:{port}/fetch?event_tag={EVENT_TAG}', timeout=20) as response:
+                    total_count = json.loads(response.read())['total_count']
+            finally:
+                stop_server(process)
+        expected = CLIENTS * POSTS_PER_CLIENT
+        if errors or total_count != expected:
+            print(f"❌ {mode}: エラー {len(errors)}件 {errors[:3]}, total_count={total_count}(期待値 {expected})")
+            success = False
+        else:
+            print(f"✅ {mode}: {CLIENTS}クライアント×{REQUESTS_PER_CLIENT * 3 + POSTS_PER_CLIENT}件を処理、"
+                  f"投稿 {total_count}件")
+    return success
+
+
+def test_stalled_connection():
+    """thread / pool モードでは、リクエストの途中で止まった接続があっても他の接続を処理するか"""
+    print("\n=== 途中で止まった接続テスト ===")
+    success = True
+    for mode in ('thread', 'pool'):
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(workdir, port, '--concurrency', mode, '--pool-size', '2')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=10) as stalled:
+                    stalled.sendall(b'GET /health HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+                    time.sleep(0.2)
+                    started = time.monotonic()
+                    with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=5) as response:
+                        served = response.status == 200
+                    elapsed = time.monotonic() - started
+            except OSError as e:
+                served, elapsed = False, repr(e)
+            finally:
+                stop_server(process)
+        if not served:
+            print(f"❌ {mode}: 止まった接続に待たされた({elapsed})")
+            success = False
+        else:
+            print(f"✅ {mode}: 止まった接続があっても {elapsed:.3f}秒で応答")
+    return success
+
+
+def test_server_classes():
+    """モード毎のサーバー・ハンドラーの組み合わせと、不正なモード・プールサイズの拒否"""
+    print("\n=== モードの選択テスト ===")
+    failures = []
+    expected = {
+        'thread': (ThreadingHTTPServer, MeaningDiversityServer, 'HTTP/1.1'),
+        'pool': (WorkerPoolHTTPServer, SingleConnectionServer, 'HTTP/1.0'),
+        'single': (HTTPServer, SingleConnectionServer, 'HTTP/1.0'),
+    }
+    for mode, (server_class, handler_class, protocol) in expected.items():
+        httpd = create_http_server(('127.0.0.1', 0), mode, pool_size=3)
+        try:
+            if type(httpd) is not server_class or httpd.RequestHandlerClass is not handler_class:
+                failures.append(f'{mode}: {type(httpd).__name__} / {httpd.RequestHandlerClass.__name__}')
+            elif httpd.RequestHandlerClass.protocol_version != protocol:
+                failures.append(f'{mode}: {httpd.RequestHandlerClass.protocol_version}')
+            elif mode == 'pool' and httpd.pool_size != 3:
+                failures.append('pool: pool_size')
+        finally:
+            httpd.server_close()
+
+    for mode, pool_size in (('bogus', 8), ('pool', 0)):
+        try:
+            create_http_server(('127.0.0.1', 0), mode, pool_size=pool_size).server_close()
+            failures.append(f'{mode} (pool_size={pool_size}) は ValueError')
+        except ValueError:
+            pass
+
+    # コマンドラインでも不正なモードは起動前に拒否する
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'server.py'), str(free_port()), '127.0.0.1',
+         '--concurrency', 'bogus'],
+        capture_output=True, text=True, timeout=30,
+    )
+    if result.returncode != 2 or 'invalid choice' not in result.stderr:
+        failures.append(f'--concurrency bogus の終了コード {result.returncode}')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ モード毎のサーバー・ハンドラーを生成し、不正なモードを拒否")
+    return True
+
+
+# エンジン・モード毎の起動オプション
+SERVER_VARIANTS = {
+    'thread': ('--concurrency', 'thread'),
+    'pool': ('--concurrency', 'pool'),
+    'asyncio': ('--engine', 'asyncio'),
+}
+
+
+def raw_request(method, path, headers=None, body=b''):
+    lines = [f'{method} {path} HTTP/1.1', 'Host: 127.0.0.1']
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    if body:
+        lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1') + body
+
+
+def split_response(data):
+    """受信したバイト列を (ステータス, ヘッダー, ボディ, 残り) に分ける"""
+    head, _, rest = data.partition(b'\r\n\r\n')
+    lines = head.decode('iso-8859-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers.setdefault(name.strip().lower(), []).append(value.strip())
+    status = int(lines[0].split()[1]) if lines[0].startswith('HTTP/') else None
+    return status, headers, rest
+
+
+def receive_all(port, raw):
+    """raw を送り、サーバーが接続を閉じるまでに受信した全てのバイト列を返す"""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        sock.sendall(raw)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def framing_requests(etag):
+    """成功・エラー・304・プリフライトなど、応答の経路が異なるリクエスト"""
+    submission_body = json.dumps(submission('framing', 0)).encode('utf-8')
+    return [
+        ('GET /health', raw_request('GET', '/health')),
+        ('GET /', raw_request('GET', '/', {'Accept-Encoding': 'gzip'})),
+        ('GET / (304)', raw_request('GET', '/', {'Accept-Encoding': 'gzip', 'If-None-Match': etag})),
+        ('GET /missing', raw_request('GET', '/missing')),
+        ('GET /fetch', raw_request('GET', '/fetch')),
+        ('GET /fetch?event_tag', raw_request('GET', f'/fetch?event_tag={EVENT_TAG}')),
+        ('GET /research?type=bogus', raw_request('GET', '/research?type=bogus')),
+        ('GET /diagnostics', raw_request('GET', '/diagnostics')),
+        ('OPTIONS /submit', raw_request('OPTIONS', '/submit')),
+        ('POST /submit', raw_request('POST', '/submit', body=submission_body)),
+        ('POST /submit (JSON エラー)', raw_request('POST', '/submit', body=b'{bad')),
+        ('POST /submit (検証エラー)', raw_request('POST', '/submit', body=b'{"consent": true}')),
+        ('POST /submit (413)', raw_request('POST', '/submit', {'Content-Length': MAX_BODY_BYTES + 1})),
+        ('POST /submit/batch (400)', raw_request('POST', '/submit/batch', body=b'[]')),
+        ('POST /missing', raw_request('POST', '/missing', body=b'{}')),
+    ]
+
+
+def test_response_framing():
+    """全ての経路でステータス行が1つだけで、Content-Length とボディの長さが一致するか"""
+    print("\n=== 応答のステータス行・Content-Length テスト ===")
+    success = True
+    for variant, args in SERVER_VARIANTS.items():
+        failures = []
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(workdir, port, *args)
+            try:
+                with urllib.request.urlopen(urllib.request.Request(
+                        f'http://127.0.0.1:{port}/', headers={'Accept-Encoding': 'gzip'}), timeout=10) as response:
+                    etag = response.headers['ETag']
+                requests = framing_requests(etag)
+                for label, raw in requests:
+                    # 1接続1リクエストにして、閉じるまでに届いたバイト列が応答1つ分ちょうどか確かめる
+                    raw = raw.replace(b'\r\n\r\n', b'\r\nConnection: close\r\n\r\n', 1)
+                    data = receive_all(port, raw)
+                    status, headers, rest = split_response(data)
+                    lengths = headers.get('content-length', [])
+                    expected_body = 0 if status == 304 else int(lengths[0]) if len(lengths) == 1 else None
+                    if status is None or data.count(b'HTTP/1.') != 1:
+                        failures.append(f'{label}: ステータス行 {data.count(b"HTTP/1.")}個')
+                    elif len(lengths) != 1:
+                        failures.append(f'{label}: Content-Length {lengths}')
+                    elif len(rest) != expected_body:
+                        failures.append(f'{label}: ボディ {len(rest)}バイト / Content-Length {lengths[0]}')
+                    elif status == 304 and lengths[0] == '0':
+                        failures.append(f'{label}: 304 の Content-Length が 0')
+
+                # keep-alive の接続で続けて送っても応答の区切りがずれない
+                if variant != 'pool':
+                    pipelined = [raw for label, raw in requests
+                                 if label in ('GET /health', 'GET /', 'GET / (304)', 'GET /fetch?event_tag',
+                                              'OPTIONS /submit')]
+                    data = receive_all(port, b''.join(pipelined) + raw_request(
+                        'GET', '/health', {'Connection': 'close'}))
+                    statuses = []
+                    while data:
+                        status, headers, rest = split_response(data)
+                        length = 0 if status == 304 else int(headers.get('content-length', ['0'])[0])
+                        statuses.append(status)
+                        data = rest[length:]
+                    if statuses != [200, 200, 304, 200, 200, 200]:
+                        failures.append(f'keep-alive で続けた応答 {statuses}')
+            finally:
+                stop_server(process)
+        if failures:
+            print(f"❌ {variant}: {', '.join(failures)}")
+            success = False
+        else:
+            print(f"✅ {variant}: {len(requests)}通りの応答が全てステータス行1つ・正しい Content-Length")
+    return success
+
+
+def test_keepalive_timeout():
+    """アイドル状態が KEEPALIVE_TIMEOUT 秒続いた接続をサーバーが閉じるか"""
+    print("\n=== keep-alive のタイムアウトテスト ===")
+    success = True
+    timeout = 1
+    for variant in ('thread', 'asyncio'):
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(workdir, port, *SERVER_VARIANTS[variant],
+                                   env={'KEEPALIVE_TIMEOUT': str(timeout)})
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+                    stream = sock.makefile('rb')
+                    results = []
+                    for pause in (0, timeout / 2):
+                        # タイムアウト前なら同じ接続で次のリクエストを送れる
+                        time.sleep(pause)
+                        sock.sendall(raw_request('GET', '/health'))
+                        results.append(stream.readline().split()[1:2] == [b'200'])
+                        while stream.readline() not in (b'\r\n', b''):
+                            pass
+                        stream.read(2)
+                    started = time.monotonic()
+                    closed = stream.read(1) == b''
+                    elapsed = time.monotonic() - started
+            finally:
+                stop_server(process)
+        if not all(results) or not closed or not timeout * 0.5 <= elapsed < timeout + 3:
+            print(f"❌ {variant}: 応答 {results}, 切断={closed}, {elapsed:.2f}秒")
+            success = False
+        else:
+            print(f"✅ {variant}: アイドル {elapsed:.2f}秒で切断(KEEPALIVE_TIMEOUT={timeout})")
+    return success
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - http.server エンジンテスト")
+    print("=" * 50)
+
+    results = [
+        ("同時リクエスト", test_concurrent_requests()),
+        ("途中で止まった接続", test_stalled_connection()),
+        ("モードの選択", test_server_classes()),
+        ("ステータス行・Content-Length", test_response_framing()),
+        ("keep-alive のタイムアウト", test_keepalive_timeout()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
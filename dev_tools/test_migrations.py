@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - スキーマ移行テスト
+変更前(baseline)のスキーマで作ったDBを現在のサーバーで開き、移行後も
+/fetch などが既存データを返すことを確認します
+
+    python dev_tools/test_migrations.py
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# 変更前の server.py の init_database と同じスキーマ
+BASELINE_DDL = [
+    '''
+    CREATE TABLE IF NOT EXISTS records (
+        id TEXT PRIMARY KEY,
+        user_id_hash TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        consent BOOLEAN NOT NULL,
+        mode TEXT NOT NULL,
+        event_text TEXT,
+        event_tag TEXT NOT NULL,
+        meaning_text TEXT NOT NULL,
+        meaning_tag TEXT,
+        rt_ms INTEGER NOT NULL,
+        saw_alt_meanings BOOLEAN DEFAULT FALSE,
+        changed_after_view BOOLEAN DEFAULT FALSE,
+        quality_flags TEXT,
+        locale TEXT DEFAULT 'ja-JP',
+        original_meaning TEXT,
+        revision_count INTEGER DEFAULT 0
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_event_tag ON records(event_tag)',
+    'CREATE INDEX IF NOT EXISTS idx_timestamp ON records(timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_consent ON records(consent)',
+]
+
+EVENT_TAG = 'work_late'
+GOOD_RECORDS = 30
+
+
+def create_baseline_db(db_path, good=GOOD_RECORDS):
+    """baseline スキーマのDBに品質の良い記録 good 件とスパム・非同意の記録を入れる"""
+    conn = sqlite3.connect(db_path)
+    for statement in BASELINE_DDL:
+        conn.execute(statement)
+    rows = []
+    for i in range(good):
+        # 3件に1件は2つのタグを持つ
+        tags = 'learning,rest' if i % 3 == 0 else 'learning'
+        rows.append((f'rec_good_{i}', f'anon_user_{i}', True, f'移行前の意味づけその{i}です', tags, 2000, '{}'))
+    rows.append(('rec_spam', 'anon_spam', True, 'スパム判定された意味づけです', 'learning', 100, '{"spam": true}'))
+    rows.append(('rec_no_consent', 'anon_nc', False, '同意していない意味づけです', 'learning', 2000, '{}'))
+    conn.executemany('''
+        INSERT INTO records (id, user_id_hash, timestamp, consent, mode, event_tag,
+                             meaning_text, meaning_tag, rt_ms, quality_flags)
+        VALUES (?, ?, '2025-09-21T10:30:00Z', ?, 'social', ?, ?, ?, ?, ?)
+    ''', [(record_id, user, consent, EVENT_TAG, text, tags, rt_ms, flags)
+          for record_id, user, consent, text, tags, rt_ms, flags in rows])
+    conn.commit()
+    conn.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_json(port, path):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=10) as response:
+        return json.loads(response.read())
+
+
+def start_server(workdir, port, *args):
+    """workdir をカレントディレクトリにしてサーバーを起動し、応答するまで待つ"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), str(port), '127.0.0.1', *args],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=10).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('サーバーが起動しませんでした')
+
+
+def test_fetch_after_upgrade():
+    """baseline のDBを移行した直後の /fetch がサンプルを返すか"""
+    print("=== 移行直後の /fetch テスト ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        create_baseline_db(os.path.join(workdir, 'kotoiminiki.db'))
+        port = free_port()
+        process = start_server(workdir, port)
+        try:
+            data = get_json(port, f'/fetch?event_tag={EVENT_TAG}')
+            samples = set(data['samples'])
+        finally:
+            process.terminate()
+            process.wait()
+
+    if data['total_count'] != GOOD_RECORDS:
+        print(f"❌ total_count が {data['total_count']} です(期待値 {GOOD_RECORDS})")
+        return False
+    if not samples:
+        print("❌ samples が空です")
+        return False
+    excluded = {'スパム判定された意味づけです', '同意していない意味づけです'}
+    if samples & excluded:
+        print(f"❌ 品質フィルタで除外すべき記録がサンプルに含まれています: {samples & excluded}")
+        return False
+    print(f"✅ total_count={data['total_count']}, samples={len(samples)}件")
+    return True
+
+
+def test_reservoir_seeded_during_backfill():
+    """バックフィル前(品質フラグ列が NULL)でもリザーバーが作られるか"""
+    print("\n=== バックフィル前のリザーバーテスト ===")
+    from db_pool import get_pool
+    from schema import bootstrap_schema
+    from server import RECORDS_MIGRATIONS
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        create_baseline_db(db_path)
+        pool = get_pool(db_path)
+        bootstrap_schema(pool, 'records', RECORDS_MIGRATIONS)
+        with pool.connection() as conn:
+            pending = conn.execute('SELECT COUNT(*) FROM records WHERE is_spam IS NULL').fetchone()[0]
+            slots = conn.execute(
+                'SELECT COUNT(*) FROM sample_reservoir WHERE event_tag = ?', (EVENT_TAG,)
+            ).fetchone()[0]
+        pool.close()
+
+    if pending == 0:
+        print("❌ バックフィル待ちの記録がありません(テストの前提が崩れています)")
+        return False
+    if slots == 0:
+        print("❌ リザーバーが空です")
+        return False
+    print(f"✅ バックフィル待ち {pending}件の状態でリザーバーに {slots}件")
+    return True
+
+
+def distribution_snapshot(conn):
+    """(出来事ごとの合計, (出来事, タグ)ごとの件数)"""
+    totals = dict(conn.execute('SELECT event_tag, total FROM distribution_totals'))
+    counts = {(event_tag, tag): count for event_tag, tag, count in conn.execute(
+        'SELECT event_tag, tag, count FROM distribution_counts'
+    )}
+    return totals, counts
+
+
+def test_distribution_counters():
+    """移行で分布カウンタが作られ、品質フラグの更新で増減し、再計算と一致するか"""
+    print("\n=== 分布カウンタテスト ===")
+    from db_pool import close_all_pools
+    from schema import apply_migrations
+    from server import DatabaseManager, RECORDS_MIGRATIONS, rebuild_distribution_counts
+    from write_queue import close_all_writers
+
+    rest = len(range(0, GOOD_RECORDS, 3))
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        create_baseline_db(db_path)
+        try:
+            db = DatabaseManager(db_path)
+            with db.pool.connection() as conn:
+                version = apply_migrations(conn, 'records', RECORDS_MIGRATIONS)
+                migrated = distribution_snapshot(conn)
+            if version != len(RECORDS_MIGRATIONS):
+                failures.append(f'スキーマバージョン {version}')
+            expected = ({EVENT_TAG: GOOD_RECORDS},
+                        {(EVENT_TAG, 'learning'): GOOD_RECORDS, (EVENT_TAG, 'rest'): rest})
+            if migrated != expected:
+                failures.append(f'移行直後 {migrated}')
+
+            # rec_good_0 は learning,rest の両方を持つ
+            db.update_quality_flags('rec_good_0', {'spam': True})
+            with db.pool.connection() as conn:
+                flagged = distribution_snapshot(conn)
+            if flagged != ({EVENT_TAG: GOOD_RECORDS - 1},
+                           {(EVENT_TAG, 'learning'): GOOD_RECORDS - 1, (EVENT_TAG, 'rest'): rest - 1}):
+                failures.append(f'スパム判定後 {flagged}')
+
+            db.update_quality_flags('rec_spam', {})
+            db.update_quality_flags('rec_good_0', {})
+            with db.pool.connection() as conn:
+                restored = distribution_snapshot(conn)
+            db.writer.execute(rebuild_distribution_counts)
+            with db.pool.connection() as conn:
+                rebuilt = distribution_snapshot(conn)
+            if restored != rebuilt or restored[0] != {EVENT_TAG: GOOD_RECORDS + 1}:
+                failures.append(f'差分更新 {restored} と再計算 {rebuilt} が一致しない')
+        finally:
+            close_all_writers()
+            close_all_pools()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 移行直後 {GOOD_RECORDS}件、差分更新と再計算が一致")
+    return True
+
+
+def test_quality_backfill():
+    """バックフィルで品質フラグ列が埋まり、列での判定が quality_flags(JSON)の判定と一致するか"""
+    print("\n=== 品質フラグ列のバックフィルテスト ===")
+    from db_pool import close_all_pools, get_pool
+    from quality_flags import (
+        HIGH_QUALITY_CONDITION, PENDING_CONDITION, is_high_quality, quality_flag_values, run_backfill
+    )
+    from schema import bootstrap_schema
+    from server import RECORDS_MIGRATIONS
+    from write_queue import close_all_writers, get_writer
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        create_baseline_db(db_path)
+        # quality_flags が無い・壊れている・複数のフラグを持つ記録
+        conn = sqlite3.connect(db_path)
+        conn.executemany('''
+            INSERT INTO records (id, user_id_hash, timestamp, consent, mode, event_tag,
+                                 meaning_text, rt_ms, quality_flags)
+            VALUES (?, 'anon_extra', '2025-09-21T10:30:00Z', 1, 'solo', ?, ?, 2000, ?)
+        ''', [('rec_null', EVENT_TAG, 'フラグの無い意味づけです', None),
+              ('rec_broken', EVENT_TAG, 'フラグが壊れた意味づけです', '{not json'),
+              ('rec_dup', EVENT_TAG, '重複した短い意味づけです', '{"duplicate": true, "too_short": true}')])
+        conn.commit()
+        conn.close()
+        try:
+            pool = get_pool(db_path)
+            bootstrap_schema(pool, 'records', RECORDS_MIGRATIONS)
+            with pool.connection() as conn:
+                pending = conn.execute(f'SELECT COUNT(*) FROM records WHERE {PENDING_CONDITION}').fetchone()[0]
+            total = run_backfill(get_writer(db_path), chunk_size=7, pause=0)
+            with pool.connection() as conn:
+                remaining = conn.execute(f'SELECT COUNT(*) FROM records WHERE {PENDING_CONDITION}').fetchone()[0]
+                high_quality = {row[0] for row in conn.execute(
+                    f'SELECT id FROM records WHERE {HIGH_QUALITY_CONDITION}'
+                )}
+                rows = conn.execute('''
+                    SELECT id, consent, quality_flags, is_spam, is_duplicate, is_too_short FROM records
+                ''').fetchall()
+        finally:
+            close_all_writers()
+            close_all_pools()
+
+    failures = []
+    if total != pending or remaining != 0:
+        failures.append(f'バックフィル {total}件 / 対象 {pending}件 / 残り {remaining}件')
+    mismatched = [row[0] for row in rows if tuple(row[3:]) != quality_flag_values(row[2])]
+    if mismatched:
+        failures.append(f'列の値が quality_flags と異なる: {mismatched}')
+    judged = {row[0] for row in rows if is_high_quality(row[1], row[2])}
+    if high_quality != judged or len(judged) != GOOD_RECORDS + 2:
+        failures.append(f'列での判定 {len(high_quality)}件 / JSONでの判定 {len(judged)}件')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ {total}件を埋め、品質の良い記録 {len(judged)}件が JSON の判定と一致")
+    return True
+
+
+# 同時起動テスト用: v2 が二重に適用されると migration_runs の行が増える
+COUNTED_MIGRATIONS = [
+    ['CREATE TABLE migration_runs (pid INTEGER NOT NULL)'],
+    # 他のプロセスが同じ版を適用しようとする時間を作る
+    lambda conn: (time.sleep(0.2), conn.execute('INSERT INTO migration_runs (pid) VALUES (?)', (os.getpid(),))),
+]
+
+
+def bootstrap_in_children(db_path, processes=4):
+    """fork した子プロセスから同時に bootstrap_schema を呼び、失敗したプロセス数を返す"""
+    from db_pool import ConnectionPool
+    from schema import bootstrap_schema
+    from server import RECORDS_MIGRATIONS
+
+    start_at = time.time() + 0.5
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                time.sleep(max(0, start_at - time.time()))
+                # プロセス内でも別々のプールから2スレッド分呼ぶ
+                pools = [ConnectionPool(db_path, size=1) for _ in range(2)]
+                for pool in pools:
+                    bootstrap_schema(pool, 'counted', COUNTED_MIGRATIONS)
+                    bootstrap_schema(pool, 'records', RECORDS_MIGRATIONS)
+                exit_code = 0
+            except Exception as e:
+                print(f"子プロセス {os.getpid()} エラー: {e}")
+            finally:
+                os._exit(exit_code)
+        children.append(pid)
+    failed = 0
+    for pid in children:
+        _, status = os.waitpid(pid, 0)
+        failed += os.waitstatus_to_exitcode(status) != 0
+    return failed
+
+
+def test_concurrent_bootstrap():
+    """複数プロセスが同時に起動しても各マイグレーションが一度だけ適用されるか"""
+    print("\n=== 同時起動のブートストラップテスト ===")
+    if not hasattr(os, 'fork'):
+        print("⚠️ os.fork が無い環境のためスキップ")
+        return True
+    from server import RECORDS_MIGRATIONS
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        create_baseline_db(db_path)
+        failed = bootstrap_in_children(db_path)
+        conn = sqlite3.connect(db_path)
+        runs = conn.execute('SELECT COUNT(*) FROM migration_runs').fetchone()[0]
+        versions = dict(conn.execute('SELECT component, version FROM schema_versions'))
+        records = conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        conn.close()
+
+    if failed:
+        failures.append(f'{failed}プロセスが失敗')
+    if runs != 1:
+        failures.append(f'v2 が {runs}回適用された')
+    if versions != {'counted': len(COUNTED_MIGRATIONS), 'records': len(RECORDS_MIGRATIONS)}:
+        failures.append(f'schema_versions {versions}')
+    if records != GOOD_RECORDS + 2:
+        failures.append(f'既存の記録 {records}件')
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 4プロセス×2プールで同時に起動し、各版を一度だけ適用")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - スキーマ移行テスト")
+    print("=" * 50)
+
+    results = [
+        ("移行直後の /fetch", test_fetch_after_upgrade()),
+        ("バックフィル前のリザーバー", test_reservoir_seeded_during_backfill()),
+        ("分布カウンタ", test_distribution_counters()),
+        ("品質フラグ列のバックフィル", test_quality_backfill()),
+        ("同時起動のブートストラップ", test_concurrent_bootstrap()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - pre-fork(--workers)テスト
+run_prefork が異常終了したワーカーを同じスロットで再起動すること、
+親プロセスへの SIGTERM が全てのワーカーに届いて親も終了することを確認します
+
+    python dev_tools/test_prefork.py
+"""
+
+import os
+import re
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from queue import Empty, Queue
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from server import WORKER_RESTART_BACKOFF, run_prefork
+
+WORKERS = 3
+STARTED = re.compile(r'ワーカー (\d+) を起動しました \(pid=(\d+)\)')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 回収されていないゾンビは終了済みとみなす
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+
+def wait_until(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+def start_supervisor(workdir, workers):
+    """子プロセスで run_prefork を動かし、(監視プロセスの pid, ワーカーの通知を読む fd) を返す
+
+    ダミーの serve_worker は起動時に「スロット pid」を1行通知し、SIGTERM まで待つ。
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        # run_prefork は共有DB(カレントディレクトリの kotoiminiki.db)を作るので一時ディレクトリで動かす
+        os.chdir(workdir)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+
+        def serve_worker(slot):
+            os.write(write_fd, f'{slot} {os.getpid()}\n'.encode())
+            while True:
+                time.sleep(1)
+
+        exit_code = 0
+        try:
+            run_prefork(workers, serve_worker)
+        except BaseException:
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+def read_started(read_fd, count, timeout):
+    """ワーカーの起動通知を count 件読み、[(スロット, pid)] を返す"""
+    started = []
+    buffer = b''
+    deadline = time.monotonic() + timeout
+    while len(started) < count:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([read_fd], [], [], remaining)[0]:
+            break
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        started += [tuple(int(value) for value in line.split()) for line in lines]
+    return started
+
+
+def test_restart_and_shutdown():
+    """run_prefork: 殺したワーカーを同じスロットで再起動し、SIGTERM で全員を止めるか"""
+    print("=== ワーカーの再起動・停止テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        supervisor, read_fd = start_supervisor(workdir, WORKERS)
+        exited = []
+        try:
+            workers = dict(read_started(read_fd, WORKERS, 10))
+            if sorted(workers) != list(range(WORKERS)):
+                failures.append(f'起動したワーカー {workers}')
+            else:
+                # 起動直後の再起動の間隔を避けてから1つを強制終了する
+                time.sleep(WORKER_RESTART_BACKOFF)
+                os.kill(workers[1], signal.SIGKILL)
+                restarted = read_started(read_fd, 1, 10)
+                if len(restarted) != 1 or restarted[0][0] != 1 or restarted[0][1] == workers[1]:
+                    failures.append(f'再起動 {restarted}')
+                else:
+                    workers[1] = restarted[0][1]
+                if not all(is_alive(pid) for pid in workers.values()):
+                    failures.append('再起動後に全スロットが動いている')
+
+            # 監視プロセスへの SIGTERM が全てのワーカーに届き、監視プロセスも正常終了する
+            os.kill(supervisor, signal.SIGTERM)
+            if not wait_until(lambda: not any(is_alive(pid) for pid in workers.values()), 10):
+                failures.append('SIGTERM 後も残ったワーカー')
+            if read_started(read_fd, 1, 0.5):
+                failures.append('停止中にワーカーを再起動した')
+            wait_until(lambda: exited or exited.extend(
+                status for pid, status in [os.waitpid(supervisor, os.WNOHANG)] if pid), 10)
+        finally:
+            os.close(read_fd)
+            if not exited:
+                os.kill(supervisor, signal.SIGKILL)
+                os.waitpid(supervisor, 0)
+                failures.append('監視プロセスが終了しない')
+        if exited and os.waitstatus_to_exitcode(exited[0]) != 0:
+            failures.append(f'監視プロセスの終了コード {os.waitstatus_to_exitcode(exited[0])}')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 強制終了したワーカーをスロット1で再起動し、SIGTERM で{WORKERS}ワーカーとも停止")
+    return True
+
+
+def test_server_workers():
+    """server.py --workers: ワーカーを殺しても応答を続け、SIGTERM で全プロセスが終了するか"""
+    print("\n=== server.py --workers テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        shutil.copy(os.path.join(ROOT, 'index.html'), workdir)
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'server.py'), str(port), '127.0.0.1', '--workers', '2'],
+            cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            env=dict(os.environ, PYTHONUNBUFFERED='1'),
+        )
+        lines = Queue()
+        threading.Thread(target=lambda: [lines.put(line) for line in process.stdout], daemon=True).start()
+
+        def next_started(timeout):
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    match = STARTED.search(lines.get(timeout=max(0.01, deadline - time.monotonic())))
+                except Empty:
+                    return None
+                if match:
+                    return int(match.group(1)), int(match.group(2))
+
+        def healthy():
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=2) as response:
+                    return response.status == 200
+            except OSError:
+                return False
+
+        workers = {}
+        try:
+            for _ in range(2):
+                started = next_started(15)
+                if started:
+                    workers[started[0]] = started[1]
+            if sorted(workers) != [0, 1] or not wait_until(healthy, 15):
+                failures.append(f'起動 {workers}')
+            else:
+                time.sleep(WORKER_RESTART_BACKOFF)
+                os.kill(workers[0], signal.SIGKILL)
+                # 殺したワーカーのソケットが閉じた後は、残ったワーカーが全ての接続に応答する
+                wait_until(lambda: not is_alive(workers[0]), 5)
+                if not all(healthy() for _ in range(5)):
+                    failures.append('ワーカーの停止中に応答しない')
+                restarted = next_started(15)
+                if not restarted or restarted[0] != 0:
+                    failures.append(f'再起動 {restarted}')
+                else:
+                    workers[0] = restarted[1]
+                    if not wait_until(healthy, 15):
+                        failures.append('再起動後に応答しない')
+
+            process.send_signal(signal.SIGTERM)
+            try:
+                if process.wait(15) != 0:
+                    failures.append(f'終了コード {process.returncode}')
+            except subprocess.TimeoutExpired:
+                failures.append('SIGTERM で親プロセスが終了しない')
+            if not wait_until(lambda: not any(is_alive(pid) for pid in workers.values()), 5):
+                failures.append('SIGTERM 後も残ったワーカー')
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            for pid in workers.values():
+                if is_alive(pid):
+                    os.kill(pid, signal.SIGKILL)
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 強制終了したワーカーを再起動して応答を続け、SIGTERM で親子とも終了")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - pre-fork テスト")
+    print("=" * 50)
+
+    results = [
+        ("再起動・停止", test_restart_and_shutdown()),
+        ("server.py --workers", test_server_workers()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
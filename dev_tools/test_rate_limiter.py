@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - レート制限テスト
+スライディングウィンドウの判定・ブロック・バックエンド(memory / shm / sqlite)の
+プロセス間共有と、サーバーの 429 応答を確認します
+
+    python dev_tools/test_rate_limiter.py
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from rate_limiter import (
+    MemoryRateLimitBackend, SharedMemoryRateLimitBackend, SlidingWindowRateLimiter,
+    SQLiteRateLimitBackend
+)
+
+
+def make_backends(workdir):
+    """テスト対象のバックエンド(shm はファイルを置く場所を指定した共有ファイル)"""
+    return [
+        MemoryRateLimitBackend(),
+        SharedMemoryRateLimitBackend(path=os.path.join(workdir, 'rate_limit.shm')),
+        SQLiteRateLimitBackend(db_path=os.path.join(workdir, 'rate_limit.db')),
+    ]
+
+
+def check_window(backend):
+    """limit=5, window=10 秒, block=30 秒で時刻を指定して判定を確認する(失敗内容のリストを返す)"""
+    limiter = SlidingWindowRateLimiter(5, 10, 30, backend=backend)
+    failures = []
+
+    def expect(now, expected, label):
+        if limiter.allow('10.0.0.1', now) != expected:
+            failures.append(f'{label} (t={now})')
+
+    # 窓は最初のリクエストの時刻(t=0)から始まる
+    expect(0.0, True, '1件目は許可')
+    for i in range(1, 5):
+        expect(9.0, True, f'{i + 1}件目は許可')
+    # 次の窓の2秒目: 直前の窓の5件を 0.8 倍して 4 件とみなす
+    expect(12.0, True, '直前の窓を按分した件数が上限未満なら許可')
+    expect(12.0, False, '按分した件数が上限に達したらブロック')
+    expect(30.0, False, 'ブロック中は拒否')
+    expect(42.5, True, 'ブロック解除後は許可')
+    if not limiter.allow('10.0.0.2', 12.0):
+        failures.append('別のクライアントは影響を受けない')
+
+    limiter.reset()
+    if not limiter.allow('10.0.0.1', 30.0):
+        failures.append('reset 後は許可')
+    return failures
+
+
+def test_sliding_window():
+    """全バックエンドで同じ判定になるか"""
+    print("=== スライディングウィンドウテスト ===")
+    success = True
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in make_backends(workdir):
+            failures = check_window(backend)
+            if failures:
+                print(f"❌ {backend.name}: {', '.join(failures)}")
+                success = False
+            else:
+                print(f"✅ {backend.name}")
+    return success
+
+
+def count_allowed_in_children(limiter, processes=4, requests_per_process=10):
+    """fork した子プロセスから同じクライアントで送り、許可された件数の合計を返す"""
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            allowed = 0
+            try:
+                for _ in range(requests_per_process):
+                    allowed += limiter.allow('203.0.113.7')
+            finally:
+                os._exit(allowed)
+        children.append(pid)
+    total = 0
+    for pid in children:
+        _, status = os.waitpid(pid, 0)
+        total += os.waitstatus_to_exitcode(status)
+    return total
+
+
+def test_cross_process_sharing():
+    """shm / sqlite の状態が fork したプロセス間で共有されるか"""
+    print("\n=== プロセス間共有テスト ===")
+    if not hasattr(os, 'fork'):
+        print("⚠️ os.fork が無い環境のためスキップ")
+        return True
+    success = True
+    limit = 20
+    with tempfile.TemporaryDirectory() as workdir:
+        backends = [
+            SharedMemoryRateLimitBackend(),  # fork 前に作る無名の一時ファイル
+            SharedMemoryRateLimitBackend(path=os.path.join(workdir, 'rate_limit.shm')),
+            SQLiteRateLimitBackend(db_path=os.path.join(workdir, 'rate_limit.db')),
+        ]
+        for backend in backends:
+            limiter = SlidingWindowRateLimiter(limit, 60, 300, backend=backend)
+            allowed = count_allowed_in_children(limiter)
+            label = f"{backend.name} ({'path' if getattr(backend, 'path', None) else 'anonymous'})"
+            if allowed != limit:
+                print(f"❌ {label}: 4プロセス×10件で {allowed}件許可(期待値 {limit})")
+                success = False
+            elif limiter.allow('203.0.113.7'):
+                print(f"❌ {label}: 親プロセスでブロックが共有されていません")
+                success = False
+            else:
+                print(f"✅ {label}: 合計 {allowed}件許可、ブロックも共有")
+    return success
+
+
+def test_shared_memory_capacity():
+    """shm の表が max_clients を超えたら古いスロットを上書きするか"""
+    print("\n=== 共有メモリの容量テスト ===")
+    backend = SharedMemoryRateLimitBackend(max_clients=8)
+    limiter = SlidingWindowRateLimiter(5, 10, 30, backend=backend)
+    for i in range(50):
+        limiter.allow(f'198.51.100.{i}', 1.0 + i)
+    stats = backend.stats(100.0)
+    if stats['clients'] > 8 or stats['evictions'] == 0:
+        print(f"❌ clients={stats['clients']}, evictions={stats['evictions']}")
+        return False
+    if not limiter.allow('198.51.100.49', 60.0):
+        print("❌ 直近のクライアントの状態が失われています")
+        return False
+    print(f"✅ clients={stats['clients']}, evictions={stats['evictions']}")
+    return True
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, port, *args):
+    """workdir をカレントディレクトリにしてサーバーを起動し、応答するまで待つ"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), str(port), '127.0.0.1', *args],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=10).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('サーバーが起動しませんでした')
+
+
+def post_submission(port, i):
+    data = {
+        'user_id_hash': f'anon_rate_{i}',
+        'timestamp': '2025-09-21T10:30:00Z',
+        'consent': True,
+        'mode': 'solo',
+        'event_tag': 'work_late',
+        'meaning_text': f'レート制限テスト用の意味づけ {i}',
+        'rt_ms': 2000,
+    }
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/submit', json.dumps(data).encode('utf-8'),
+        {'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_http_429(*server_args):
+    """1分間に31件目の /submit が 429 になるか"""
+    label = ' '.join(server_args) or '単一プロセス'
+    print(f"\n=== /submit の 429 テスト ({label}) ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        process = start_server(workdir, port, *server_args)
+        try:
+            statuses = [post_submission(port, i) for i in range(31)]
+        finally:
+            process.terminate()
+            process.wait()
+    if any(status == 429 for status in statuses[:30]) or statuses[30] != 429:
+        print(f"❌ ステータス: {statuses}")
+        return False
+    print("✅ 30件目までは受け付け、31件目は 429")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - レート制限テスト")
+    print("=" * 50)
+
+    results = [
+        ("スライディングウィンドウ", test_sliding_window()),
+        ("プロセス間共有", test_cross_process_sharing()),
+        ("共有メモリの容量", test_shared_memory_capacity()),
+        ("429 (単一プロセス)", test_http_429()),
+        ("429 (--workers 2)", test_http_429('--workers', '2')),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 研究データ分析ツールテスト
+get_quality_analysis の品質フラグの集計(整数列 / バックフィル待ちの JSON)が、
+同意済みデータの quality_flags を直接数えた結果と一致することを一時DBで確認します
+
+    python dev_tools/test_research_data_analyzer.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from db_pool import close_all_pools
+from research_data_analyzer import ResearchDataAnalyzer
+from server import DatabaseManager
+from write_queue import close_all_writers
+
+# 3列のフラグに加え、送信データに含まれていた他のキー(真・偽の値)を持つ quality_flags
+QUALITY_FLAGS = [
+    {'duplicate': False},
+    {'duplicate': True},
+    {'duplicate': False, 'spam': True, 'too_short': True},
+    {'duplicate': False, 'too_short': True},
+    {'duplicate': False, 'flagged_by_user': True},
+    {'duplicate': False, 'review_note': '要確認'},
+    {'duplicate': False, 'score': 0.5},
+    {'duplicate': False, 'labels': ['off_topic']},
+    {'duplicate': False, 'flagged_by_user': False, 'score': 0, 'review_note': '',
+     'labels': [], 'details': {}, 'reviewed': None},
+]
+
+
+def record(i, quality_flags, consent=True):
+    return {
+        'user_id_hash': f'anon_quality_{i}',
+        'timestamp': '2025-09-21T10:30:00Z',
+        'consent': consent,
+        'mode': 'solo',
+        'event_tag': 'work_late',
+        'meaning_text': f'品質フラグを数える意味づけ{i}',
+        'rt_ms': 2000,
+        'quality_flags': json.dumps(quality_flags, ensure_ascii=False),
+    }
+
+
+def expected_quality(flag_sets):
+    """quality_flags を1件ずつ数える(フラグ列が無かった頃の定義)"""
+    return {
+        'spam': sum(1 for q in flag_sets if q.get('spam', False)),
+        'duplicate': sum(1 for q in flag_sets if q.get('duplicate', False)),
+        'too_short': sum(1 for q in flag_sets if q.get('too_short', False)),
+        'high_quality': sum(1 for q in flag_sets if not any(q.values())),
+    }
+
+
+def test_quality_analysis():
+    """整数列で集計した記録・バックフィル待ちの記録のどちらも quality_flags の定義どおりに数えるか"""
+    print("=== 品質フラグ集計テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'kotoiminiki.db')
+        try:
+            db = DatabaseManager(db_path)
+            items = [record(i, flags) for i, flags in enumerate(QUALITY_FLAGS)]
+            # 同意の無い記録は数えない
+            items.append(record(len(items), {'duplicate': False}, consent=False))
+            record_ids = db.insert_records(items)
+            analyzer = ResearchDataAnalyzer(db_path)
+
+            expected = expected_quality(QUALITY_FLAGS)
+            for label, pending in (('整数列', []), ('バックフィル待ち', record_ids[::2])):
+                with db.pool.connection() as conn:
+                    conn.executemany('UPDATE records SET is_spam = NULL WHERE id = ?',
+                                     [(record_id,) for record_id in pending])
+                    conn.commit()
+                result = analyzer.get_quality_analysis()
+                if result['quality_issues'] != expected:
+                    failures.append(f"{label}: {result['quality_issues']}(期待値 {expected})")
+                if result['total_analyzed'] != len(QUALITY_FLAGS):
+                    failures.append(f"{label}: 対象 {result['total_analyzed']}件")
+        finally:
+            close_all_writers()
+            close_all_pools()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 高品質 {expected['high_quality']}件(3列以外の真のフラグも除外)、"
+          "整数列・バックフィル待ちとも一致")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - 研究データ分析ツールテスト")
+    print("=" * 50)
+
+    results = [
+        ("品質フラグ集計", test_quality_analysis()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - レスポンスキャッシュテスト
+ResponseCache の LRU の追い出し・スコープ単位の無効化・有効期限と、
+計算中に無効化された結果を登録しないことを確認します
+
+    python dev_tools/test_response_cache.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from response_cache import ResponseCache
+
+SCOPE = ('fetch', 'work_late')
+
+
+def test_lru_eviction():
+    """上限を超えたら最も長く参照されていないエントリから追い出すか"""
+    print("=== LRU の追い出しテスト ===")
+    cache = ResponseCache(max_entries=3, ttl=60)
+    for key in ('a', 'b', 'c'):
+        cache.get_or_compute(key, SCOPE, lambda key=key: key.upper())
+    # a を参照して最近使ったことにすると、次に追い出されるのは b
+    cache.get('a')
+    cache.get_or_compute('d', SCOPE, lambda: 'D')
+    failures = []
+    if cache.get('b') is not None:
+        failures.append('最も古い b が残っている')
+    if [cache.get(key) for key in ('a', 'c', 'd')] != ['A', 'C', 'D']:
+        failures.append('最近使ったエントリが追い出された')
+    stats = cache.stats()
+    if stats['entries'] != 3 or stats['evictions'] != 1:
+        failures.append(f"entries={stats['entries']}, evictions={stats['evictions']}")
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 上限3件で最も古いエントリだけを追い出した")
+    return True
+
+
+def test_invalidation():
+    """スコープ単位・全体の無効化で再計算し、他のスコープは残るか"""
+    print("\n=== 無効化テスト ===")
+    cache = ResponseCache(max_entries=10, ttl=60)
+    other = ('fetch', 'rainy_day')
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    cache.get_or_compute('k1', SCOPE, lambda: compute(1))
+    cache.get_or_compute('k2', other, lambda: compute(2))
+    cache.invalidate(SCOPE)
+    failures = []
+    if cache.get_or_compute('k1', SCOPE, lambda: compute(3)) != 3:
+        failures.append('無効化したスコープは再計算')
+    if cache.get_or_compute('k2', other, lambda: compute(4)) != 2:
+        failures.append('他のスコープはキャッシュから返す')
+    cache.invalidate()
+    if cache.get_or_compute('k2', other, lambda: compute(5)) != 5:
+        failures.append('全体の無効化で全スコープを再計算')
+    if calls != [1, 2, 3, 5] or cache.stats()['stale'] != 2:
+        failures.append(f"計算の回数 {calls}, stale={cache.stats()['stale']}")
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 無効化したスコープだけを再計算")
+    return True
+
+
+def test_version_bump_during_compute():
+    """計算中に invalidate() されたら、その結果を登録しない"""
+    print("\n=== 計算中の無効化テスト ===")
+    cache = ResponseCache(max_entries=10, ttl=60)
+    started = threading.Event()
+    written = threading.Event()
+
+    def slow_compute():
+        # 古いデータを読んだ後で書き込みが入る
+        started.set()
+        written.wait(5)
+        return 'stale'
+
+    result = {}
+    reader = threading.Thread(
+        target=lambda: result.setdefault('value', cache.get_or_compute('k', SCOPE, slow_compute))
+    )
+    reader.start()
+    started.wait(5)
+    cache.invalidate(SCOPE)
+    written.set()
+    reader.join(5)
+
+    failures = []
+    if result.get('value') != 'stale':
+        failures.append('計算した呼び出し元には結果を返す')
+    if cache.get('k') is not None or cache.stats()['entries'] != 0:
+        failures.append('計算中に無効化された結果が登録された')
+    if cache.get_or_compute('k', SCOPE, lambda: 'fresh') != 'fresh' or cache.get('k') != 'fresh':
+        failures.append('次の参照で新しい値を計算して登録')
+
+    # 全体の無効化も同じく計算中の結果を捨てる
+    version = cache.version(('fetch', 'other'))
+    cache.invalidate()
+    cache.put('k2', ('fetch', 'other'), 'stale', version)
+    if cache.get('k2') is not None:
+        failures.append('全体の無効化前のバージョンで登録された')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 計算中に書き込みがあった結果は登録しない")
+    return True
+
+
+def test_ttl_and_disabled():
+    """有効期限切れのエントリは再計算し、max_entries=0 では常に計算するか"""
+    print("\n=== 有効期限・無効化設定テスト ===")
+    failures = []
+    cache = ResponseCache(max_entries=10, ttl=0.05)
+    cache.get_or_compute('k', SCOPE, lambda: 'old')
+    time.sleep(0.1)
+    if cache.get_or_compute('k', SCOPE, lambda: 'new') != 'new' or cache.stats()['expired'] != 1:
+        failures.append('期限切れは再計算')
+
+    disabled = ResponseCache(max_entries=0, ttl=60)
+    calls = []
+    for _ in range(3):
+        disabled.get_or_compute('k', SCOPE, lambda: calls.append(1) or len(calls))
+    if len(calls) != 3 or disabled.stats()['entries'] != 0:
+        failures.append('max_entries=0 はキャッシュしない')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 期限切れで再計算、max_entries=0 ではキャッシュしない")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - レスポンスキャッシュテスト")
+    print("=" * 50)
+
+    results = [
+        ("LRU の追い出し", test_lru_eviction()),
+        ("無効化", test_invalidation()),
+        ("計算中の無効化", test_version_bump_during_compute()),
+        ("有効期限・無効化設定", test_ttl_and_disabled()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
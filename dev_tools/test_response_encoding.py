@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - JSONレスポンスのエンコードテスト
+encode_json_response のコンパクト / ?pretty 出力、Accept-Encoding(q=0 を含む)と
+GZIP_MIN_SIZE による gzip の判定、ルート毎の集計を確認します
+
+    python dev_tools/test_response_encoding.py
+"""
+
+import gzip
+import json
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import response_encoding
+from response_encoding import encode_json_response, response_stats, wants_pretty
+
+# GZIP_MIN_SIZE を十分に超え、圧縮が効くJSON
+LARGE_DATA = {'samples': [f'意味づけ{i % 10}' for i in range(500)], 'status': 'success'}
+SMALL_DATA = {'success': True}
+
+
+def decode(body, headers):
+    """ボディを(gzip なら展開して)JSONとして読む"""
+    if dict(headers).get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return json.loads(body.decode('utf-8'))
+
+
+def test_pretty():
+    """既定はコンパクト、?pretty=1|true|yes で整形"""
+    print("=== 整形出力テスト ===")
+    failures = []
+    cases = {None: False, '': False, 'pretty=1': True, 'a=b&pretty=TRUE': True, 'pretty=yes': True,
+             'pretty=0': False, 'pretty': False, 'prettyx=1': False}
+    failures += [f'wants_pretty({value!r})' for value, expected in cases.items()
+                 if wants_pretty(value) != expected]
+
+    compact, _ = encode_json_response(dict(SMALL_DATA, text='日本語'))
+    pretty, _ = encode_json_response(dict(SMALL_DATA, text='日本語'), query_string='pretty=1')
+    if compact != '{"success":true,"text":"日本語"}'.encode('utf-8'):
+        failures.append(f'コンパクト表記 {compact!r}')
+    if b'\n  "success": true' not in pretty or json.loads(pretty) != json.loads(compact):
+        failures.append(f'整形表記 {pretty!r}')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 既定はコンパクト、?pretty で整形(内容は同じ)")
+    return True
+
+
+def test_accept_encoding():
+    """gzip を受け付けるときだけ圧縮し、q=0 なら無圧縮"""
+    print("\n=== Accept-Encoding テスト ===")
+    failures = []
+    for accept_encoding, expected in ((None, False), ('gzip', True), ('gzip, deflate', True),
+                                      ('gzip;q=0', False), ('*;q=1, gzip;q=0', False),
+                                      ('identity', False), ('*', True)):
+        body, headers = encode_json_response(LARGE_DATA, accept_encoding=accept_encoding)
+        headers = dict(headers)
+        compressed = headers.get('Content-Encoding') == 'gzip'
+        if compressed != expected or decode(body, headers.items()) != LARGE_DATA:
+            failures.append(f'{accept_encoding!r}')
+        if headers.get('Vary') != 'Accept-Encoding' or not headers['Content-Type'].startswith('application/json'):
+            failures.append(f'{accept_encoding!r} のヘッダー')
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ gzip の受け入れ・q=0 の拒否どおりに圧縮")
+    return True
+
+
+def test_size_threshold():
+    """GZIP_MIN_SIZE 未満は圧縮せず、圧縮しても小さくならなければ無圧縮で返す"""
+    print("\n=== 圧縮するサイズの閾値テスト ===")
+    failures = []
+    original = response_encoding.GZIP_MIN_SIZE
+    try:
+        body, _ = encode_json_response(LARGE_DATA)
+        response_encoding.GZIP_MIN_SIZE = len(body) + 1
+        _, headers = encode_json_response(LARGE_DATA, accept_encoding='gzip')
+        if 'Content-Encoding' in dict(headers):
+            failures.append('閾値未満は圧縮しない')
+        response_encoding.GZIP_MIN_SIZE = len(body)
+        _, headers = encode_json_response(LARGE_DATA, accept_encoding='gzip')
+        if dict(headers).get('Content-Encoding') != 'gzip':
+            failures.append('閾値ちょうどは圧縮する')
+
+        # 0 で常に圧縮を試みるが、小さいJSONは gzip のヘッダー分大きくなるので無圧縮
+        response_encoding.GZIP_MIN_SIZE = 0
+        body, headers = encode_json_response(SMALL_DATA, accept_encoding='gzip')
+        if 'Content-Encoding' in dict(headers) or json.loads(body) != SMALL_DATA:
+            failures.append('圧縮で大きくなるなら無圧縮')
+    finally:
+        response_encoding.GZIP_MIN_SIZE = original
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 閾値以上かつ小さくなるときだけ圧縮")
+    return True
+
+
+def test_route_stats():
+    """route を渡した応答だけをルート毎に集計するか"""
+    print("\n=== ルート毎の集計テスト ===")
+    route = '/test_response_encoding'
+    plain, _ = encode_json_response(LARGE_DATA, route=route)
+    gzipped, _ = encode_json_response(LARGE_DATA, route=route, accept_encoding='gzip')
+    encode_json_response(LARGE_DATA, accept_encoding='gzip')
+    stats = response_stats()[route]
+    expected = {
+        'responses': 2,
+        'gzip_responses': 1,
+        'json_bytes': len(plain) * 2,
+        'sent_bytes': len(plain) + len(gzipped),
+        'saved_bytes': len(plain) - len(gzipped),
+        'avg_sent_bytes': (len(plain) + len(gzipped)) / 2,
+    }
+    if stats != expected:
+        print(f"❌ {stats} != {expected}")
+        return False
+    print("✅ 応答数・gzip 応答数・バイト数を集計")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - JSONレスポンスのエンコードテスト")
+    print("=" * 50)
+
+    results = [
+        ("整形出力", test_pretty()),
+        ("Accept-Encoding", test_accept_encoding()),
+        ("圧縮の閾値", test_size_threshold()),
+        ("ルート毎の集計", test_route_stats()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
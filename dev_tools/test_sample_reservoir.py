@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - サンプルリザーバーテスト
+offer_sample(Algorithm R)・discard_sample・refresh_reservoir の動作と、
+投稿から /fetch 用のサンプルに反映されるまでを一時DBで確認します
+
+    python dev_tools/test_sample_reservoir.py
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from sample_reservoir import (
+    SAMPLE_RESERVOIR_DDL, discard_sample, offer_sample, refresh_reservoir, reservoir_samples
+)
+
+EVENT_TAG = 'work_late'
+
+
+def reservoir_connection():
+    """リザーバーのテーブルだけを持つメモリ上のDB"""
+    conn = sqlite3.connect(':memory:')
+    for statement in SAMPLE_RESERVOIR_DDL:
+        conn.execute(statement)
+    return conn
+
+
+def test_offer_fills_reservoir():
+    """size 件までは全て入り、以降も size 件を保つか"""
+    print("=== offer_sample テスト ===")
+    conn = reservoir_connection()
+    for i in range(3):
+        offer_sample(conn, EVENT_TAG, f'rec_{i}', f'意味づけ{i}', size=5)
+    texts, refreshed_at = reservoir_samples(conn, EVENT_TAG)
+    if sorted(texts) != ['意味づけ0', '意味づけ1', '意味づけ2'] or refreshed_at != 0:
+        print(f"❌ size 未満: {texts}, refreshed_at={refreshed_at}")
+        return False
+    for i in range(3, 50):
+        offer_sample(conn, EVENT_TAG, f'rec_{i}', f'意味づけ{i}', size=5)
+    texts, _ = reservoir_samples(conn, EVENT_TAG)
+    seen = conn.execute(
+        'SELECT seen FROM sample_reservoir_state WHERE event_tag = ?', (EVENT_TAG,)
+    ).fetchone()[0]
+    if len(texts) != 5 or len(set(texts)) != 5 or seen != 50:
+        print(f"❌ size 超過後: {len(texts)}件, seen={seen}")
+        return False
+    print("✅ size 件まで埋まり、以降は size 件を保つ")
+    return True
+
+
+def test_offer_is_uniform():
+    """Algorithm R で最初と最後の記録が同じ確率(size / 件数)で残るか"""
+    print("\n=== offer_sample 一様性テスト ===")
+    random.seed(0)
+    trials, size, stream = 400, 5, 20
+    kept = {'rec_0': 0, f'rec_{stream - 1}': 0}
+    for _ in range(trials):
+        conn = reservoir_connection()
+        for i in range(stream):
+            offer_sample(conn, EVENT_TAG, f'rec_{i}', f'意味づけ{i}', size=size)
+        for (record_id,) in conn.execute('SELECT record_id FROM sample_reservoir'):
+            if record_id in kept:
+                kept[record_id] += 1
+        conn.close()
+    expected = size / stream
+    rates = {record_id: count / trials for record_id, count in kept.items()}
+    if any(abs(rate - expected) > 0.08 for rate in rates.values()):
+        print(f"❌ 残った割合 {rates}(期待値 {expected})")
+        return False
+    print(f"✅ 残った割合 {rates}(期待値 {expected})")
+    return True
+
+
+def test_discard_sample():
+    """除外した記録が外れ、その出来事が引き直し対象になるか"""
+    print("\n=== discard_sample テスト ===")
+    conn = reservoir_connection()
+    for i in range(3):
+        offer_sample(conn, EVENT_TAG, f'rec_{i}', f'意味づけ{i}', size=5)
+    conn.execute('UPDATE sample_reservoir_state SET refreshed_at = 100')
+    discard_sample(conn, 'rec_missing')
+    discard_sample(conn, 'rec_1')
+    texts, refreshed_at = reservoir_samples(conn, EVENT_TAG)
+    if '意味づけ1' in texts or len(texts) != 2 or refreshed_at != 0:
+        print(f"❌ {texts}, refreshed_at={refreshed_at}")
+        return False
+    print("✅ 除外した記録が外れ、引き直し対象になった")
+    return True
+
+
+def test_refresh_and_submit():
+    """引き直しが最近の品質の良い記録だけを使い、投稿がリザーバーに反映されるか"""
+    print("\n=== refresh_reservoir テスト ===")
+    from server import DatabaseManager
+    from db_pool import close_all_pools
+    from write_queue import close_all_writers
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            db = DatabaseManager(os.path.join(workdir, 'kotoiminiki.db'))
+            base = {
+                'timestamp': '2025-09-21T10:30:00Z',
+                'consent': True,
+                'mode': 'solo',
+                'event_tag': EVENT_TAG,
+                'rt_ms': 2000,
+            }
+            for i in range(30):
+                db.insert_record(dict(base, user_id_hash=f'anon_{i}', meaning_text=f'古い意味づけ{i}'))
+            # 品質フラグはハンドラーが付けるので、ここでは付けた状態で渡す
+            db.insert_record(dict(base, user_id_hash='anon_spam', meaning_text='スパムの意味づけ',
+                                  rt_ms=100, quality_flags='{"spam": true}'))
+            db.insert_record(dict(base, user_id_hash='anon_nc', meaning_text='非同意の意味づけ', consent=False))
+
+            with db.pool.connection() as conn:
+                texts, _ = reservoir_samples(conn, EVENT_TAG)
+            if len(texts) != 20 or any('古い' not in text for text in texts):
+                failures.append(f'投稿時の offer_sample: {len(texts)}件 {texts}')
+
+            count = db.writer.execute(lambda conn: refresh_reservoir(conn, EVENT_TAG, size=5, window=10))
+            with db.pool.connection() as conn:
+                texts, refreshed_at = reservoir_samples(conn, EVENT_TAG)
+                seen = conn.execute(
+                    'SELECT seen FROM sample_reservoir_state WHERE event_tag = ?', (EVENT_TAG,)
+                ).fetchone()[0]
+            recent = {f'古い意味づけ{i}' for i in range(20, 30)}
+            if count != 5 or len(texts) != 5 or not set(texts) <= recent:
+                failures.append(f'引き直し: {count}件 {texts}')
+            if seen != 10 or refreshed_at == 0:
+                failures.append(f'引き直し後の状態: seen={seen}, refreshed_at={refreshed_at}')
+        finally:
+            close_all_writers()
+            close_all_pools()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 最近の品質の良い記録からだけ引き直した")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - サンプルリザーバーテスト")
+    print("=" * 50)
+
+    results = [
+        ("offer_sample", test_offer_fills_reservoir()),
+        ("offer_sample 一様性", test_offer_is_uniform()),
+        ("discard_sample", test_discard_sample()),
+        ("refresh_reservoir", test_refresh_and_submit()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 静的ファイルキャッシュテスト
+StaticFileCache の ETag・If-None-Match による 304・gzip の選択と、
+ファイルの更新・削除でキャッシュが読み直されることを一時ディレクトリで確認します
+
+    python dev_tools/test_static_cache.py
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from static_cache import GZIP_MIN_SIZE, StaticFileCache, accepts_gzip, etag_matches
+
+CONTENT_TYPE = 'text/html; charset=utf-8'
+# gzip 版が作られる大きさの HTML と、作られない小さな HTML
+LARGE_HTML = ('<html><body>' + '<p>ことイミ日記</p>' * (GZIP_MIN_SIZE // 10) + '</body></html>').encode('utf-8')
+SMALL_HTML = '<html>小</html>'.encode('utf-8')
+
+
+def write_file(path, body, mtime_ns=None):
+    with open(path, 'wb') as f:
+        f.write(body)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_accepts_gzip():
+    """Accept-Encoding の q 値・* の扱い"""
+    print("=== accepts_gzip テスト ===")
+    cases = {
+        None: False,
+        '': False,
+        'gzip': True,
+        'GZIP, deflate': True,
+        'deflate, br': False,
+        'gzip;q=0': False,
+        'gzip; q=0.0': False,
+        'gzip;q=0.5': True,
+        'gzip;level=1;q=0': False,
+        '*': True,
+        '*;q=0': False,
+        '*;q=1, gzip;q=0': False,
+        'gzip;q=0.2, *;q=0': True,
+        'gzip;q=abc': False,
+    }
+    failures = [f'{value!r}' for value, expected in cases.items() if accepts_gzip(value) != expected]
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ {len(cases)}通りの Accept-Encoding を正しく判定")
+    return True
+
+
+def test_etag_matches():
+    """If-None-Match の弱い比較・複数指定・*"""
+    print("\n=== etag_matches テスト ===")
+    etags = ('"abc"', '"abc-gz"')
+    cases = {
+        None: False,
+        '"abc"': True,
+        'W/"abc"': True,
+        '"other", "abc-gz"': True,
+        '"other"': False,
+        '*': True,
+    }
+    failures = [f'{value!r}' for value, expected in cases.items() if etag_matches(value, etags) != expected]
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ {len(cases)}通りの If-None-Match を正しく判定")
+    return True
+
+
+def test_respond():
+    """200 の ETag・gzip の選択と、If-None-Match が一致したときの 304"""
+    print("\n=== respond テスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write_file(os.path.join(workdir, 'large.html'), LARGE_HTML)
+        write_file(os.path.join(workdir, 'small.html'), SMALL_HTML)
+        cache = StaticFileCache(workdir)
+
+        status, headers, body = cache.respond('large.html', CONTENT_TYPE)
+        headers = dict(headers)
+        etag = headers['ETag']
+        if status != 200 or body != LARGE_HTML or 'Content-Encoding' in headers:
+            failures.append('Accept-Encoding なしは無圧縮の 200')
+        if headers['Content-Length'] != str(len(LARGE_HTML)) or headers['Vary'] != 'Accept-Encoding':
+            failures.append(f'200 のヘッダー {headers}')
+
+        status, gz_headers, gz_body = cache.respond('large.html', CONTENT_TYPE, accept_encoding='gzip')
+        gz_headers = dict(gz_headers)
+        gz_etag = gz_headers['ETag']
+        if status != 200 or gz_headers.get('Content-Encoding') != 'gzip' or gzip.decompress(gz_body) != LARGE_HTML:
+            failures.append('gzip を受け付けるなら gzip 版')
+        if gz_etag == etag or gz_headers['Content-Length'] != str(len(gz_body)):
+            failures.append(f'gzip 版の ETag・Content-Length {gz_headers}')
+        if dict(cache.respond('large.html', CONTENT_TYPE, accept_encoding='gzip;q=0')[1])['ETag'] != etag:
+            failures.append('gzip;q=0 なら無圧縮')
+
+        _, small_headers, small_body = cache.respond('small.html', CONTENT_TYPE, accept_encoding='gzip')
+        if small_body != SMALL_HTML or 'Content-Encoding' in dict(small_headers):
+            failures.append('小さいファイルは圧縮しない')
+
+        for if_none_match in (etag, gz_etag, f'W/{etag}', f'"other", {gz_etag}', '*'):
+            status, headers, body = cache.respond('large.html', CONTENT_TYPE, if_none_match, 'gzip')
+            if status != 304 or body != b'' or dict(headers)['ETag'] != gz_etag:
+                failures.append(f'If-None-Match: {if_none_match} で 304')
+            elif dict(headers)['Content-Length'] != str(len(gz_body)):
+                failures.append('304 の Content-Length は 200 と同じ')
+        status, _, _ = cache.respond('large.html', CONTENT_TYPE, '"other"', 'gzip')
+        if status != 200:
+            failures.append('一致しない If-None-Match は 200')
+
+        if cache.respond('missing.html', CONTENT_TYPE) is not None:
+            failures.append('存在しないファイルは None')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ ETag・gzip 版の選択・304 を正しく返す")
+    return True
+
+
+def test_invalidation():
+    """mtime・サイズの変化で読み直し、削除されたら None を返すか"""
+    print("\n=== キャッシュの読み直しテスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'index.html')
+        write_file(path, LARGE_HTML, mtime_ns=1_000_000_000)
+        cache = StaticFileCache(workdir)
+        cache.preload({'index.html': CONTENT_TYPE})
+        etag = dict(cache.respond('index.html', CONTENT_TYPE)[1])['ETag']
+
+        # 同じサイズで内容だけ変わった場合も mtime の変化で読み直す
+        updated = LARGE_HTML.replace('ことイミ'.encode('utf-8'), 'ことばの'.encode('utf-8'), 1)
+        write_file(path, updated, mtime_ns=2_000_000_000)
+        status, headers, body = cache.respond('index.html', CONTENT_TYPE, if_none_match=etag)
+        new_etag = dict(headers)['ETag']
+        if status != 200 or body != updated or new_etag == etag:
+            failures.append('mtime の変化で読み直して古い ETag には 200')
+
+        # mtime が同じでもサイズが変われば読み直す
+        write_file(path, SMALL_HTML, mtime_ns=2_000_000_000)
+        status, _, body = cache.respond('index.html', CONTENT_TYPE, if_none_match=new_etag)
+        if status != 200 or body != SMALL_HTML:
+            failures.append('サイズの変化で読み直す')
+
+        stats = cache.stats()
+        if stats['loads'] != 3 or stats['assets'][path]['size'] != len(SMALL_HTML):
+            failures.append(f"読み込み回数 {stats['loads']}")
+
+        os.remove(path)
+        if cache.respond('index.html', CONTENT_TYPE) is not None or cache.stats()['assets']:
+            failures.append('削除されたファイルは None でキャッシュからも外す')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 更新で読み直し、削除でキャッシュから外す")
+    return True
+
+
+def test_stats():
+    """統計カウンタ: ヒット・304・gzip 応答・送信/削減バイト数"""
+    print("\n=== 統計カウンタテスト ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        write_file(os.path.join(workdir, 'index.html'), LARGE_HTML)
+        cache = StaticFileCache(workdir)
+        _, headers, gz_body = cache.respond('index.html', CONTENT_TYPE, accept_encoding='gzip')
+        cache.respond('index.html', CONTENT_TYPE)
+        cache.respond('index.html', CONTENT_TYPE, dict(headers)['ETag'], 'gzip')
+        stats = cache.stats()
+    expected = {
+        'loads': 1,
+        'hits': 2,
+        'not_modified': 1,
+        'gzip_responses': 1,
+        'bytes_sent': len(gz_body) + len(LARGE_HTML),
+        'bytes_saved': (len(LARGE_HTML) - len(gz_body)) + len(gz_body),
+    }
+    actual = {name: stats[name] for name in expected}
+    if actual != expected:
+        print(f"❌ {actual} != {expected}")
+        return False
+    print("✅ 統計カウンタが応答と一致")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - 静的ファイルキャッシュテスト")
+    print("=" * 50)
+
+    results = [
+        ("accepts_gzip", test_accepts_gzip()),
+        ("etag_matches", test_etag_matches()),
+        ("respond", test_respond()),
+        ("キャッシュの読み直し", test_invalidation()),
+        ("統計カウンタ", test_stats()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 送信データのスキーマテスト
+RECORD_SCHEMA が従来の validate_submission_data と同じ送信データを受け付け・拒否し、
+同じ値に置き換えることをランダムな入力で確認し、エラーの形式も確認します
+
+    python dev_tools/test_submission_schema.py
+"""
+
+import copy
+import random
+import re
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from sanitizer import sanitize_text
+from submission_schema import ALLOWED_EVENT_TAGS, MEANING_SCHEMA, RECORD_SCHEMA
+
+FUZZ_ROUNDS = 50000
+
+# ランダムな送信データの各項目の候補(境界値・型違い・サニタイズ対象を含む)
+# 先頭2つは有効な値で、受け付ける送信データも十分な数になるよう多めに選ぶ
+FIELD_VALUES = {
+    'user_id_hash': ['anon_abc', 'anon_a_1', 'anon_', 'ANON_x', 'anon_x\n', 'anon_<b>', 'user', '', None, 5],
+    'consent': [True, False, 1, 0, 'true', None],
+    'mode': ['solo', 'social', 'Solo', '', None, 3],
+    'event_tag': ['work_late', 'other', '<other>', 'bogus', '', None, ' work_late'],
+    'meaning_text': ['残業で疲れた一日', 'abc', '    abcd  ', 'hello world', '<script>x</script>',
+                     '', None, 12345, 1234, 'a&b<c>d"e'],
+    'rt_ms': [0, 2000, -1, 2.0, 2.5, '2000', None, 10 ** 12],
+    'event_text': ['text', '', None, '<i>x</i>', 7],
+    'meaning_tag': ['learning', 'a,b', '', None, 3],
+}
+TIMESTAMP = '2025-09-21T10:30:00Z'
+
+
+def legacy_validate_submission_data(data):
+    """変更前の server.py の validate_submission_data(例外は 500 = 拒否として扱う)"""
+    required_fields = [
+        'user_id_hash', 'consent', 'mode', 'event_tag',
+        'meaning_text', 'rt_ms'
+    ]
+    for field in required_fields:
+        if field not in data:
+            return False
+    if not isinstance(data['consent'], bool):
+        return False
+    if not isinstance(data['rt_ms'], int) or data['rt_ms'] < 0:
+        return False
+    text_fields = ['event_text', 'meaning_text', 'meaning_tag', 'user_id_hash', 'event_tag']
+    for field in text_fields:
+        if field in data and data[field]:
+            data[field] = sanitize_text(data[field])
+    if len(data['meaning_text'].strip()) < 5:
+        return False
+    if data['mode'] not in ['solo', 'social']:
+        return False
+    if data['event_tag'] not in ALLOWED_EVENT_TAGS:
+        return False
+    if not re.match(r'^anon_[a-z0-9_]+$', data['user_id_hash']):
+        return False
+    return True
+
+
+def legacy_accepts(data):
+    try:
+        return legacy_validate_submission_data(data)
+    except Exception:
+        return False
+
+
+def random_submission(rng):
+    data = {'timestamp': TIMESTAMP}
+    for name, values in FIELD_VALUES.items():
+        if rng.random() < 0.95:
+            data[name] = rng.choice(values[:2] if rng.random() < 0.7 else values)
+    return data
+
+
+def test_fuzz_equivalence():
+    """ランダムな送信データで従来の検証と受理・拒否・置き換え後の値が一致するか"""
+    print("=== 従来の検証との一致テスト ===")
+    rng = random.Random(20)
+    mismatches = []
+    accepted = 0
+    for _ in range(FUZZ_ROUNDS):
+        data = random_submission(rng)
+        legacy_data = copy.deepcopy(data)
+        schema_data = copy.deepcopy(data)
+        legacy_ok = legacy_accepts(legacy_data)
+        schema_ok = not RECORD_SCHEMA.validate(schema_data)
+        if legacy_ok != schema_ok or (legacy_ok and legacy_data != schema_data):
+            mismatches.append(data)
+        accepted += legacy_ok
+    if mismatches:
+        print(f"❌ {len(mismatches)}件が一致しません(例: {mismatches[0]})")
+        return False
+    print(f"✅ {FUZZ_ROUNDS}件中 受理 {accepted}件・拒否 {FUZZ_ROUNDS - accepted}件が一致")
+    return True
+
+
+def test_intended_differences():
+    """従来と意図的に変えた点: timestamp は必須、rt_ms に真偽値は不可"""
+    print("\n=== 意図的な差分テスト ===")
+    base = {
+        'user_id_hash': 'anon_abc', 'timestamp': TIMESTAMP, 'consent': True, 'mode': 'solo',
+        'event_tag': 'work_late', 'meaning_text': '残業で疲れた一日', 'rt_ms': 2000,
+    }
+    failures = []
+    no_timestamp = {key: value for key, value in base.items() if key != 'timestamp'}
+    if RECORD_SCHEMA.validate(no_timestamp) != [
+            {'field': 'timestamp', 'code': 'required', 'message': 'required'}]:
+        failures.append('timestamp が無い送信データ')
+    if RECORD_SCHEMA.validate(dict(base, rt_ms=True)) != [
+            {'field': 'rt_ms', 'code': 'type', 'message': 'must be int'}]:
+        failures.append('rt_ms が真偽値の送信データ')
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ timestamp の欠落と真偽値の rt_ms を拒否")
+    return True
+
+
+def test_error_format():
+    """エラーが {field, code, message} のリストで、宣言順に全て返るか"""
+    print("\n=== エラー形式テスト ===")
+    data = {
+        'user_id_hash': 'user', 'consent': 'yes', 'mode': 'group', 'event_tag': 'work_late',
+        'meaning_text': 'abc', 'rt_ms': -5, 'event_text': 7,
+    }
+    expected = [
+        {'field': 'user_id_hash', 'code': 'pattern', 'message': 'invalid format'},
+        {'field': 'timestamp', 'code': 'required', 'message': 'required'},
+        {'field': 'consent', 'code': 'type', 'message': 'must be bool'},
+        {'field': 'mode', 'code': 'choice', 'message': 'not an allowed value'},
+        {'field': 'meaning_text', 'code': 'min_length', 'message': 'must be at least 5 characters'},
+        {'field': 'rt_ms', 'code': 'minimum', 'message': 'must be >= 0'},
+    ]
+    errors = RECORD_SCHEMA.validate(data)
+    # event_text の 7 は文字列に変換して受け付ける
+    if errors != expected or data['event_text'] != '7':
+        print(f"❌ {errors}")
+        return False
+    if RECORD_SCHEMA.validate([]) != [{'field': None, 'code': 'type', 'message': 'must be an object'}]:
+        print("❌ オブジェクト以外のエラー")
+        return False
+    print("✅ フィールド単位のエラーを宣言順に返す")
+    return True
+
+
+def test_meaning_schema():
+    """/api/entries: 未指定・null は従来どおり空文字、mode は solo / social のみ"""
+    print("\n=== MEANING_SCHEMA テスト ===")
+    data = {'personal_meaning': '学びになった', 'event_category': None}
+    errors = MEANING_SCHEMA.validate(data)
+    failures = []
+    if errors or data['event_category'] != '' or data['event_description'] != '' or data['mode'] != 'solo':
+        failures.append(f'既定値 {errors} {data}')
+    if [error['code'] for error in MEANING_SCHEMA.validate({'mode': 'group', 'meaning_tags': []})] != [
+            'type', 'choice']:
+        failures.append('型違い・mode の拒否')
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 既定値を補い、型違いと不正な mode を拒否")
+    return True
+
+
+def test_csv_import_values():
+    """CSV の文字列の値(rt_ms・consent)は取り込み側で変換してからスキーマに渡す"""
+    print("\n=== CSV の値の変換テスト ===")
+    from import_records import normalize_row
+
+    row = {
+        'record_id': 'rec_1', 'timestamp': TIMESTAMP, 'mode': 'solo', 'event_tag': 'work_late',
+        'meaning_text': '残業で疲れた一日', 'reaction_time_ms': ' 2000 ', 'consent': 'True',
+    }
+    data = normalize_row(row)
+    errors = RECORD_SCHEMA.validate(data)
+    if errors or data['rt_ms'] != 2000 or data['consent'] is not True:
+        print(f"❌ {errors} {data}")
+        return False
+    bad = normalize_row(dict(row, reaction_time_ms='2.5'))
+    if [error['field'] for error in RECORD_SCHEMA.validate(bad)] != ['rt_ms']:
+        print("❌ 整数でない rt_ms を受け付けています")
+        return False
+    print("✅ CSV の整数・真偽値を変換して受け付ける")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - 送信データのスキーマテスト")
+    print("=" * 50)
+
+    results = [
+        ("従来の検証との一致", test_fuzz_equivalence()),
+        ("意図的な差分", test_intended_differences()),
+        ("エラー形式", test_error_format()),
+        ("MEANING_SCHEMA", test_meaning_schema()),
+        ("CSV の値の変換", test_csv_import_values()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - まとめて送信(/submit/batch)テスト
+parse_submission_batch(JSON 配列 / NDJSON)と process_submission_batch の項目毎の結果、
+バッチ内の重複判定、空・上限超過のエラー、1トランザクションでの保存を一時DBで確認します
+
+    python dev_tools/test_submit_batch.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from server import (
+    INVALID_JSON_ITEM, SUBMIT_BATCH_MAX_ITEMS, ApiError, DatabaseManager, MeaningDiversityServer,
+    parse_submission_batch
+)
+from db_pool import close_all_pools
+from write_queue import close_all_writers
+
+
+def submission(i, text='まとめて送った意味づけです'):
+    return {
+        'user_id_hash': f'anon_batch_{i}',
+        'timestamp': '2025-09-21T10:30:00Z',
+        'consent': True,
+        'mode': 'solo',
+        'event_tag': 'work_late',
+        'meaning_text': f'{text}{i}',
+        'rt_ms': 2000,
+    }
+
+
+class TemporaryDatabase:
+    """一時ディレクトリをカレントにして、ハンドラーが使う共有の DatabaseManager を一時DBにする"""
+
+    def __enter__(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._tempdir.name)
+        DatabaseManager.reset_shared()
+        return DatabaseManager.shared()
+
+    def __exit__(self, *exc_info):
+        close_all_writers()
+        close_all_pools()
+        DatabaseManager.reset_shared()
+        os.chdir(self._cwd)
+        self._tempdir.cleanup()
+
+
+def stored_records(db):
+    with db.pool.connection() as conn:
+        return {row[0]: (row[1], json.loads(row[2])) for row in conn.execute(
+            'SELECT id, user_id_hash, quality_flags FROM records')}
+
+
+def test_parse_batch():
+    """JSON 配列・NDJSON の解析と、解析できない行の扱い"""
+    print("=== バッチの解析テスト ===")
+    failures = []
+    items = [submission(0), submission(1)]
+    if parse_submission_batch(json.dumps(items).encode('utf-8')) != items:
+        failures.append('JSON 配列')
+    if parse_submission_batch(b'  \n' + json.dumps(items).encode('utf-8')) != items:
+        failures.append('先頭に空白のある JSON 配列')
+    ndjson = (json.dumps(items[0]) + '\n{bad line\n\n' + json.dumps(items[1]) + '\r\n').encode('utf-8')
+    parsed = parse_submission_batch(ndjson)
+    if parsed != [items[0], INVALID_JSON_ITEM, items[1]]:
+        failures.append(f'NDJSON の解析できない行 {parsed}')
+    if parse_submission_batch(b'') != [] or parse_submission_batch(b'\n\n') != []:
+        failures.append('空のボディは空のバッチ')
+    for body in (b'[{"a": 1}', b'\xff\xfe', b'[1, 2'):
+        try:
+            parse_submission_batch(body)
+            failures.append(f'{body!r} は 400')
+        except ApiError as e:
+            if e.status != 400:
+                failures.append(f'{body!r} は 400({e.status})')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ JSON 配列・NDJSON を解析し、壊れた行は項目毎のエラーにする")
+    return True
+
+
+def test_mixed_items():
+    """有効・無効が混ざったバッチで、有効な項目だけを保存し項目毎の結果を返すか"""
+    print("\n=== 有効・無効の混在テスト ===")
+    failures = []
+    with TemporaryDatabase() as db:
+        body = (json.dumps(submission(0)) + '\n{bad\n' + json.dumps({'consent': True}) + '\n'
+                + json.dumps(submission(3)) + '\n"text"\n').encode('utf-8')
+        result = MeaningDiversityServer.process_submission_batch(parse_submission_batch(body))
+        stored = stored_records(db)
+
+    results = result['results']
+    if (result['success'], result['inserted'], result['failed']) != (False, 2, 3):
+        failures.append(f"件数 {result['inserted']}/{result['failed']}")
+    if [item['index'] for item in results] != list(range(5)):
+        failures.append('index の順序')
+    if [item['success'] for item in results] != [True, False, False, True, False]:
+        failures.append(f"項目毎の成否 {[item['success'] for item in results]}")
+    else:
+        if results[1]['errors'][0]['code'] != 'json':
+            failures.append('解析できない行は json エラー')
+        if not {'user_id_hash', 'timestamp'} <= {error['field'] for error in results[2]['errors']}:
+            failures.append('必須項目のエラー')
+        if results[4]['errors'][0]['code'] != 'type':
+            failures.append('オブジェクト以外は type エラー')
+        saved = {results[0]['record_id']: 'anon_batch_0', results[3]['record_id']: 'anon_batch_3'}
+        if {record_id: user for record_id, (user, _) in stored.items()} != saved:
+            failures.append(f'保存された記録 {stored}')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 有効な2件を保存し、無効な3件は項目毎のエラーを返す")
+    return True
+
+
+def test_duplicates_in_batch():
+    """同じバッチの先行する項目・保存済みの記録との重複に duplicate フラグが付くか"""
+    print("\n=== バッチ内の重複テスト ===")
+    failures = []
+    with TemporaryDatabase() as db:
+        MeaningDiversityServer.process_submission(submission(9))
+        first = submission(1)
+        # 正規化すると同じ意味づけ(前後の空白・全角)
+        again = dict(first, meaning_text=f"  {first['meaning_text'].replace('1', '１')} ")
+        items = [first, submission(2), again, submission(9)]
+        result = MeaningDiversityServer.process_submission_batch(items)
+        stored = stored_records(db)
+
+    if result['inserted'] != 4:
+        failures.append(f"重複も保存する({result['inserted']}件)")
+    else:
+        flags = [stored[item['record_id']][1]['duplicate'] for item in result['results']]
+        if flags != [False, False, True, True]:
+            failures.append(f'duplicate フラグ {flags}')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ バッチ内の先行項目・保存済みの記録との重複を判定")
+    return True
+
+
+def test_batch_size_errors():
+    """空のバッチは 400、上限超過は 413 で何も保存しないか"""
+    print("\n=== 空・上限超過テスト ===")
+    failures = []
+    with TemporaryDatabase() as db:
+        for items, expected in (([], 400), ([submission(i) for i in range(SUBMIT_BATCH_MAX_ITEMS + 1)], 413)):
+            try:
+                MeaningDiversityServer.process_submission_batch(items)
+                failures.append(f'{len(items)}件は {expected}')
+            except ApiError as e:
+                if e.status != expected:
+                    failures.append(f'{len(items)}件は {expected}({e.status})')
+        stored = stored_records(db)
+    if stored:
+        failures.append(f'{len(stored)}件が保存された')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 0件は 400、{SUBMIT_BATCH_MAX_ITEMS + 1}件は 413")
+    return True
+
+
+def test_single_transaction():
+    """バッチの全件を1回の書き込み(1トランザクション)で保存し、途中の失敗で全件を巻き戻すか"""
+    print("\n=== 1トランザクションでの保存テスト ===")
+    failures = []
+    with TemporaryDatabase() as db:
+        before = db.writer.stats()
+        result = MeaningDiversityServer.process_submission_batch([submission(i) for i in range(20)])
+        after = db.writer.stats()
+        if result['inserted'] != 20 or len(stored_records(db)) != 20:
+            failures.append(f"保存件数 {result['inserted']}")
+        # 書き込みキューの1操作が1トランザクションになる
+        if after['committed'] - before['committed'] != 1:
+            failures.append(f"書き込み {after['committed'] - before['committed']}回")
+
+        # 途中の項目で挿入が失敗したら、先に挿入した項目も残らない
+        original = DatabaseManager._insert_record
+        inserted = []
+
+        def failing_insert(self, conn, record_id, data, *args):
+            if len(inserted) == 3:
+                raise RuntimeError('insert failed')
+            inserted.append(record_id)
+            return original(self, conn, record_id, data, *args)
+
+        DatabaseManager._insert_record = failing_insert
+        try:
+            MeaningDiversityServer.process_submission_batch([submission(i) for i in range(100, 110)])
+            failures.append('挿入の失敗は例外になる')
+        except RuntimeError:
+            pass
+        finally:
+            DatabaseManager._insert_record = original
+        stored = stored_records(db)
+        if any(record_id in stored for record_id in inserted) or len(stored) != 20:
+            failures.append(f'失敗したバッチの {len(stored) - 20}件が残っている')
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 20件を1回のコミットで保存し、途中で失敗したバッチは全件巻き戻した")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - まとめて送信テスト")
+    print("=" * 50)
+
+    results = [
+        ("バッチの解析", test_parse_batch()),
+        ("有効・無効の混在", test_mixed_items()),
+        ("バッチ内の重複", test_duplicates_in_batch()),
+        ("空・上限超過", test_batch_size_errors()),
+        ("1トランザクション", test_single_transaction()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
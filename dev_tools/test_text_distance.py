@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 編集距離テスト
+ビット並列の編集距離・平均意味距離が従来の DP 実装と一致すること、複数プロセスでの
+全組計算が1プロセスと同じ値になること、抽出による推定の信頼区間を確認します
+
+    python dev_tools/test_text_distance.py
+"""
+
+import glob
+import os
+import random
+import signal
+import statistics
+import sys
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import text_distance
+from text_distance import (
+    MIN_SAMPLE_PAIRS, PARALLEL_MIN_PAIRS, close_distance_executors, estimate_mean_pairwise_distance,
+    get_distance_executor, levenshtein, mean_pairwise_distance, normalized_distance, row_blocks
+)
+
+# 64文字(機械語1語)をまたぐ長さ・小文字にすると文字数が変わる文字(İ)を含める
+ALPHABET = 'abcAB あいう意味İ'
+
+
+def legacy_levenshtein(s1, s2):
+    """変更前の simple_text_distance の DP"""
+    if len(s1) < len(s2):
+        return legacy_levenshtein(s2, s1)
+    if len(s2) == 0:
+        return len(s1)
+    previous_row = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1
+            deletions = current_row[j] + 1
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+    return previous_row[-1]
+
+
+def legacy_normalized_distance(text1, text2):
+    distance = legacy_levenshtein(text1.lower(), text2.lower())
+    max_len = max(len(text1), len(text2))
+    return distance / max_len if max_len > 0 else 0
+
+
+def legacy_mean_pairwise_distance(texts):
+    """変更前の calculate_semantic_distance_avg"""
+    if len(texts) < 2:
+        return 0
+    distances = []
+    for i in range(len(texts)):
+        for j in range(i + 1, len(texts)):
+            distances.append(legacy_normalized_distance(texts[i], texts[j]))
+    return statistics.mean(distances) if distances else 0
+
+
+def random_text(rng, max_length):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def random_texts(rng, count, max_length=30):
+    """重複・空文字を含むテキストの一覧"""
+    texts = [random_text(rng, max_length) for _ in range(count)]
+    texts[::7] = [''] * len(texts[::7])
+    texts[1::5] = texts[:len(texts[1::5])]
+    return texts
+
+
+def test_levenshtein_fuzz():
+    """ランダムな文字列で levenshtein・normalized_distance が DP と一致するか"""
+    print("=== 編集距離の一致テスト ===")
+    rng = random.Random(23)
+    mismatches = []
+    for _ in range(3000):
+        text1 = random_text(rng, 150)
+        text2 = random_text(rng, 150) if rng.random() < 0.8 else text1[:rng.randint(0, len(text1))]
+        if levenshtein(text1, text2) != legacy_levenshtein(text1, text2):
+            mismatches.append((text1, text2))
+        elif normalized_distance(text1, text2) != legacy_normalized_distance(text1, text2):
+            mismatches.append((text1, text2))
+    if mismatches:
+        print(f"❌ {len(mismatches)}組が一致しません(例: {mismatches[0]})")
+        return False
+    print("✅ 3000組で一致")
+    return True
+
+
+def test_mean_equality():
+    """mean_pairwise_distance が従来の平均と完全に同じ値になるか"""
+    print("\n=== 平均距離の一致テスト ===")
+    rng = random.Random(24)
+    cases = [[], ['ひとつ'], ['', ''], random_texts(rng, 40), random_texts(rng, 120, 80)]
+    for texts in cases:
+        expected = legacy_mean_pairwise_distance(texts)
+        actual = mean_pairwise_distance(texts)
+        if actual != expected:
+            print(f"❌ {len(texts)}件: {actual} != {expected}")
+            return False
+    print(f"✅ {len(cases)}通りの入力で一致")
+    return True
+
+
+def test_row_blocks():
+    """row_blocks が全ての行を重複なく連続した区間に分けるか"""
+    print("\n=== 行ブロック分割テスト ===")
+    for count in range(0, 80):
+        for blocks in range(1, 13):
+            bounds = row_blocks(count, blocks)
+            rows = [row for start, stop in bounds for row in range(start, stop)]
+            pairs = sum(count - 1 - row for row in rows)
+            if pairs != count * (count - 1) // 2 or rows != sorted(set(rows)) or len(bounds) > blocks + 1:
+                print(f"❌ count={count}, blocks={blocks}: {bounds}")
+                return False
+    print("✅ 全ての組がちょうど1度ずつ含まれる")
+    return True
+
+
+def test_parallel_equality():
+    """複数プロセスの全組計算が1プロセスと同じ値になり、一時ファイルを残さないか"""
+    print("\n=== 複数プロセスの一致テスト ===")
+    rng = random.Random(25)
+    count = 1
+    while count * (count - 1) // 2 < PARALLEL_MIN_PAIRS:
+        count += 1
+    pattern = os.path.join(tempfile.gettempdir(), 'kotoimi-distance-*')
+    before = set(glob.glob(pattern))
+    try:
+        failures = []
+        for texts in (random_texts(rng, count), random_texts(rng, count + 37, 60)):
+            serial = mean_pairwise_distance(texts)
+            for workers in (2, 3):
+                parallel = mean_pairwise_distance(texts, workers)
+                if parallel != serial:
+                    failures.append(f'{len(texts)}件・{workers}プロセス: {parallel} != {serial}')
+        if get_distance_executor(2) is not get_distance_executor(2):
+            failures.append('プロセスプールが使い回されていない')
+    finally:
+        close_distance_executors()
+    leftover = set(glob.glob(pattern)) - before
+    if leftover:
+        failures.append(f'一時ファイルが残っている: {sorted(leftover)}')
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ {count}件以上の入力で 2・3プロセスとも1プロセスと一致")
+    return True
+
+
+def break_executor(executor):
+    """プールのワーカープロセスを SIGKILL で落とし、プールが壊れたと検出されるまで待つ"""
+    executor.submit(os.getpid).result()
+    for pid in list(executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    try:
+        while True:
+            executor.submit(os.getpid).result()
+    except BrokenProcessPool:
+        pass
+    return executor
+
+
+def test_broken_pool_recovery():
+    """ワーカーが落ちたプールを捨てて作り直し、作り直しても壊れていれば1プロセスで計算するか"""
+    print("\n=== 壊れたプロセスプールの作り直しテスト ===")
+    rng = random.Random(27)
+    count = 1
+    while count * (count - 1) // 2 < PARALLEL_MIN_PAIRS:
+        count += 1
+    texts = random_texts(rng, count)
+    serial = mean_pairwise_distance(texts)
+    failures = []
+    original = text_distance.get_distance_executor
+    try:
+        broken = break_executor(get_distance_executor(2))
+        if mean_pairwise_distance(texts, 2) != serial:
+            failures.append('作り直したプールでの計算が1プロセスと一致しない')
+        replacement = get_distance_executor(2)
+        if replacement is broken:
+            failures.append('壊れたプールが使い回されている')
+        elif replacement.submit(os.getpid).result() == os.getpid():
+            failures.append('作り直したプールが別プロセスで動いていない')
+
+        # 取得するプールが毎回壊れていれば、やり直しは1度だけで1プロセスの計算に切り替える
+        created = []
+
+        def broken_executor(workers):
+            created.append(workers)
+            return break_executor(original(workers))
+
+        text_distance.get_distance_executor = broken_executor
+        if mean_pairwise_distance(texts, 2) != serial:
+            failures.append('1プロセスへの切り替え後の値が一致しない')
+        if len(created) != 2:
+            failures.append(f'プールを{len(created)}回取得(期待値 2)')
+    finally:
+        text_distance.get_distance_executor = original
+        close_distance_executors()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 壊れたプールを作り直し、2回続けて壊れたら1プロセスで計算")
+    return True
+
+
+def test_estimator():
+    """推定: 小さい入力は全組計算、同じ種なら同じ結果、信頼区間が真値を含む割合"""
+    print("\n=== 平均距離の推定テスト ===")
+    rng = random.Random(26)
+    texts = random_texts(rng, 120)
+    truth = mean_pairwise_distance(texts)
+    failures = []
+
+    small = estimate_mean_pairwise_distance(texts[:20], max_pairs=1000)
+    if not small['exact'] or small['estimate'] != mean_pairwise_distance(texts[:20]):
+        failures.append('全組数が max_pairs 以下なら全組計算')
+    for empty in ([], ['ひとつ']):
+        summary = estimate_mean_pairwise_distance(empty)
+        if summary['estimate'] != 0 or summary['total_pairs'] != 0 or not summary['exact']:
+            failures.append(f'{len(empty)}件の入力')
+
+    first = estimate_mean_pairwise_distance(texts, max_pairs=200, rng=random.Random(7))
+    second = estimate_mean_pairwise_distance(texts, max_pairs=200, rng=random.Random(7))
+    if first != second or first['exact'] or first['pairs_used'] != 200:
+        failures.append('同じ種で同じ推定')
+
+    runs = 200
+    covered = sum(
+        summary['ci_low'] <= truth <= summary['ci_high']
+        for summary in (estimate_mean_pairwise_distance(texts, max_pairs=300, rng=random.Random(seed))
+                        for seed in range(runs))
+    )
+    if covered / runs < 0.9:
+        failures.append(f'95%信頼区間が真値を含む割合 {covered / runs:.2f}')
+
+    target = estimate_mean_pairwise_distance(texts, max_pairs=5000, target_se=0.01,
+                                             rng=random.Random(8))
+    if not (target['standard_error'] <= 0.01 and MIN_SAMPLE_PAIRS <= target['pairs_used'] < 5000):
+        failures.append(f"target_se で打ち切り(se={target['standard_error']}, 組数={target['pairs_used']})")
+
+    try:
+        estimate_mean_pairwise_distance(texts, max_pairs=1)
+        failures.append('max_pairs=1 は ValueError')
+    except ValueError:
+        pass
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ 信頼区間が真値を含む割合 {covered / runs:.2f}、target_se で {target['pairs_used']}組で打ち切り")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - 編集距離テスト")
+    print("=" * 50)
+
+    results = [
+        ("編集距離の一致", test_levenshtein_fuzz()),
+        ("平均距離の一致", test_mean_equality()),
+        ("行ブロック分割", test_row_blocks()),
+        ("複数プロセスの一致", test_parallel_equality()),
+        ("壊れたプールの作り直し", test_broken_pool_recovery()),
+        ("平均距離の推定", test_estimator()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+# 複数プロセスのテストは forkserver / spawn でこのファイルを読み込み直すため、
+# 実行はこのガードの中だけで行う
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
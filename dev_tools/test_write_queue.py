@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - グループコミット書き込みキューテスト
+GroupCommitWriter が同時の書き込みを1回のコミットにまとめ、1件の失敗をセーブポイントで
+切り離し、コミットの失敗を全員に通知し、close() でキューを流し切ることを一時DBで確認します
+
+    python dev_tools/test_write_queue.py
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from db_pool import ConnectionPool
+from write_queue import GroupCommitWriter
+
+
+def create_pool(workdir):
+    """items テーブルと、コミット時に検査される外部キーを持つ一時DBのプール"""
+    pool = ConnectionPool(os.path.join(workdir, 'queue.db'), size=2, timeout=5)
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE items (value INTEGER UNIQUE)')
+        conn.execute('CREATE TABLE parents (id INTEGER PRIMARY KEY)')
+        conn.execute('''
+            CREATE TABLE children (
+                parent_id INTEGER REFERENCES parents(id) DEFERRABLE INITIALLY DEFERRED
+            )
+        ''')
+        conn.commit()
+    return pool
+
+
+def insert(value):
+    def operation(conn):
+        conn.execute('INSERT INTO items (value) VALUES (?)', (value,))
+        return value
+    return operation
+
+
+def stored_values(pool):
+    with pool.connection() as conn:
+        return sorted(row[0] for row in conn.execute('SELECT value FROM items'))
+
+
+def test_batches_into_one_commit():
+    """待ち時間内に届いた書き込みを1トランザクションでコミットするか"""
+    print("=== グループコミットテスト ===")
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = create_pool(workdir)
+        writer = GroupCommitWriter(pool, max_batch=10, max_wait_ms=2000)
+        commits = []
+        with pool.connection() as conn:
+            conn.set_trace_callback(lambda sql: commits.append(sql) if sql == 'COMMIT' else None)
+        try:
+            started = time.monotonic()
+            futures = [writer.submit(insert(value)) for value in range(10)]
+            results = [future.result(5) for future in futures]
+            elapsed = time.monotonic() - started
+            stats = writer.stats()
+            if results != list(range(10)) or stored_values(pool) != list(range(10)):
+                failures.append(f'結果 {results}')
+            if (stats['batches'], stats['committed'], stats['max_batch_seen']) != (1, 10, 10):
+                failures.append(f'統計 {stats}')
+            if len(commits) != 1:
+                failures.append(f'COMMIT の回数 {len(commits)}')
+            # max_batch に達したら待ち時間の終わりを待たずにコミットする
+            if elapsed >= 2:
+                failures.append(f'max_batch に達してもコミットを待った({elapsed:.2f}秒)')
+        finally:
+            writer.close()
+            pool.close()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 10件の書き込みを1回のコミットにまとめた")
+    return True
+
+
+def test_savepoint_isolation():
+    """失敗した1件だけを巻き戻し、同じバッチの他の書き込みはコミットするか"""
+    print("\n=== セーブポイントによる切り離しテスト ===")
+    failures = []
+
+    def insert_then_fail(conn):
+        conn.execute('INSERT INTO items (value) VALUES (2)')
+        raise ValueError('operation failed')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = create_pool(workdir)
+        writer = GroupCommitWriter(pool, max_batch=4, max_wait_ms=2000)
+        try:
+            futures = [
+                writer.submit(insert(1)),
+                writer.submit(insert_then_fail),
+                writer.submit(insert(1)),
+                writer.submit(insert(3)),
+            ]
+            outcomes = []
+            for future in futures:
+                error = future.exception(5)
+                outcomes.append(type(error).__name__ if error else future.result())
+            if outcomes != [1, 'ValueError', 'IntegrityError', 3]:
+                failures.append(f'項目毎の結果 {outcomes}')
+            if stored_values(pool) != [1, 3]:
+                failures.append(f'失敗した書き込みが残っている {stored_values(pool)}')
+            stats = writer.stats()
+            if (stats['batches'], stats['committed'], stats['failed']) != (1, 2, 2):
+                failures.append(f'統計 {stats}')
+        finally:
+            writer.close()
+            pool.close()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ 失敗した2件だけを巻き戻し、残りの2件をコミット")
+    return True
+
+
+def test_commit_failure():
+    """コミット自体が失敗したら、バッチの全員に同じ例外を通知し何も残さないか"""
+    print("\n=== コミット失敗テスト ===")
+    failures = []
+
+    def insert_orphan(conn):
+        # 遅延外部キーの違反は COMMIT の時点で初めて検出される
+        conn.execute('INSERT INTO children (parent_id) VALUES (42)')
+        return 'orphan'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = create_pool(workdir)
+        # プールの接続(size=2)の両方で外部キーの検査を有効にする
+        held = [pool.acquire() for _ in range(2)]
+        for conn in held:
+            conn.execute('PRAGMA foreign_keys = ON')
+            pool.release(conn)
+        writer = GroupCommitWriter(pool, max_batch=3, max_wait_ms=2000)
+        try:
+            futures = [writer.submit(insert(1)), writer.submit(insert_orphan), writer.submit(insert(2))]
+            errors = [future.exception(5) for future in futures]
+            if not all(isinstance(error, sqlite3.IntegrityError) for error in errors):
+                failures.append(f'全員に IntegrityError {errors}')
+            elif len({id(error) for error in errors}) != 1:
+                failures.append('全員に同じ例外')
+            if stored_values(pool):
+                failures.append('失敗したバッチの書き込みが残っている')
+            stats = writer.stats()
+            if (stats['committed'], stats['failed']) != (0, 3):
+                failures.append(f'統計 {stats}')
+            # ライターは次のバッチを続けて処理できる
+            if writer.execute(insert(5), timeout=5) != 5 or stored_values(pool) != [5]:
+                failures.append('失敗後の書き込み')
+        finally:
+            writer.close()
+            pool.close()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print("✅ コミットの失敗を3件全員に通知し、次のバッチは書き込めた")
+    return True
+
+
+def test_close_drains_queue():
+    """close() がキューに残った書き込みを全て処理してから戻るか"""
+    print("\n=== close の流し切りテスト ===")
+    failures = []
+
+    def slow_insert(value):
+        def operation(conn):
+            time.sleep(0.05)
+            conn.execute('INSERT INTO items (value) VALUES (?)', (value,))
+            return value
+        return operation
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pool = create_pool(workdir)
+        # 1件ずつコミットさせ、close の時点でキューに書き込みが残るようにする
+        writer = GroupCommitWriter(pool, max_batch=1, max_wait_ms=0)
+        try:
+            futures = [writer.submit(slow_insert(value)) for value in range(10)]
+            pending = writer.stats()['pending']
+            writer.close(timeout=10)
+            if pending == 0:
+                failures.append('close の時点でキューが空だった')
+            if not all(future.done() for future in futures):
+                failures.append('close が処理前に戻った')
+            elif [future.result() for future in futures] != list(range(10)):
+                failures.append('書き込みの結果')
+            if stored_values(pool) != list(range(10)):
+                failures.append(f'書き込まれた値 {stored_values(pool)}')
+            try:
+                writer.submit(insert(99))
+                failures.append('close 後の submit は RuntimeError')
+            except RuntimeError:
+                pass
+        finally:
+            writer.close()
+            pool.close()
+
+    if failures:
+        print(f"❌ {', '.join(failures)}")
+        return False
+    print(f"✅ キューに残った{pending}件を処理してから停止")
+    return True
+
+
+def run_all_tests():
+    """全てのテストを実行"""
+    print("ことイミ日記 - グループコミット書き込みキューテスト")
+    print("=" * 50)
+
+    results = [
+        ("グループコミット", test_batches_into_one_commit()),
+        ("セーブポイント", test_savepoint_isolation()),
+        ("コミット失敗", test_commit_failure()),
+        ("close の流し切り", test_close_drains_queue()),
+    ]
+
+    print("\n" + "=" * 50)
+    for test_name, result in results:
+        status = "✅ 成功" if result else "❌ 失敗"
+        print(f"{test_name:<20}: {status}")
+
+    success_count = sum(1 for _, result in results if result)
+    print(f"\n成功: {success_count}/{len(results)}")
+    return success_count == len(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_all_tests() else 1)
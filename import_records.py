@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - records の一括インポート
+export_research_data(dev_tools/research_data_analyzer.py)と同じ列の CSV、
+または /submit と同じ項目の NDJSON を読み込み、送信時と同じ検証・品質フラグを
+付けて大きなトランザクション単位で書き込む
+
+    python import_records.py research_data_20250921.csv
+    python import_records.py archive.ndjson --chunk-size 100000
+    python import_records.py archive.ndjson --resume        # 中断した位置から再開
+
+既定では records の二次インデックスを外してから書き込み、最後にインデックスと
+分布カウンタ・タグ索引・サンプルリザーバーをまとめて作り直す。サーバーの
+稼働中に少量を取り込む場合は --no-defer-indexes を使う。
+
+重複判定は timestamp の古い順に読むことを前提にしている(判定の期間を過ぎた
+記録はウィンドウから捨てる)ため、user_id_hash のある入力は timestamp の昇順に
+並べておくこと。前の行より古い timestamp があればその行で取り込みを中止する。
+"""
+
+import argparse
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import sys
+import time
+
+from dedup import DuplicateWindow, content_hash
+from quality_flags import analyze_records, apply_quality_flags, load_quality_flags
+from sample_reservoir import rebuild_sample_reservoirs
+from server import (
+    INVALID_JSON_ERRORS, INVALID_JSON_ITEM, RECORD_INSERT_SQL, DatabaseManager,
+    rebuild_distribution_counts, record_values
+)
+from submission_schema import RECORD_SCHEMA
+from tag_index import rebuild_record_tags
+from write_queue import close_all_writers
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# export_research_data の列名 -> /submit の項目名
+EXPORT_COLUMN_ALIASES = {
+    'record_id': 'id',
+    'reaction_time_ms': 'rt_ms',
+    'saw_alternatives': 'saw_alt_meanings',
+}
+BOOLEAN_COLUMNS = ('consent', 'saw_alt_meanings', 'changed_after_view')
+INTEGER_COLUMNS = ('rt_ms',)
+TRUE_VALUES = frozenset(['1', 'true', 't', 'yes'])
+FALSE_VALUES = frozenset(['0', 'false', 'f', 'no', ''])
+
+# CSV のヘッダーに無い列の既定値(export_research_data は user_id_hash を出力せず、
+# 同意済みのデータのみを出力する)。NDJSON には適用せず /submit と同じく必須にする
+DEFAULT_VALUES = {
+    'user_id_hash': 'anon_import',
+    'consent': True,
+}
+
+TIMESTAMP_ERROR = {'field': 'timestamp', 'code': 'format', 'message': 'invalid ISO 8601 timestamp'}
+
+INSERT_OR_IGNORE_SQL = RECORD_INSERT_SQL.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1)
+
+# インデックスを外して書き込む間も残すインデックス(既存記録との重複判定の読み込み用)
+KEPT_INDEXES = frozenset(['idx_records_received_at'])
+
+
+def parse_bool(value):
+    """CSV の真偽値('1' / 'True' など)を bool にする(解釈できなければそのまま)"""
+    if isinstance(value, str) and value.strip().lower() in TRUE_VALUES:
+        return True
+    if isinstance(value, str) and value.strip().lower() in FALSE_VALUES:
+        return False
+    if isinstance(value, int):
+        return bool(value)
+    return value
+
+
+def parse_int(value):
+    """CSV の整数('2000' など)を int にする(解釈できなければそのまま)"""
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return value
+    return value
+
+
+def parse_timestamp(value):
+    """ISO 8601 の時刻を UNIX 時刻にする(タイムゾーンの無いものは UTC とみなす)"""
+    try:
+        parsed = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def normalize_row(row, defaults=DEFAULT_VALUES):
+    """CSV の列名・文字列の値を /submit の項目に合わせる
+
+    defaults はヘッダーに列が無い場合だけ使う(列があって空の値は補わない)。
+    """
+    data = {}
+    for key, value in row.items():
+        data[EXPORT_COLUMN_ALIASES.get(key, key)] = value
+    for key, value in defaults.items():
+        if key not in data:
+            data[key] = value
+    for key in BOOLEAN_COLUMNS:
+        if key in data:
+            data[key] = parse_bool(data[key])
+    for key in INTEGER_COLUMNS:
+        if key in data:
+            data[key] = parse_int(data[key])
+    revision_count = data.get('revision_count')
+    if isinstance(revision_count, str):
+        data['revision_count'] = int(revision_count) if revision_count.strip().isdigit() else 0
+    return data
+
+
+def read_rows(stream, fmt):
+    """入力を1件ずつ返す(NDJSON は解析前の行、空行は数えない)"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield line
+
+
+def decode_row(row, fmt):
+    if fmt == 'csv':
+        return row
+    try:
+        return json.loads(row)
+    except json.JSONDecodeError:
+        return INVALID_JSON_ITEM
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return 'ndjson'
+    raise ValueError(f'形式を判別できません(--format で指定してください): {path}')
+
+
+class ImportState:
+    """再開位置と外したインデックスを記録する状態ファイル"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.dropped_indexes = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            self.offset = saved.get('offset', 0)
+            self.dropped_indexes = [tuple(index) for index in saved.get('dropped_indexes', [])]
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'offset': self.offset, 'dropped_indexes': self.dropped_indexes}, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RecordImporter:
+    """検証・品質フラグ付けをしながら records にチャンク単位で書き込む
+
+    重複は記録の timestamp を受信時刻として、取り込むデータ同士と DB の既存記録
+    (content_hash のある記録)を対象に判定する。既存記録は判定する時刻の前後の
+    期間だけを必要になった時に読み込む。判定する記録は timestamp の昇順でなければ
+    ならず、前の記録より古いものは ValueError にする。
+    """
+
+    def __init__(self, db, chunk_size=DEFAULT_CHUNK_SIZE, sanitize=False, defer_indexes=True,
+                 defaults=DEFAULT_VALUES, rejects=None, progress=True):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.schema = RECORD_SCHEMA if sanitize else RECORD_SCHEMA.without_sanitize()
+        self.defer_indexes = defer_indexes
+        self.defaults = defaults
+        self.rejects = rejects
+        self.progress = progress
+        self.dedup = DuplicateWindow(authoritative=True)
+        self.dedup.load([], float('-inf'))
+        self._loaded_periods = set()
+        self._latest_received_at = float('-inf')
+        self.stats = {
+            'read': 0,
+            'inserted': 0,
+            'existing': 0,
+            'rejected': 0,
+            'duplicates': 0,
+        }
+        self._started_at = None
+
+    def prepare(self, line, row, fmt='ndjson'):
+        """1件を検証して書き込み用の値を返す(不正なら None)"""
+        if row is INVALID_JSON_ITEM:
+            return self.reject(line, INVALID_JSON_ERRORS)
+        # NDJSON は /submit と同じ項目なのでそのまま検証する
+        data = normalize_row(row, self.defaults) if fmt == 'csv' else row
+        errors = self.schema.validate(data)
+        if errors:
+            return self.reject(line, errors)
+        received_at = parse_timestamp(data['timestamp'])
+        if received_at is None:
+            return self.reject(line, [TIMESTAMP_ERROR])
+
+        record_hash = content_hash(data['user_id_hash'], data['event_tag'], data['meaning_text'])
+        if 'user_id_hash' in row:
+            # ウィンドウは古い記録から捨てるので、時刻を遡ると捨てた記録との重複を見逃す
+            if received_at < self._latest_received_at:
+                raise ValueError(
+                    f"{line + 1:,} 件目の timestamp ({data['timestamp']}) が前の記録より古いため、"
+                    "重複を判定できません(timestamp の昇順に並べ替えてから取り込んでください)"
+                )
+            self._latest_received_at = received_at
+            self.load_existing_hashes(received_at)
+            is_duplicate = self.dedup.lookup(record_hash, received_at) is True
+            self.dedup.add(record_hash, received_at)
+        else:
+            # エクスポートには user_id_hash が無く利用者を区別できないので、保存時の判定を引き継ぐ
+            is_duplicate = bool(load_quality_flags(data.get('quality_flags')).get('duplicate', False))
+        if is_duplicate:
+            self.stats['duplicates'] += 1
+        apply_quality_flags(data, is_duplicate)
+        record_id = data.get('id') or self.db.generate_record_id()
+        return record_id, data, record_hash, received_at
+
+    def load_existing_hashes(self, received_at):
+        """received_at の重複判定に必要な期間の既存記録をウィンドウに読み込む
+
+        期間は重複判定の期間の長さで区切り、各期間は1度だけ読む。この取り込みで
+        書き込んだ記録も読まれることがあるが、同じハッシュ・時刻なので判定は変わらない。
+        """
+        window = self.dedup.window
+        period = math.floor(received_at / window)
+        for start in (period - 1, period):
+            if start in self._loaded_periods:
+                continue
+            self._loaded_periods.add(start)
+            with self.db.pool.connection() as conn:
+                rows = conn.execute('''
+                    SELECT content_hash, received_at FROM records
+                    WHERE received_at >= ? AND received_at < ? AND content_hash IS NOT NULL
+                    ORDER BY received_at
+                ''', (start * window, (start + 1) * window)).fetchall()
+            for key, seen_at in rows:
+                self.dedup.add(key, seen_at)
+
+    def reject(self, line, errors):
+        self.stats['rejected'] += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({'line': line, 'errors': errors}, ensure_ascii=False) + '\n')
+        return None
+
+    def write_chunk(self, prepared):
+        """1チャンクを1トランザクションで書き込むよう依頼し、追加件数の Future を返す"""
+        if self.defer_indexes:
+            def insert_chunk(conn):
+                before = conn.total_changes
+                conn.executemany(INSERT_OR_IGNORE_SQL, (
+                    record_values(record_id, data, record_hash, received_at)
+                    for record_id, data, record_hash, received_at in prepared
+                ))
+                return conn.total_changes - before
+        else:
+            # 分布カウンタ・タグ索引・リザーバーも1件ずつ更新する
+            def insert_chunk(conn):
+                inserted = 0
+                for record_id, data, record_hash, received_at in prepared:
+                    if conn.execute('SELECT 1 FROM records WHERE id = ?', (record_id,)).fetchone():
+                        continue
+                    self.db._insert_record(conn, record_id, data, record_hash, received_at)
+                    inserted += 1
+                return inserted
+        return self.db.writer.submit(insert_chunk)
+
+    def drop_indexes(self, state):
+        """records の二次インデックスを外し、作り直すための定義を状態ファイルに残す"""
+        def drop(conn):
+            indexes = conn.execute('''
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'index' AND tbl_name = 'records' AND sql IS NOT NULL
+            ''').fetchall()
+            indexes = [(name, sql) for name, sql in indexes if name not in KEPT_INDEXES]
+            for name, _ in indexes:
+                conn.execute(f'DROP INDEX "{name}"')
+            return indexes
+        dropped = self.db.writer.execute(drop)
+        known = {name for name, _ in state.dropped_indexes}
+        state.dropped_indexes.extend((name, sql) for name, sql in dropped if name not in known)
+        state.save()
+
+    def finish(self, state):
+        """外したインデックスと集計テーブルを作り直す"""
+        def restore(conn):
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            for name, sql in state.dropped_indexes:
+                if name not in existing:
+                    conn.execute(sql)
+            analyze_records(conn)
+        self.log('インデックスを作り直しています...')
+        self.db.writer.execute(restore)
+        state.dropped_indexes = []
+        state.save()
+        self.log('分布カウンタ・タグ索引・サンプルリザーバーを再計算しています...')
+        self.db.writer.execute(rebuild_distribution_counts)
+        self.db.writer.execute(rebuild_record_tags)
+        self.db.writer.execute(rebuild_sample_reservoirs)
+
+    def run(self, rows, fmt, state, offset=0):
+        """offset 件目から取り込み、統計を返す
+
+        チャンクの書き込み中に次のチャンクを準備する(書き込み待ちは1チャンクまで)。
+        """
+        self._started_at = time.time()
+        if self.defer_indexes:
+            self.drop_indexes(state)
+        pending = None
+        try:
+            line = offset
+            chunk = []
+            for row in rows:
+                self.stats['read'] += 1
+                prepared = self.prepare(line, decode_row(row, fmt), fmt)
+                line += 1
+                if prepared is not None:
+                    chunk.append(prepared)
+                if self.stats['read'] % self.chunk_size == 0:
+                    previous, pending = pending, (self.write_chunk(chunk), len(chunk), line)
+                    chunk = []
+                    if previous is not None:
+                        self.complete(state, *previous)
+            if chunk or pending is None:
+                previous, pending = pending, (self.write_chunk(chunk), len(chunk), line)
+                if previous is not None:
+                    self.complete(state, *previous)
+        finally:
+            try:
+                if pending is not None:
+                    self.complete(state, *pending)
+            finally:
+                if self.defer_indexes or state.dropped_indexes:
+                    self.finish(state)
+        state.remove()
+        return self.stats
+
+    def complete(self, state, future, size, line):
+        """書き込みの完了を待って再開位置を進める"""
+        inserted = future.result()
+        self.stats['inserted'] += inserted
+        self.stats['existing'] += size - inserted
+        state.offset = line
+        state.save()
+        if self.rejects is not None:
+            self.rejects.flush()
+        self.report(line)
+
+    def report(self, line):
+        elapsed = max(time.time() - self._started_at, 1e-9)
+        stats = self.stats
+        self.log(
+            f"{line:,} 行目まで: 追加 {stats['inserted']:,} / 既存 {stats['existing']:,} / "
+            f"不正 {stats['rejected']:,} / 重複 {stats['duplicates']:,} "
+            f"({stats['read'] / elapsed:,.0f} 行/秒)"
+        )
+
+    def log(self, message):
+        if self.progress:
+            print(message, file=sys.stderr, flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='ことイミ日記 records の一括インポート',
+        epilog='user_id_hash のある入力は timestamp の昇順に並べておくこと'
+               '(重複判定のため。前の行より古い timestamp があればその行で中止する)')
+    parser.add_argument('input', help='CSV / NDJSON ファイル(- で標準入力、--format が必要)')
+    parser.add_argument('--format', choices=('csv', 'ndjson'),
+                        help='入力形式(既定: 拡張子から判別)')
+    parser.add_argument('--db', default='kotoiminiki.db', help='書き込み先のデータベース')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='1トランザクションで書き込む行数')
+    parser.add_argument('--offset', type=int, default=None,
+                        help='この件数を読み飛ばしてから取り込む(ヘッダー・空行は数えない)')
+    parser.add_argument('--resume', action='store_true',
+                        help='状態ファイルに記録された位置から再開')
+    parser.add_argument('--state-file', help='再開位置の記録先(既定: 入力ファイル名.import-state.json)')
+    parser.add_argument('--sanitize', action='store_true',
+                        help='/submit と同じサニタイズを行う(エクスポートしたデータはサニタイズ済みなので既定はしない)')
+    parser.add_argument('--no-defer-indexes', dest='defer_indexes', action='store_false',
+                        help='インデックスを外さず、集計テーブルも1件ずつ更新する(稼働中のDBへの少量の取り込み向け)')
+    parser.add_argument('--user-id-hash', default=DEFAULT_VALUES['user_id_hash'],
+                        help='user_id_hash 列が無い CSV に使う値')
+    parser.add_argument('--rejects', help='不正な行を NDJSON で書き出すファイル')
+    parser.add_argument('--quiet', action='store_true', help='進捗を表示しない')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fmt = args.format or detect_format(args.input)
+    if args.input == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        state_path = args.state_file or 'stdin.import-state.json'
+    else:
+        stream = open(args.input, encoding='utf-8', newline='')
+        state_path = args.state_file or args.input + '.import-state.json'
+
+    state = ImportState(state_path)
+    offset = args.offset if args.offset is not None else (state.offset if args.resume else 0)
+    rejects = open(args.rejects, 'a', encoding='utf-8') if args.rejects else None
+
+    db = DatabaseManager(args.db)
+    importer = RecordImporter(
+        db, chunk_size=args.chunk_size, sanitize=args.sanitize, defer_indexes=args.defer_indexes,
+        defaults=dict(DEFAULT_VALUES, user_id_hash=args.user_id_hash), rejects=rejects,
+        progress=not args.quiet
+    )
+    try:
+        rows = read_rows(stream, fmt)
+        for _ in range(offset):
+            if next(rows, None) is None:
+                break
+        if offset:
+            importer.log(f"{offset:,} 件を読み飛ばしました")
+        stats = importer.run(rows, fmt, state, offset)
+    except ValueError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        print(f"{state.offset:,} 件目までは書き込み済みです", file=sys.stderr)
+        return 1
+    finally:
+        stream.close()
+        if rejects is not None:
+            rejects.close()
+        close_all_writers()
+
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
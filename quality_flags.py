@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 品質フラグ列
+quality_flags(JSON文字列)の spam / duplicate / too_short を records の整数列にも持ち、
+品質フィルタをSQLite側(部分インデックス)で行う
+"""
+
+import json
+import threading
+import time
+
+# quality_flags のキーと records の列名
+QUALITY_FLAG_COLUMNS = {
+    'spam': 'is_spam',
+    'duplicate': 'is_duplicate',
+    'too_short': 'is_too_short',
+}
+
+# 研究・分布に使う「品質の良い同意済みデータ」の条件
+# 部分インデックス idx_records_high_quality と同じ式にしておくとインデックスが使われる
+HIGH_QUALITY_CONDITION = 'consent = TRUE AND is_spam = 0 AND is_duplicate = 0'
+
+# 反応時間がこれ未満ならスパム、意味づけがこれ未満の文字数なら短すぎる
+SPAM_RT_MS = 500
+TOO_SHORT_LENGTH = 10
+
+# 列が未設定(NULL)のレコード = バックフィル待ち
+PENDING_CONDITION = 'is_spam IS NULL'
+
+BACKFILL_CHUNK_SIZE = 500
+BACKFILL_PAUSE = 0.05  # チャンク間の待ち時間(秒)、通常の書き込みを優先させる
+# ANALYZE で標本にする行数の上限(大きなDBでも統計の更新を短時間で済ませる)
+ANALYSIS_LIMIT = 1000
+
+
+def load_quality_flags(quality_flags):
+    """quality_flags を辞書にする(空・不正なJSONは空の辞書)"""
+    if isinstance(quality_flags, dict):
+        return quality_flags
+    try:
+        flags = json.loads(quality_flags or '{}')
+    except (TypeError, ValueError):
+        return {}
+    return flags if isinstance(flags, dict) else {}
+
+
+def quality_flag_values(quality_flags):
+    """(is_spam, is_duplicate, is_too_short) の整数値を返す"""
+    flags = load_quality_flags(quality_flags)
+    return tuple(1 if flags.get(key, False) else 0 for key in QUALITY_FLAG_COLUMNS)
+
+
+def apply_quality_flags(data, is_duplicate):
+    """送信データの quality_flags に duplicate / spam / too_short を設定する"""
+    flags = load_quality_flags(data.get('quality_flags', '{}'))
+    flags['duplicate'] = is_duplicate
+    # スパム検出(反応時間ベース)
+    if data['rt_ms'] < SPAM_RT_MS:
+        flags['spam'] = True
+    # 短すぎる意味づけ
+    if len(data['meaning_text'].strip()) < TOO_SHORT_LENGTH:
+        flags['too_short'] = True
+    data['quality_flags'] = json.dumps(flags)
+
+
+def is_high_quality(consent, quality_flags):
+    """HIGH_QUALITY_CONDITION と同じ判定をPython側で行う(バックフィル待ちのレコード用)"""
+    if consent != 1:
+        return False
+    is_spam, is_duplicate, _ = quality_flag_values(quality_flags)
+    return not (is_spam or is_duplicate)
+
+
+def add_quality_flag_columns(conn):
+    """品質フラグ列とインデックスを追加(値はバックフィルで埋める)"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(records)')}
+    for column in QUALITY_FLAG_COLUMNS.values():
+        if column not in columns:
+            conn.execute(f'ALTER TABLE records ADD COLUMN {column} INTEGER')
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_records_high_quality
+        ON records(event_tag, mode) WHERE {HIGH_QUALITY_CONDITION}
+    ''')
+    # バックフィル待ちのレコードだけを含むインデックス(完了後は空になる)
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_records_quality_pending
+        ON records(is_spam) WHERE {PENDING_CONDITION}
+    ''')
+    analyze_records(conn)
+
+
+def analyze_records(conn):
+    """records の統計を更新する
+
+    統計が無いとプランナーは部分インデックスより idx_consent を選ぶため、
+    インデックス追加後とバックフィル完了後に取り直す。
+    """
+    conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    conn.execute('ANALYZE records')
+
+
+def backfill_chunk(conn, chunk_size=BACKFILL_CHUNK_SIZE):
+    """バックフィル待ちのレコードを最大 chunk_size 件埋め、処理件数を返す"""
+    rows = conn.execute(f'''
+        SELECT rowid, quality_flags FROM records WHERE {PENDING_CONDITION} LIMIT ?
+    ''', (chunk_size,)).fetchall()
+    conn.executemany(
+        'UPDATE records SET is_spam = ?, is_duplicate = ?, is_too_short = ? WHERE rowid = ?',
+        [quality_flag_values(quality_flags) + (rowid,) for rowid, quality_flags in rows]
+    )
+    return len(rows)
+
+
+def has_pending_backfill(pool):
+    """バックフィル待ちのレコードがあるか"""
+    with pool.connection() as conn:
+        row = conn.execute(
+            f'SELECT 1 FROM records WHERE {PENDING_CONDITION} LIMIT 1'
+        ).fetchone()
+    return row is not None
+
+
+def run_backfill(writer, chunk_size=BACKFILL_CHUNK_SIZE, pause=BACKFILL_PAUSE):
+    """オンラインバックフィル
+
+    1チャンクずつ書き込みキュー経由でコミットするため、
+    サーバー稼働中でも通常の書き込みを長く待たせない。
+    """
+    total = 0
+    while True:
+        updated = writer.execute(lambda conn: backfill_chunk(conn, chunk_size))
+        total += updated
+        if updated < chunk_size:
+            writer.execute(analyze_records)
+            return total
+        time.sleep(pause)
+
+
+def start_backfill(pool, writer):
+    """バックフィル待ちがあればバックグラウンドスレッドで埋める(無ければNone)"""
+    if not has_pending_backfill(pool):
+        return None
+
+    def backfill():
+        try:
+            total = run_backfill(writer)
+            print(f"品質フラグ列のバックフィルが完了しました({total}件)")
+        except Exception as e:
+            print(f"Quality flag backfill error: {e}")
+
+    thread = threading.Thread(target=backfill, name='kotoimi-quality-backfill', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - レート制限
+スライディングウィンドウカウンタでクライアント毎の送信数を制限する(1リクエスト O(1)・メモリ上限付き)
+
+クライアント毎の状態は差し替え可能なバックエンドに置く。
+    memory: プロセス内の辞書(単一プロセス向け)
+    shm:    共有メモリ(mmap)上の固定長ハッシュ表(同一ホストの複数プロセス向け)
+    sqlite: SQLiteファイル(共有ファイルシステム上の複数ノード・検証用)
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 追跡するクライアント数の上限(超えたら最も長くアクセスの無いクライアントから忘れる)
+DEFAULT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 10000))
+# バックエンドの指定(未指定なら単一プロセスは memory、--workers 使用時は shm)
+DEFAULT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', '')
+# shm の共有ファイル(未指定ならfork前に作る無名の一時ファイル)
+DEFAULT_SHM_PATH = os.environ.get('RATE_LIMIT_SHM_PATH') or None
+DEFAULT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH', 'rate_limit.db')
+
+# decide() の結果
+ALLOWED = 'allowed'
+REJECTED = 'rejected'
+BLOCKED = 'blocked'
+
+
+class MemoryRateLimitBackend:
+    """プロセス内の OrderedDict に状態を置くバックエンド(LRUで上限を守る)"""
+
+    name = 'memory'
+
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def update(self, client, now, decide):
+        """状態を decide(state, now) -> (new_state, outcome) で更新して outcome を返す"""
+        with self._lock:
+            state = self._clients.get(client)
+            if state is not None:
+                self._clients.move_to_end(client)
+            state, outcome = decide(state, now)
+            self._clients[client] = state
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self._evictions += 1
+            return outcome
+
+    def prune(self, idle_before):
+        """idle_before より前から使われていない状態を消す(LRUで足りるので何もしない)"""
+        return 0
+
+    def reset(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self, now):
+        with self._lock:
+            states = list(self._clients.values())
+        return {
+            'clients': len(states),
+            'blocked_clients': sum(1 for state in states if state[3] > now),
+            'evictions': self._evictions,
+        }
+
+
+class SharedMemoryRateLimitBackend:
+    """mmap した固定長ハッシュ表に状態を置くバックエンド
+
+    8スロットを1グループとするセット連想の表で、クライアントはハッシュ値で
+    グループが決まる。グループが埋まっていれば最終アクセスが最も古いスロットを
+    上書きする。グループ単位の fcntl バイト範囲ロックでプロセス間の排他を取る。
+
+    path を省略した場合は無名の一時ファイルを使うので、fork 前に作成して
+    子プロセスに引き継ぐこと。path を指定すれば無関係なプロセス間でも共有できる
+    (同じ max_clients で開くこと)。
+    """
+
+    name = 'shm'
+    WAYS = 8
+    # key, window_start, blocked_until, last_seen, current, previous
+    SLOT = struct.Struct('<QdddII')
+
+    def __init__(self, path=DEFAULT_SHM_PATH, max_clients=DEFAULT_MAX_CLIENTS):
+        if fcntl is None:
+            raise RuntimeError('shm rate limit backend requires fcntl (Linux / macOS)')
+        self.path = path
+        self.max_clients = max_clients
+        self.groups = max(1, -(-max_clients // self.WAYS))
+        self.group_size = self.WAYS * self.SLOT.size
+        self.size = self.groups * self.group_size
+
+        if path:
+            self._file = open(path, 'a+b')
+        else:
+            self._file = tempfile.TemporaryFile(prefix='kotoimi-ratelimit-')
+        fd = self._file.fileno()
+        if os.fstat(fd).st_size < self.size:
+            os.ftruncate(fd, self.size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        # fcntl のロックはプロセス単位なので、同じプロセスのスレッド間は別に排他する
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    @staticmethod
+    def _key(client):
+        digest = hashlib.blake2b(client.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def update(self, client, now, decide):
+        key = self._key(client)
+        base = (key % self.groups) * self.group_size
+        slot = self.SLOT
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.group_size, base, os.SEEK_SET)
+            try:
+                target = None
+                state = None
+                victim = None
+                victim_seen = None
+                for offset in range(base, base + self.group_size, slot.size):
+                    slot_key, window_start, blocked_until, last_seen, current, previous = \
+                        slot.unpack_from(self._map, offset)
+                    if slot_key == key:
+                        target = offset
+                        state = (window_start, current, previous, blocked_until)
+                        break
+                    if slot_key == 0:
+                        if target is None:
+                            target = offset
+                    elif victim_seen is None or last_seen < victim_seen:
+                        victim, victim_seen = offset, last_seen
+                if target is None:
+                    target = victim
+                    self._evictions += 1
+
+                (window_start, current, previous, blocked_until), outcome = decide(state, now)
+                slot.pack_into(self._map, target, key, window_start, blocked_until, now,
+                               current, previous)
+                return outcome
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.group_size, base, os.SEEK_SET)
+
+    def prune(self, idle_before):
+        """使われていないスロットは上書きで再利用されるので何もしない"""
+        return 0
+
+    def _slots(self):
+        for offset in range(0, self.size, self.SLOT.size):
+            yield self.SLOT.unpack_from(self._map, offset)
+
+    def reset(self):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(self.size)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def stats(self, now):
+        clients = 0
+        blocked = 0
+        for slot_key, _, blocked_until, _, _, _ in self._slots():
+            if slot_key:
+                clients += 1
+                if blocked_until > now:
+                    blocked += 1
+        return {
+            'clients': clients,
+            'blocked_clients': blocked,
+            'evictions': self._evictions,
+            'path': self.path,
+            'bytes': self.size,
+        }
+
+
+class SQLiteRateLimitBackend:
+    """SQLiteファイルに状態を置くバックエンド
+
+    接続はスレッド毎に持ち、fork した子プロセスでは作り直す。
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path=DEFAULT_SQLITE_PATH, max_clients=DEFAULT_MAX_CLIENTS):
+        self.db_path = db_path
+        self.max_clients = max_clients
+        self._local = threading.local()
+        self._pid = None
+        self._connection()
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            # fork 前の接続は子プロセスで使わない
+            self._pid = os.getpid()
+            self._local = threading.local()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            # 再起動で失っても困らない状態なので fsync しない
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    client TEXT PRIMARY KEY,
+                    window_start REAL NOT NULL,
+                    current INTEGER NOT NULL,
+                    previous INTEGER NOT NULL,
+                    blocked_until REAL NOT NULL,
+                    last_seen REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limits_last_seen ON rate_limits(last_seen)')
+            self._local.conn = conn
+        return conn
+
+    def update(self, client, now, decide):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''
+                SELECT window_start, current, previous, blocked_until
+                FROM rate_limits WHERE client = ?
+            ''', (client,)).fetchone()
+            (window_start, current, previous, blocked_until), outcome = decide(row, now)
+            conn.execute('''
+                INSERT OR REPLACE INTO rate_limits
+                    (client, window_start, current, previous, blocked_until, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (client, window_start, current, previous, blocked_until, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return outcome
+
+    def prune(self, idle_before):
+        """使われていないクライアントと上限を超えた古いクライアントを消す"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            removed = conn.execute(
+                'DELETE FROM rate_limits WHERE last_seen < ?', (idle_before,)
+            ).rowcount
+            removed += conn.execute('''
+                DELETE FROM rate_limits WHERE client IN (
+                    SELECT client FROM rate_limits ORDER BY last_seen DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_clients,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return removed
+
+    def reset(self):
+        self._connection().execute('DELETE FROM rate_limits')
+
+    def stats(self, now):
+        conn = self._connection()
+        clients, blocked = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(blocked_until > ?), 0) FROM rate_limits
+        ''', (now,)).fetchone()
+        return {
+            'clients': clients,
+            'blocked_clients': blocked,
+            'path': self.db_path,
+        }
+
+
+RATE_LIMIT_BACKENDS = {
+    'memory': MemoryRateLimitBackend,
+    'shm': SharedMemoryRateLimitBackend,
+    'sqlite': SQLiteRateLimitBackend,
+}
+
+
+def create_rate_limit_backend(name, **options):
+    """名前からバックエンドを作成"""
+    if name not in RATE_LIMIT_BACKENDS:
+        raise ValueError(f'Unknown rate limit backend: {name}')
+    return RATE_LIMIT_BACKENDS[name](**options)
+
+
+class SlidingWindowRateLimiter:
+    """スライディングウィンドウカウンタ方式のレート制限
+
+    クライアント毎に「現在の窓」と「直前の窓」の件数だけを持ち、
+    直前の窓の件数を経過時間で按分して直近 window 秒の件数を見積もる。
+    上限に達したクライアントは block_time 秒ブロックする。
+    """
+
+    def __init__(self, limit, window, block_time, backend=None):
+        if limit < 1 or window <= 0:
+            raise ValueError('limit must be >= 1 and window must be > 0')
+        self.limit = limit
+        self.window = window
+        self.block_time = block_time
+        self.backend = backend or MemoryRateLimitBackend()
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+        self._stats = {
+            'allowed': 0,
+            'rejected': 0,
+            'blocks': 0,
+        }
+
+    def decide(self, state, now):
+        """(窓の開始時刻, 現在の窓の件数, 直前の窓の件数, ブロック解除時刻) から判定する"""
+        if state is None:
+            state = (now, 0, 0, 0.0)
+        window_start, current, previous, blocked_until = state
+        if blocked_until > now:
+            return state, REJECTED
+
+        elapsed = now - window_start
+        if elapsed >= self.window:
+            # 1窓分だけ進んだなら現在の件数が直前の窓になる(2窓以上なら両方0)
+            previous = current if elapsed < 2 * self.window else 0
+            window_start += (elapsed // self.window) * self.window
+            current = 0
+            elapsed = now - window_start
+
+        if previous * (1 - elapsed / self.window) + current >= self.limit:
+            return (window_start, current, previous, now + self.block_time), BLOCKED
+        return (window_start, current + 1, previous, blocked_until), ALLOWED
+
+    def allow(self, client, now=None):
+        """リクエストを許可するなら記録して True を返す"""
+        if now is None:
+            now = time.time()
+        outcome = self.backend.update(client, now, self.decide)
+
+        prune = False
+        with self._lock:
+            if outcome == ALLOWED:
+                self._stats['allowed'] += 1
+            else:
+                self._stats['rejected'] += 1
+                if outcome == BLOCKED:
+                    self._stats['blocks'] += 1
+            if now - self._last_prune > self.window:
+                self._last_prune = now
+                prune = True
+        if prune:
+            # 直前の窓もブロックも残っていないクライアントは忘れてよい
+            self.backend.prune(now - max(2 * self.window, self.block_time))
+        return outcome == ALLOWED
+
+    def reset(self):
+        """全クライアントの状態を消す"""
+        self.backend.reset()
+
+    def stats(self):
+        """統計カウンタ(診断用、allowed などはこのプロセスの分)"""
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+        stats['backend'] = self.backend.name
+        stats.update(self.backend.stats(now))
+        stats['limit'] = self.limit
+        stats['window'] = self.window
+        stats['block_time'] = self.block_time
+        stats['max_clients'] = self.backend.max_clients
+        return stats
@@ -5,23 +5,45 @@
 """
 
 import json
-import sqlite3
 import math
+import os
+import random
+import datetime
+import heapq
 from collections import Counter, defaultdict
-import statistics
+
+from db_pool import get_pool
+from quality_flags import HIGH_QUALITY_CONDITION, PENDING_CONDITION, is_high_quality
+from tag_index import record_tag_counts
+from text_distance import (
+    DEFAULT_SAMPLE_PAIRS, DEFAULT_WORKERS, estimate_mean_pairwise_distance, exact_distance_summary,
+    mean_pairwise_distance, normalized_distance,
+)
+
+# 平均意味距離の計算方法(exact: 全組を計算 / estimate: 組を抽出して推定)
+# 研究結果の再現性のため既定は exact、推定は明示的に選んだ場合だけ使う
+DISTANCE_MODES = ('exact', 'estimate')
+DEFAULT_DISTANCE_MODE = os.environ.get('RESEARCH_DISTANCE_MODE', 'exact')
 
 class MeaningDiversityAnalyzer:
     """意味づけ多様性分析クラス"""
     
-    def __init__(self, db_path='kotoiminiki.db'):
+    def __init__(self, db_path='kotoiminiki.db', distance_mode=DEFAULT_DISTANCE_MODE,
+                 sample_pairs=DEFAULT_SAMPLE_PAIRS, target_se=None, seed=None,
+                 workers=DEFAULT_WORKERS):
+        if distance_mode not in DISTANCE_MODES:
+            raise ValueError(f'Unknown distance mode: {distance_mode}')
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.distance_mode = distance_mode
+        self.sample_pairs = sample_pairs
+        self.target_se = target_se
+        self.seed = seed
+        self.workers = workers  # 全組計算に使うプロセス数
     
     def get_high_quality_data(self, event_tag=None, mode=None):
-        """品質の高いデータのみを取得"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        where_conditions = ["consent = TRUE"]
+        """品質の高いデータのみを取得(品質フィルタはSQLite側で行う)"""
+        where_conditions = []
         params = []
         
         if event_tag:
@@ -32,24 +54,30 @@ class MeaningDiversityAnalyzer:
             where_conditions.append("mode = ?")
             params.append(mode)
         
-        query = f'''
-            SELECT * FROM records 
-            WHERE {" AND ".join(where_conditions)}
-        '''
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        filters = "".join(f" AND {condition}" for condition in where_conditions)
         
-        # 品質フィルタリング
-        filtered_data = []
-        for row in rows:
-            quality_flags = json.loads(row[12] or '{}')  # quality_flags
-            if not (quality_flags.get('spam', False) or 
-                   quality_flags.get('duplicate', False)):
-                filtered_data.append(row)
-        
-        return filtered_data
+        # 従来の1つのクエリと同じ行順(rowid 順)になるよう、両方を rowid 順に取得して併合する
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT rowid, * FROM records 
+                WHERE {HIGH_QUALITY_CONDITION}{filters}
+                ORDER BY rowid
+            ''', params).fetchall()
+            
+            # 品質フラグ列のバックフィルが済んでいないレコードはJSONで判定
+            pending = conn.execute(f'''
+                SELECT rowid, * FROM records 
+                WHERE {PENDING_CONDITION} AND consent = TRUE{filters}
+                ORDER BY rowid
+            ''', params).fetchall()
+        
+        pending = [row for row in pending if is_high_quality(row[4], row[13])]  # consent, quality_flags
+        return [row[1:] for row in heapq.merge(rows, pending, key=lambda row: row[0])]
+    
+    def get_tag_counts(self, event_tag=None, mode=None):
+        """品質の高いデータのタグ出現回数(タグ索引を GROUP BY で集計)"""
+        with self.pool.connection() as conn:
+            return record_tag_counts(conn, event_tag, mode)
     
     def calculate_entropy(self, meanings):
         """エントロピー H(E) の計算"""
@@ -57,12 +85,16 @@ class MeaningDiversityAnalyzer:
             return 0
         
         # 意味づけの頻度を計算
-        meaning_counts = Counter(meanings)
-        total = len(meanings)
+        return self.calculate_entropy_from_counts(Counter(meanings).values())
+    
+    def calculate_entropy_from_counts(self, counts):
+        """出現回数の一覧からエントロピーを計算"""
+        counts = list(counts)
+        total = sum(counts)
         
         # エントロピー計算
         entropy = 0
-        for count in meaning_counts.values():
+        for count in counts:
             probability = count / total
             if probability > 0:
                 entropy -= probability * math.log2(probability)
@@ -84,43 +116,28 @@ class MeaningDiversityAnalyzer:
         return self.calculate_entropy(all_tags)
     
     def calculate_semantic_distance_avg(self, meanings):
-        """意味埋め込み距離の平均（簡易版）"""
-        if len(meanings) < 2:
-            return 0
-        
-        # 簡易的な文字ベース類似度計算
-        distances = []
-        for i in range(len(meanings)):
-            for j in range(i + 1, len(meanings)):
-                distance = self.simple_text_distance(meanings[i], meanings[j])
-                distances.append(distance)
-        
-        return statistics.mean(distances) if distances else 0
+        """意味埋め込み距離の平均（簡易版：全ての組の正規化編集距離の平均）"""
+        return mean_pairwise_distance(meanings, self.workers)
+    
+    def calculate_semantic_distance(self, meanings):
+        """平均意味距離と信頼区間・使った組数(distance_mode に従って全組計算か推定)
+
+        推定した場合は同じ結果を再現できるよう、使った乱数の種を seed に入れる。
+        """
+        if self.distance_mode == 'exact':
+            return exact_distance_summary(meanings, workers=self.workers)
+        seed = self.seed if self.seed is not None else random.randrange(2 ** 32)
+        summary = estimate_mean_pairwise_distance(
+            meanings, max_pairs=self.sample_pairs, target_se=self.target_se,
+            rng=random.Random(seed), workers=self.workers,
+        )
+        if not summary['exact']:
+            summary['seed'] = seed
+        return summary
     
     def simple_text_distance(self, text1, text2):
         """簡易テキスト距離計算（レーベンシュタイン距離の正規化版）"""
-        def levenshtein_distance(s1, s2):
-            if len(s1) < len(s2):
-                return levenshtein_distance(s2, s1)
-            
-            if len(s2) == 0:
-                return len(s1)
-            
-            previous_row = list(range(len(s2) + 1))
-            for i, c1 in enumerate(s1):
-                current_row = [i + 1]
-                for j, c2 in enumerate(s2):
-                    insertions = previous_row[j + 1] + 1
-                    deletions = current_row[j] + 1
-                    substitutions = previous_row[j] + (c1 != c2)
-                    current_row.append(min(insertions, deletions, substitutions))
-                previous_row = current_row
-            
-            return previous_row[-1]
-        
-        distance = levenshtein_distance(text1.lower(), text2.lower())
-        max_len = max(len(text1), len(text2))
-        return distance / max_len if max_len > 0 else 0
+        return normalized_distance(text1, text2)
     
     def calculate_consensus_rate(self, meaning_tags):
         """合意率 max p(M_i|E) の計算"""
@@ -138,8 +155,12 @@ class MeaningDiversityAnalyzer:
                     if tag:
                         tag_counts[tag] += 1
         
+        return self.calculate_consensus_rate_from_counts(tag_counts, total_entries)
+    
+    def calculate_consensus_rate_from_counts(self, tag_counts, total_entries):
+        """タグの出現回数と記録数から合意率を計算"""
         # 最大出現率を計算
-        if not tag_counts:
+        if not tag_counts or not total_entries:
             return 0
         
         max_count = max(tag_counts.values())
@@ -150,15 +171,17 @@ class MeaningDiversityAnalyzer:
         data = self.get_high_quality_data(event_tag=event_tag)
         
         meanings = [row[7] for row in data]  # meaning_text
-        meaning_tags = [row[8] for row in data]  # meaning_tag
+        tag_counts = self.get_tag_counts(event_tag=event_tag)
+        semantic_distance = self.calculate_semantic_distance(meanings)
         
         analysis = {
             'event_tag': event_tag,
             'total_entries': len(data),
             'entropy_text': self.calculate_entropy(meanings),
-            'entropy_tags': self.calculate_tag_entropy(meaning_tags),
-            'semantic_distance_avg': self.calculate_semantic_distance_avg(meanings),
-            'consensus_rate': self.calculate_consensus_rate(meaning_tags),
+            'entropy_tags': self.calculate_entropy_from_counts(tag_counts.values()),
+            'semantic_distance_avg': semantic_distance['estimate'],
+            'semantic_distance': semantic_distance,
+            'consensus_rate': self.calculate_consensus_rate_from_counts(tag_counts, len(data)),
             'sample_meanings': meanings[:5] if meanings else []
         }
         
@@ -171,22 +194,22 @@ class MeaningDiversityAnalyzer:
         
         solo_meanings = [row[7] for row in solo_data]
         social_meanings = [row[7] for row in social_data]
-        solo_tags = [row[8] for row in solo_data]
-        social_tags = [row[8] for row in social_data]
+        solo_tags = self.get_tag_counts(event_tag=event_tag, mode='solo')
+        social_tags = self.get_tag_counts(event_tag=event_tag, mode='social')
         
         comparison = {
             'event_tag': event_tag or 'all',
             'solo': {
                 'count': len(solo_data),
                 'entropy_text': self.calculate_entropy(solo_meanings),
-                'entropy_tags': self.calculate_tag_entropy(solo_tags),
-                'consensus_rate': self.calculate_consensus_rate(solo_tags)
+                'entropy_tags': self.calculate_entropy_from_counts(solo_tags.values()),
+                'consensus_rate': self.calculate_consensus_rate_from_counts(solo_tags, len(solo_data))
             },
             'social': {
                 'count': len(social_data),
                 'entropy_text': self.calculate_entropy(social_meanings),
-                'entropy_tags': self.calculate_tag_entropy(social_tags),
-                'consensus_rate': self.calculate_consensus_rate(social_tags)
+                'entropy_tags': self.calculate_entropy_from_counts(social_tags.values()),
+                'consensus_rate': self.calculate_consensus_rate_from_counts(social_tags, len(social_data))
             }
         }
         
@@ -201,9 +224,6 @@ class MeaningDiversityAnalyzer:
     
     def analyze_revision_impact(self, event_tag=None):
         """他者結果表示後の変化分析（changed_after_view）"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         where_conditions = [
             "consent = TRUE", 
             "mode = 'social'", 
@@ -221,9 +241,8 @@ class MeaningDiversityAnalyzer:
             WHERE {" AND ".join(where_conditions)}
         '''
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
         
         # 変更率の計算
         total_saw_alt = len(rows)
@@ -250,17 +269,13 @@ class MeaningDiversityAnalyzer:
     
     def generate_comprehensive_report(self):
         """包括的な分析レポート生成"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # 出来事タグ一覧取得
-        cursor.execute('''
-            SELECT DISTINCT event_tag 
-            FROM records 
-            WHERE consent = TRUE
-        ''')
-        event_tags = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        with self.pool.connection() as conn:
+            event_tags = [row[0] for row in conn.execute('''
+                SELECT DISTINCT event_tag 
+                FROM records 
+                WHERE consent = TRUE
+            ''')]
         
         report = {
             'generated_at': datetime.datetime.now().isoformat(),
@@ -304,6 +319,9 @@ def main():
     print("ことイミ日記 - 研究者向け分析ツール")
     print("=" * 60)
     
+    # records のスキーマを最新化(品質フラグ列など)
+    from server import DatabaseManager
+    DatabaseManager.shared()
     analyzer = MeaningDiversityAnalyzer()
     
     try:
@@ -326,5 +344,4 @@ def main():
         print(f"❌ 分析エラー: {e}")
 
 if __name__ == '__main__':
-    import datetime
     main()
\ No newline at end of file
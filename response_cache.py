@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 読み取りAPIのレスポンスキャッシュ
+/fetch と /api/analysis の結果をデータのバージョン付きでLRUに保持し、書き込みで無効化する
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 保持するエントリ数の上限(0 でキャッシュ無効)
+DEFAULT_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+# エントリの有効期間(秒)
+#   pre-fork の他ワーカーの書き込みは無効化が届かないため、古さの上限にもなる
+DEFAULT_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 30))
+
+
+class ResponseCache:
+    """データバージョン付きLRUキャッシュ
+
+    エントリはスコープ(例: ('fetch', event_tag))に属し、計算を始めた時点の
+    スコープのバージョンを記録する。書き込み側が invalidate() でバージョンを
+    上げると、そのスコープのエントリは次の参照時に破棄される。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._global_version = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def version(self, scope):
+        """スコープの現在のバージョン"""
+        with self._lock:
+            return self._global_version, self._versions.get(scope, 0)
+
+    def get(self, key):
+        """キャッシュ済みの値を返す(無い・古い場合はNone)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            value, scope, version, expires_at = entry
+            if version != (self._global_version, self._versions.get(scope, 0)):
+                del self._entries[key]
+                self._stats['stale'] += 1
+                self._stats['misses'] += 1
+                return None
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, scope, value, version):
+        """値を登録(version は計算を始める前に version() で取得したもの)"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            # 計算中に書き込みがあった結果は登録しない
+            if version != (self._global_version, self._versions.get(scope, 0)):
+                return
+            self._entries[key] = (value, scope, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_or_compute(self, key, scope, compute):
+        """キャッシュに無ければ compute() の結果を登録して返す"""
+        if self.max_entries <= 0:
+            return compute()
+        value = self.get(key)
+        if value is not None:
+            return value
+        version = self.version(scope)
+        value = compute()
+        self.put(key, scope, value, version)
+        return value
+
+    def invalidate(self, scope=None):
+        """スコープ(None なら全体)のエントリを無効化"""
+        with self._lock:
+            if scope is None:
+                self._global_version += 1
+            else:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """統計カウンタ(診断用)"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0
+        return stats
+
+
+_response_cache = ResponseCache()
+
+
+def get_response_cache():
+    """プロセス内で共有されるレスポンスキャッシュを取得"""
+    return _response_cache
+
+
+def response_cache_stats():
+    """レスポンスキャッシュの統計(診断用)"""
+    return _response_cache.stats()
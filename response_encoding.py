@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - JSONレスポンスのエンコード
+既定はコンパクトなJSON(?pretty=1 で整形)、一定サイズ以上は gzip で返す
+"""
+
+import gzip
+import json
+import os
+import threading
+from urllib.parse import parse_qs
+
+from static_cache import accepts_gzip
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+# これより小さいJSONは圧縮しない(環境変数で上書き可能、0 で常に圧縮)
+GZIP_MIN_SIZE = int(os.environ.get('RESPONSE_GZIP_MIN_SIZE', 1024))
+# zlib の既定値(6)で速度と圧縮率を両立する(応答毎の圧縮が重ければ環境変数で下げる)
+GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+
+_COMPACT_SEPARATORS = (',', ':')
+
+_route_stats = {}
+_stats_lock = threading.Lock()
+
+
+def wants_pretty(query_string):
+    """クエリ文字列で整形出力(?pretty=1)が指定されているか"""
+    if not query_string or 'pretty' not in query_string:
+        return False
+    value = parse_qs(query_string).get('pretty', [''])[0].lower()
+    return value in ('1', 'true', 'yes')
+
+
+def encode_json(data, pretty=False):
+    """JSONをUTF-8のバイト列にする"""
+    if pretty:
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+    else:
+        text = json.dumps(data, ensure_ascii=False, separators=_COMPACT_SEPARATORS)
+    return text.encode('utf-8')
+
+
+def encode_json_response(data, route=None, query_string=None, accept_encoding=None):
+    """JSONレスポンスのボディとヘッダーのリストを返す
+
+    route を渡した場合はルート毎のバイト数を集計する。
+    Content-Length は呼び出し側で付ける。
+    """
+    body = encode_json(data, pretty=wants_pretty(query_string))
+    json_size = len(body)
+    headers = [('Content-Type', JSON_CONTENT_TYPE), ('Vary', 'Accept-Encoding')]
+
+    compressed = False
+    if json_size >= GZIP_MIN_SIZE and accepts_gzip(accept_encoding):
+        gzipped = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if len(gzipped) < json_size:
+            body = gzipped
+            compressed = True
+            headers.append(('Content-Encoding', 'gzip'))
+
+    if route is not None:
+        record_response(route, json_size, len(body), compressed)
+    return body, headers
+
+
+def record_response(route, json_size, sent_size, compressed):
+    """ルート毎の送信バイト数を集計"""
+    with _stats_lock:
+        stats = _route_stats.get(route)
+        if stats is None:
+            stats = _route_stats[route] = {
+                'responses': 0,
+                'gzip_responses': 0,
+                'json_bytes': 0,
+                'sent_bytes': 0,
+            }
+        stats['responses'] += 1
+        stats['json_bytes'] += json_size
+        stats['sent_bytes'] += sent_size
+        if compressed:
+            stats['gzip_responses'] += 1
+
+
+def response_stats():
+    """ルート毎の送信バイト数と圧縮による削減量(診断用)"""
+    with _stats_lock:
+        routes = {route: dict(stats) for route, stats in _route_stats.items()}
+    for stats in routes.values():
+        stats['saved_bytes'] = stats['json_bytes'] - stats['sent_bytes']
+        stats['avg_sent_bytes'] = stats['sent_bytes'] / stats['responses'] if stats['responses'] else 0
+    return routes
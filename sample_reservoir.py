@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - /fetch 用のサンプル意味づけリザーバー
+出来事毎に固定件数の意味づけだけを保持し、/fetch は全件の本文を読まずにサンプルを返す
+"""
+
+import os
+import random
+import time
+
+from quality_flags import HIGH_QUALITY_CONDITION, PENDING_CONDITION, is_high_quality
+
+# 出来事毎に保持するサンプル数(環境変数で上書き可能)
+RESERVOIR_SIZE = int(os.environ.get('FETCH_RESERVOIR_SIZE', 20))
+# リザーバーを最近のデータから引き直す間隔(秒)
+REFRESH_INTERVAL = float(os.environ.get('FETCH_RESERVOIR_REFRESH', 600))
+# 引き直しの対象にする最近の記録数
+RECENT_WINDOW = int(os.environ.get('FETCH_RESERVOIR_WINDOW', 1000))
+
+SAMPLE_RESERVOIR_DDL = [
+    '''
+    CREATE TABLE IF NOT EXISTS sample_reservoir (
+        event_tag TEXT NOT NULL,
+        slot INTEGER NOT NULL,
+        record_id TEXT NOT NULL,
+        meaning_text TEXT NOT NULL,
+        PRIMARY KEY (event_tag, slot)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_sample_reservoir_record ON sample_reservoir(record_id)',
+    # seen: リザーバーに提示した記録数(Algorithm R の置き換え確率に使う)
+    '''
+    CREATE TABLE IF NOT EXISTS sample_reservoir_state (
+        event_tag TEXT PRIMARY KEY,
+        seen INTEGER NOT NULL,
+        refreshed_at REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+def offer_sample(conn, event_tag, record_id, meaning_text, size=RESERVOIR_SIZE):
+    """品質の良い新しい記録をリザーバーに提示する(トランザクションは呼び出し側)
+
+    Algorithm R: seen 件目の記録は size / seen の確率でランダムな枠と入れ替わる。
+    """
+    row = conn.execute(
+        'SELECT seen FROM sample_reservoir_state WHERE event_tag = ?', (event_tag,)
+    ).fetchone()
+    if row is None:
+        # 状態が無い出来事は次の /fetch で引き直されるよう refreshed_at = 0 にしておく
+        seen = 0
+        conn.execute('''
+            INSERT INTO sample_reservoir_state (event_tag, seen, refreshed_at) VALUES (?, 0, 0)
+        ''', (event_tag,))
+    else:
+        seen = row[0]
+
+    slot = seen if seen < size else random.randrange(seen + 1)
+    if slot < size:
+        conn.execute('''
+            INSERT OR REPLACE INTO sample_reservoir (event_tag, slot, record_id, meaning_text)
+            VALUES (?, ?, ?, ?)
+        ''', (event_tag, slot, record_id, meaning_text))
+    conn.execute(
+        'UPDATE sample_reservoir_state SET seen = seen + 1 WHERE event_tag = ?', (event_tag,)
+    )
+
+
+def discard_sample(conn, record_id):
+    """品質フラグで除外された記録をリザーバーから外し、その出来事を引き直し対象にする"""
+    rows = conn.execute(
+        'SELECT event_tag FROM sample_reservoir WHERE record_id = ?', (record_id,)
+    ).fetchall()
+    if not rows:
+        return
+    conn.execute('DELETE FROM sample_reservoir WHERE record_id = ?', (record_id,))
+    conn.executemany(
+        'UPDATE sample_reservoir_state SET refreshed_at = 0 WHERE event_tag = ?', rows
+    )
+
+
+def refresh_reservoir(conn, event_tag, size=RESERVOIR_SIZE, window=RECENT_WINDOW):
+    """最近の品質の良い記録 window 件から size 件を引き直す(トランザクションは呼び出し側)"""
+    if _has_pending_records(conn, event_tag):
+        samples, candidates = _pending_aware_samples(conn, event_tag, size, window)
+    else:
+        # 抽選はSQLite内で行い、Pythonには選ばれた size 件の本文だけを渡す
+        samples = conn.execute(f'''
+            SELECT id, meaning_text FROM (
+                SELECT id, meaning_text FROM records
+                WHERE event_tag = ? AND {HIGH_QUALITY_CONDITION}
+                ORDER BY rowid DESC LIMIT ?
+            ) ORDER BY RANDOM() LIMIT ?
+        ''', (event_tag, window, size)).fetchall()
+        candidates = conn.execute(f'''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM records
+                WHERE event_tag = ? AND {HIGH_QUALITY_CONDITION}
+                LIMIT ?
+            )
+        ''', (event_tag, window)).fetchone()[0]
+
+    conn.execute('DELETE FROM sample_reservoir WHERE event_tag = ?', (event_tag,))
+    conn.executemany('''
+        INSERT INTO sample_reservoir (event_tag, slot, record_id, meaning_text) VALUES (?, ?, ?, ?)
+    ''', [(event_tag, slot, record_id, text) for slot, (record_id, text) in enumerate(samples)])
+    conn.execute('''
+        INSERT INTO sample_reservoir_state (event_tag, seen, refreshed_at) VALUES (?, ?, ?)
+        ON CONFLICT(event_tag) DO UPDATE SET
+            seen = excluded.seen,
+            refreshed_at = excluded.refreshed_at
+    ''', (event_tag, candidates, time.time()))
+    return len(samples)
+
+
+def _has_pending_records(conn, event_tag):
+    """品質フラグ列のバックフィル待ちの記録があるか(完了後は空の部分インデックスを引くだけ)"""
+    return conn.execute(f'''
+        SELECT 1 FROM records WHERE {PENDING_CONDITION} AND event_tag = ? LIMIT 1
+    ''', (event_tag,)).fetchone() is not None
+
+
+def _pending_aware_samples(conn, event_tag, size, window):
+    """バックフィル待ちの記録を quality_flags(JSON)で判定して含めた抽選
+
+    マイグレーション直後は全ての記録が列未設定のため、列だけで絞ると
+    リザーバーが空のまま次の引き直しまで残ってしまう。
+    """
+    rows = conn.execute(f'''
+        SELECT id, meaning_text, consent, quality_flags, {PENDING_CONDITION} FROM records
+        WHERE event_tag = ? AND ({HIGH_QUALITY_CONDITION} OR {PENDING_CONDITION})
+        ORDER BY rowid DESC
+    ''', (event_tag,))
+    eligible = []
+    for record_id, meaning_text, consent, quality_flags, pending in rows:
+        if not pending or is_high_quality(consent, quality_flags):
+            eligible.append((record_id, meaning_text))
+            if len(eligible) >= window:
+                break
+    return random.sample(eligible, min(size, len(eligible))), len(eligible)
+
+
+def rebuild_sample_reservoirs(conn, size=RESERVOIR_SIZE, window=RECENT_WINDOW):
+    """全ての出来事のリザーバーを作り直し、出来事数を返す(トランザクションは呼び出し側)"""
+    conn.execute('DELETE FROM sample_reservoir')
+    conn.execute('DELETE FROM sample_reservoir_state')
+    event_tags = [row[0] for row in conn.execute('SELECT DISTINCT event_tag FROM records')]
+    for event_tag in event_tags:
+        refresh_reservoir(conn, event_tag, size, window)
+    return len(event_tags)
+
+
+def create_sample_reservoir(conn):
+    """リザーバーの作成と既存記録からの初期化(マイグレーション用)"""
+    for statement in SAMPLE_RESERVOIR_DDL:
+        conn.execute(statement)
+    rebuild_sample_reservoirs(conn)
+
+
+def reservoir_samples(conn, event_tag):
+    """(リザーバー内の本文のリスト, 最後に引き直した時刻) を返す(未作成なら時刻は0)"""
+    texts = [row[0] for row in conn.execute(
+        'SELECT meaning_text FROM sample_reservoir WHERE event_tag = ?', (event_tag,)
+    )]
+    row = conn.execute(
+        'SELECT refreshed_at FROM sample_reservoir_state WHERE event_tag = ?', (event_tag,)
+    ).fetchone()
+    return texts, row[0] if row else 0
+
+
+def needs_refresh(refreshed_at, interval=REFRESH_INTERVAL):
+    return time.time() - refreshed_at >= interval
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 入力値のサニタイゼーション
+規則は読み込み時に一度だけコンパイルし、必要な長さだけを先に切り出してから処理する
+"""
+
+import html
+import re
+
+# 長すぎる入力を制限(DoS攻撃対策)
+MAX_INPUT_LENGTH = 10000
+
+# 除去する文字列(大文字小文字を区別しない)
+#   HTML エスケープ後は '<' が残らないため、危険なタグ(script / iframe / object /
+#   embed / form / input / button)は全て無害な文字列になっており、除去の規則は要らない
+REMOVED_PATTERN = re.compile(r'javascript:', re.IGNORECASE)
+# 除去対象は必ずこの文字を含むので、無ければ正規表現による走査を省く
+REMOVED_ANCHOR = ':'
+# 入力の切り出し位置をまたぐ可能性のある除去対象の長さ(len('javascript:') - 1)
+REMOVED_SPAN = 10
+# 1文字のエスケープ後の最大長(' -> &#x27;)
+MAX_ESCAPED_LENGTH = 6
+
+
+def _sanitize(text):
+    sanitized = html.escape(text)
+    if REMOVED_ANCHOR in sanitized:
+        sanitized = REMOVED_PATTERN.sub('', sanitized)
+    return sanitized
+
+
+def sanitize_text(text, max_length=MAX_INPUT_LENGTH):
+    """HTML エスケープと危険な文字列の除去を行い、max_length 文字に切り詰める
+
+    入力全体を処理してから切り詰めた場合と同じ結果を、先頭の必要な分だけを
+    処理して求める。切り出した末尾 REMOVED_SPAN 文字は除去対象の途中かも
+    しれないので、そこから生じた出力を除いても max_length 文字に届くまで
+    切り出す長さを広げる。
+    """
+    if not isinstance(text, str):
+        return str(text)
+
+    tail = REMOVED_SPAN * MAX_ESCAPED_LENGTH
+    end = max_length + tail
+    while True:
+        sanitized = _sanitize(text[:end])
+        if end >= len(text) or len(sanitized) >= max_length + tail:
+            break
+        end *= 2
+    return sanitized[:max_length].strip()
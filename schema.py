@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - スキーマのバージョン管理
+DDLはプロセス起動時に一度だけ実行し、DB側の適用済みバージョンを schema_versions に記録する
+"""
+
+import os
+import threading
+
+# records(server.py)と meanings(simple_server.py)が同じDBファイルを共有するため、
+# PRAGMA user_version ではなくコンポーネント単位でバージョンを管理する
+SCHEMA_VERSIONS_DDL = '''
+    CREATE TABLE IF NOT EXISTS schema_versions (
+        component TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+
+def get_schema_version(conn, component):
+    """適用済みのスキーマバージョンを返す(未適用なら0)"""
+    conn.execute(SCHEMA_VERSIONS_DDL)
+    row = conn.execute(
+        'SELECT version FROM schema_versions WHERE component = ?', (component,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def apply_migrations(conn, component, migrations):
+    """未適用のマイグレーションを1トランザクションで適用し、適用後のバージョンを返す
+
+    migrations[i] がバージョン i+1 に対応する。各要素はSQL文のリスト、
+    または接続を受け取る関数。
+    """
+    # 複数プロセスが同時に起動しても二重適用しないよう書き込みロックを先に取る
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = get_schema_version(conn, component)
+        for version, step in enumerate(migrations, start=1):
+            if version <= current:
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            current = version
+
+        conn.execute('''
+            INSERT INTO schema_versions (component, version, applied_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(component) DO UPDATE SET
+                version = excluded.version,
+                applied_at = excluded.applied_at
+            WHERE schema_versions.version <> excluded.version
+        ''', (component, current))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return current
+
+
+def bootstrap_schema(pool, component, migrations, force=False):
+    """プロセス内で一度だけスキーマを最新化する
+
+    2回目以降の呼び出しは何もしない(force=True で再確認)。
+    """
+    key = (os.path.abspath(pool.db_path), component)
+    if not force and key in _bootstrapped:
+        return
+
+    with _bootstrap_lock:
+        if not force and key in _bootstrapped:
+            return
+        with pool.connection() as conn:
+            apply_migrations(conn, component, migrations)
+        _bootstrapped.add(key)
+
+
+def reset_bootstrap_state():
+    """ブートストラップ済みの記録を消す(fork後の子プロセスやテスト用)"""
+    with _bootstrap_lock:
+        _bootstrapped.clear()
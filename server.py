@@ -5,18 +5,46 @@
 """
 
 import json
-import sqlite3
 import hashlib
 import datetime
-import urllib.parse
-import html
-import re
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
 import os
+import random
+import signal
+import socket
+import sys
 import threading
 import time
 
+from db_pool import get_pool, storage_diagnostics, close_all_pools
+from schema import bootstrap_schema
+from write_queue import get_writer, writer_stats, close_all_writers
+from static_cache import get_static_cache, static_cache_stats
+from response_encoding import encode_json_response, response_stats
+from response_cache import get_response_cache, response_cache_stats
+from dedup import DuplicateWindow, content_hash
+from sanitizer import sanitize_text
+from submission_schema import RECORD_SCHEMA
+from rate_limiter import (
+    DEFAULT_BACKEND as DEFAULT_RATE_LIMIT_BACKEND, RATE_LIMIT_BACKENDS, SlidingWindowRateLimiter,
+    create_rate_limit_backend
+)
+from quality_flags import (
+    add_quality_flag_columns, apply_quality_flags, is_high_quality,
+    quality_flag_values, start_backfill
+)
+from tag_index import (
+    create_record_tags, index_record_tags, parse_meaning_tags, rebuild_record_tags,
+    set_record_tags_quality
+)
+from sample_reservoir import (
+    create_sample_reservoir, discard_sample, needs_refresh, offer_sample,
+    rebuild_sample_reservoirs, refresh_reservoir, reservoir_samples
+)
+from text_distance import close_distance_executors
+
 class MeaningDiversityAnalyzer:
     """意味づけデータの分析クラス"""
     
@@ -24,15 +52,14 @@ class MeaningDiversityAnalyzer:
         self.db_path = db_path
     
     def get_connection(self):
-        """データベース接続を取得"""
-        return sqlite3.connect(self.db_path)
+        """データベース接続を取得(接続プールから借りる)"""
+        return get_pool(self.db_path).connection()
     
     def analyze_event_diversity(self, event_tag=None):
         """イベントの意味づけ多様性を分析"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
             # 基本統計
             cursor.execute("SELECT COUNT(*) FROM meanings")
             total_count = cursor.fetchone()[0]
@@ -62,15 +89,12 @@ class MeaningDiversityAnalyzer:
                 "entropy_text": 0.0,  # 簡易実装
                 "entropy_tags": 0.0   # 簡易実装
             }
-        finally:
-            conn.close()
 
     def compare_solo_vs_social(self, event_tag=None):
         """Solo vs Social モードの比較分析"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
             cursor.execute("SELECT mode, COUNT(*) FROM meanings GROUP BY mode")
             mode_counts = dict(cursor.fetchall())
             
@@ -80,8 +104,6 @@ class MeaningDiversityAnalyzer:
                 "solo_count": mode_counts.get("solo", 0),
                 "social_count": mode_counts.get("social", 0)
             }
-        finally:
-            conn.close()
     
     def analyze_revision_impact(self, event_tag=None):
         """修正の影響分析"""
@@ -104,96 +126,148 @@ class MeaningDiversityAnalyzer:
         }
 
 
+class ApiError(Exception):
+    """HTTPエラーレスポンスとして返すべき例外"""
+    
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        # フィールド単位のエラー(あれば JSON で返す)
+        self.errors = errors
+    
+    def to_json(self):
+        return {'error': self.message, 'errors': self.errors}
+
+
+# /submit/batch で一度に受け付ける最大件数
+SUBMIT_BATCH_MAX_ITEMS = int(os.environ.get('SUBMIT_BATCH_MAX_ITEMS', 100))
+# 送信データ1件あたりに見込むJSONの大きさ(バイト)
+SUBMIT_ITEM_MAX_BYTES = int(os.environ.get('SUBMIT_ITEM_MAX_BYTES', 64 * 1024))
+# リクエストボディの最大サイズ(http.server / asyncio エンジン共通)
+#   上限件数のバッチが収まるよう、件数の上限から決める
+MAX_BODY_BYTES = SUBMIT_BATCH_MAX_ITEMS * SUBMIT_ITEM_MAX_BYTES
+
+# NDJSON の解析できなかった行
+INVALID_JSON_ITEM = object()
+INVALID_JSON_ERRORS = [{'field': None, 'code': 'json', 'message': 'invalid JSON'}]
+
+
+def parse_submission_batch(body):
+    """/submit/batch のボディ(JSON 配列 または NDJSON)を項目のリストにする
+    
+    NDJSON の解析できない行は INVALID_JSON_ITEM として項目毎のエラーにする。
+    """
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ApiError(400, 'Invalid JSON')
+    if text.lstrip().startswith('['):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError:
+            raise ApiError(400, 'Invalid JSON')
+        if not isinstance(items, list):
+            raise ApiError(400, 'Invalid JSON')
+        return items
+    
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError:
+            items.append(INVALID_JSON_ITEM)
+    return items
+
+
+# Netlifyドメインからのアクセスを許可
+ALLOWED_ORIGINS = [
+    'https://kotoimidiary.netlify.app',
+    'http://localhost:8000',
+    'http://127.0.0.1:8000'
+]
+
+
+def cors_headers(origin):
+    """CORS・セキュリティヘッダーの一覧を返す"""
+    if origin in ALLOWED_ORIGINS:
+        allow_origin = origin
+    else:
+        # デフォルトでNetlifyを許可
+        allow_origin = 'https://kotoimidiary.netlify.app'
+    
+    return [
+        ('Access-Control-Allow-Origin', allow_origin),
+        ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+        ('Access-Control-Allow-Headers', 'Content-Type'),
+        # セキュリティヘッダーの追加
+        ('X-Content-Type-Options', 'nosniff'),
+        ('X-Frame-Options', 'DENY'),
+        ('X-XSS-Protection', '1; mode=block'),
+        ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+        ('Content-Security-Policy',
+            "default-src 'self'; "
+            "script-src 'self' 'unsafe-inline'; "
+            "style-src 'self' 'unsafe-inline'; "
+            "img-src 'self' data:; "
+            "connect-src 'self'"),
+    ]
+
+
+# keep-alive 接続のアイドルタイムアウト(秒)
+KEEPALIVE_TIMEOUT = int(os.environ.get('KEEPALIVE_TIMEOUT', 15))
+
+
 class MeaningDiversityServer(BaseHTTPRequestHandler):
     
-    # レート制限用のクラス変数
-    _request_counts = {}
-    _blocked_ips = {}
-    _last_cleanup = time.time()
+    # HTTP/1.1 で接続を使い回す(アイドル状態が timeout 秒続いたら切断)
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
     
     # 設定値
     RATE_LIMIT_REQUESTS = 30  # 1分間あたりの最大リクエスト数
     RATE_LIMIT_WINDOW = 60    # 時間窓(秒)
     RATE_LIMIT_BLOCK_TIME = 300  # ブロック時間(秒)
     
+    # 全ハンドラー(スレッド)で共有するレート制限
+    rate_limiter = SlidingWindowRateLimiter(
+        RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, RATE_LIMIT_BLOCK_TIME
+    )
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
     
     def check_rate_limit(self):
         """レート制限のチェック"""
-        client_ip = self.client_address[0]
-        current_time = time.time()
-        
-        # 定期的にカウンターをクリーンアップ
-        if current_time - self._last_cleanup > self.RATE_LIMIT_WINDOW:
-            self._cleanup_rate_limit_data()
-            self._last_cleanup = current_time
-        
-        # ブロックされたIPかチェック
-        if client_ip in self._blocked_ips:
-            if current_time - self._blocked_ips[client_ip] < self.RATE_LIMIT_BLOCK_TIME:
-                return False
-            else:
-                # ブロック期間が過ぎたので解除
-                del self._blocked_ips[client_ip]
-        
-        # リクエスト数をカウント
-        if client_ip not in self._request_counts:
-            self._request_counts[client_ip] = []
-        
-        # 古いリクエストを削除
-        cutoff_time = current_time - self.RATE_LIMIT_WINDOW
-        self._request_counts[client_ip] = [
-            req_time for req_time in self._request_counts[client_ip] 
-            if req_time > cutoff_time
-        ]
-        
-        # リクエスト制限チェック
-        if len(self._request_counts[client_ip]) >= self.RATE_LIMIT_REQUESTS:
-            # IPをブロック
-            self._blocked_ips[client_ip] = current_time
-            return False
-        
-        # リクエストを記録
-        self._request_counts[client_ip].append(current_time)
-        return True
+        return self.check_client_rate_limit(self.client_address[0])
+    
+    @classmethod
+    def configure_rate_limiter(cls, backend_name, **options):
+        """レート制限の状態を置くバックエンドを切り替える(pre-fork では fork 前に呼ぶ)"""
+        cls.rate_limiter = SlidingWindowRateLimiter(
+            cls.RATE_LIMIT_REQUESTS, cls.RATE_LIMIT_WINDOW, cls.RATE_LIMIT_BLOCK_TIME,
+            backend=create_rate_limit_backend(backend_name, **options)
+        )
+        return cls.rate_limiter
     
-    def _cleanup_rate_limit_data(self):
-        """古いレート制限データをクリーンアップ"""
-        current_time = time.time()
-        cutoff_time = current_time - self.RATE_LIMIT_WINDOW
-        
-        # 古いリクエストカウントを削除
-        for ip in list(self._request_counts.keys()):
-            self._request_counts[ip] = [
-                req_time for req_time in self._request_counts[ip] 
-                if req_time > cutoff_time
-            ]
-            if not self._request_counts[ip]:
-                del self._request_counts[ip]
-        
-        # 期限切れのブロックを削除
-        for ip in list(self._blocked_ips.keys()):
-            if current_time - self._blocked_ips[ip] >= self.RATE_LIMIT_BLOCK_TIME:
-                del self._blocked_ips[ip]
+    @classmethod
+    def check_client_rate_limit(cls, client_ip):
+        """クライアントIP単位のレート制限チェック(HTTPエンジン非依存)"""
+        return cls.rate_limiter.allow(client_ip)
     
     def do_GET(self):
         """GET リクエストの処理"""
         parsed_path = urlparse(self.path)
         path = parsed_path.path
         
-        # CORS ヘッダーを設定
-        self.send_cors_headers()
-        
         if path == '/':
             # Railwayヘルスチェック対応 + index.html
             user_agent = self.headers.get('User-Agent', '')
             if 'curl' in user_agent.lower() or 'railway' in user_agent.lower() or self.headers.get('Accept') == 'text/plain':
                 # ヘルスチェックリクエスト
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'OK')
+                self.send_body(b'OK', 'text/plain')
             else:
                 # 通常のブラウザアクセス
                 self.serve_static_file('index.html', 'text/html')
@@ -205,25 +279,19 @@ class MeaningDiversityServer(BaseHTTPRequestHandler):
             self.handle_fetch_request(parsed_path.query)
         elif path == '/health':
             # ヘルスチェック - Railwayが期待する形式
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(b'OK')
-        elif path == '/' and self.headers.get('User-Agent', '').startswith('Railway'):
-            # Railway専用ルートヘルスチェック
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(b'OK')
+            self.send_body(b'OK', 'text/plain; charset=utf-8')
         elif path == '/research':
             # 研究者向け分析データ
             self.handle_research_request(parsed_path.query)
+        elif path == '/diagnostics':
+            # 運用診断(ストレージ設定・接続プール統計)
+            self.send_json_response(self.process_diagnostics())
         else:
             self.send_error(404, 'Not Found')
     
     def do_POST(self):
         """POST リクエストの処理"""
-        # レート制限チェック
+        # レート制限チェック(send_error は Connection: close を付けるので未読のボディは残らない)
         if not self.check_rate_limit():
             self.send_error(429, 'Too Many Requests')
             return
@@ -231,11 +299,10 @@ class MeaningDiversityServer(BaseHTTPRequestHandler):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
         
-        # CORS ヘッダーを設定
-        self.send_cors_headers()
-        
         if path == '/submit':
             self.handle_submit_request()
+        elif path == '/submit/batch':
+            self.handle_submit_batch_request()
         elif path == '/update_saw_alt_meanings':
             self.handle_update_saw_alt_meanings()
         else:
@@ -243,113 +310,96 @@ class MeaningDiversityServer(BaseHTTPRequestHandler):
     
     def do_OPTIONS(self):
         """CORS プリフライトリクエストの処理"""
-        self.send_cors_headers()
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
+    def end_headers(self):
+        """全てのレスポンス(send_error を含む)に CORS ヘッダーを付けてからヘッダーを終える"""
+        self.send_cors_headers()
+        super().end_headers()
+    
     def send_cors_headers(self):
         """CORS ヘッダーを送信"""
-        self.send_response(200)
-        # Netlifyドメインからのアクセスを許可
-        origin = self.headers.get('Origin')
-        allowed_origins = [
-            'https://kotoimidiary.netlify.app',
-            'http://localhost:8000',
-            'http://127.0.0.1:8000'
-        ]
-        
-        if origin in allowed_origins:
-            self.send_header('Access-Control-Allow-Origin', origin)
-        else:
-            # デフォルトでNetlifyを許可
-            self.send_header('Access-Control-Allow-Origin', 'https://kotoimidiary.netlify.app')
-            
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        
-        # セキュリティヘッダーの追加
-        self.send_header('X-Content-Type-Options', 'nosniff')
-        self.send_header('X-Frame-Options', 'DENY')
-        self.send_header('X-XSS-Protection', '1; mode=block')
-        self.send_header('Referrer-Policy', 'strict-origin-when-cross-origin')
-        self.send_header('Content-Security-Policy', 
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline'; "
-            "style-src 'self' 'unsafe-inline'; "
-            "img-src 'self' data:; "
-            "connect-src 'self'"
-        )
+        for name, value in cors_headers(self.headers.get('Origin')):
+            self.send_header(name, value)
+    
+    def send_body(self, body, content_type, status=200, headers=()):
+        """ステータス行・Content-Length 付きでレスポンスを1つ送信"""
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def serve_static_file(self, filename, content_type):
-        """静的ファイルを提供"""
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            self.send_response(200)
-            self.send_header('Content-Type', content_type + '; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
-        except FileNotFoundError:
+        """静的ファイルを提供(メモリキャッシュから ETag / gzip 対応で返す)"""
+        result = get_static_cache().respond(
+            filename, content_type + '; charset=utf-8',
+            self.headers.get('If-None-Match'),
+            self.headers.get('Accept-Encoding')
+        )
+        if result is None:
             self.send_error(404, 'File not found')
+            return
+        
+        status, headers, body = result
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def read_body(self):
+        """リクエストボディを読み取る(MAX_BODY_BYTES を超えるものは読まずに 413)"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise ApiError(400, 'Bad Content-Length')
+        if content_length < 0:
+            raise ApiError(400, 'Bad Content-Length')
+        if content_length > MAX_BODY_BYTES:
+            raise ApiError(413, 'Payload Too Large')
+        return self.rfile.read(content_length)
+    
+    def read_json_body(self):
+        """リクエストボディをJSONとして読み取る"""
+        return json.loads(self.read_body().decode('utf-8'))
     
     def handle_submit_request(self):
         """データ送信リクエストを処理"""
         try:
-            # リクエストボディを読み取り
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
-            # データバリデーション
-            if not self.validate_submission_data(data):
-                self.send_error(400, 'Invalid data')
-                return
-            
-            # 品質フラグの追加処理
-            self.enhance_quality_flags(data)
-            
-            # データベースに保存
-            db = DatabaseManager()
-            record_id = db.insert_record(data)
-            
-            # 成功レスポンス
-            response = {
-                'success': True,
-                'record_id': record_id,
-                'timestamp': datetime.datetime.now().isoformat()
-            }
-            
-            self.send_json_response(response)
-            
+            data = self.read_json_body()
+            self.send_json_response(self.process_submission(data))
+        except ApiError as e:
+            self.send_api_error(e)
         except json.JSONDecodeError:
             self.send_error(400, 'Invalid JSON')
         except Exception as e:
             print(f"Submit error: {e}")
             self.send_error(500, 'Internal server error')
     
+    def handle_submit_batch_request(self):
+        """まとめて送信されたデータ(JSON 配列 / NDJSON)を処理"""
+        try:
+            items = parse_submission_batch(self.read_body())
+            self.send_json_response(self.process_submission_batch(items))
+        except ApiError as e:
+            self.send_api_error(e)
+        except Exception as e:
+            print(f"Submit batch error: {e}")
+            self.send_error(500, 'Internal server error')
+    
     def handle_update_saw_alt_meanings(self):
         """saw_alt_meaningsフラグの更新"""
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
-            record_id = data.get('record_id')
-            saw_alt_meanings = data.get('saw_alt_meanings', False)
-            
-            if not record_id:
-                self.send_error(400, 'record_id required')
-                return
-            
-            db = DatabaseManager()
-            success = db.update_saw_alt_meanings(record_id, saw_alt_meanings)
-            
-            if success:
-                self.send_json_response({'success': True})
-            else:
-                self.send_error(404, 'Record not found')
-                
+            data = self.read_json_body()
+            self.send_json_response(self.process_update_saw_alt_meanings(data))
+        except ApiError as e:
+            self.send_api_error(e)
         except json.JSONDecodeError:
             self.send_error(400, 'Invalid JSON')
         except Exception as e:
@@ -359,28 +409,9 @@ class MeaningDiversityServer(BaseHTTPRequestHandler):
     def handle_research_request(self, query_string):
         """研究者向け分析データ取得リクエストを処理"""
         try:
-            from research_analyzer import MeaningDiversityAnalyzer
-            
-            params = parse_qs(query_string)
-            analysis_type = params.get('type', ['diversity'])[0]
-            event_tag = params.get('event_tag', [None])[0]
-            
-            analyzer = MeaningDiversityAnalyzer(self.db_path if hasattr(self, 'db_path') else 'kotoiminiki.db')
-            
-            if analysis_type == 'diversity':
-                result = analyzer.analyze_event_diversity(event_tag)
-            elif analysis_type == 'mode_comparison':
-                result = analyzer.compare_solo_vs_social(event_tag)
-            elif analysis_type == 'revision_impact':
-                result = analyzer.analyze_revision_impact(event_tag)
-            elif analysis_type == 'comprehensive':
-                result = analyzer.generate_comprehensive_report()
-            else:
-                self.send_error(400, 'Invalid analysis type')
-                return
-            
-            self.send_json_response(result)
-            
+            self.send_json_response(self.process_research(query_string))
+        except ApiError as e:
+            self.send_api_error(e)
         except Exception as e:
             print(f"Research request error: {e}")
             self.send_error(500, 'Analysis error')
@@ -388,286 +419,631 @@ class MeaningDiversityServer(BaseHTTPRequestHandler):
     def handle_fetch_request(self, query_string):
         """分布データ取得リクエストを処理"""
         try:
-            params = parse_qs(query_string)
-            event_tag = params.get('event_tag', [''])[0]
-            
-            if not event_tag:
-                self.send_error(400, 'event_tag parameter required')
-                return
-            
-            db = DatabaseManager()
-            distribution_data = db.get_distribution_data(event_tag)
-            
-            self.send_json_response(distribution_data)
-            
+            self.send_json_response(self.process_fetch(query_string))
+        except ApiError as e:
+            self.send_api_error(e)
         except Exception as e:
             print(f"Fetch error: {e}")
             self.send_error(500, 'Internal server error')
     
-    def sanitize_input(self, text):
-        """入力値のサニタイゼーション"""
-        if not isinstance(text, str):
-            return str(text)
+    # --- ルート処理本体(http.server / asyncio エンジン共通) ---
+    
+    @classmethod
+    def process_submission(cls, data):
+        """送信データを検証・保存してレスポンスを返す"""
+        # データバリデーション(テキスト項目はサニタイズ済みの値に置き換わる)
+        errors = RECORD_SCHEMA.validate(data)
+        if errors:
+            raise ApiError(400, 'Invalid data', errors)
         
-        # HTML エスケープ
-        sanitized = html.escape(text)
+        # 品質フラグの追加処理
+        cls.enhance_quality_flags(data)
         
-        # 危険なスクリプトタグを除去
-        sanitized = re.sub(r'<script[^>]*>.*?</script>', '', sanitized, flags=re.DOTALL | re.IGNORECASE)
+        # データベースに保存
+        db = DatabaseManager.shared()
+        record_id = db.insert_record(data)
         
-        # その他の危険なタグを除去
-        dangerous_tags = ['iframe', 'object', 'embed', 'form', 'input', 'button']
-        for tag in dangerous_tags:
-            sanitized = re.sub(f'<{tag}[^>]*>.*?</{tag}>', '', sanitized, flags=re.DOTALL | re.IGNORECASE)
-            sanitized = re.sub(f'<{tag}[^>]*/?>', '', sanitized, flags=re.IGNORECASE)
+        # 成功レスポンス
+        return {
+            'success': True,
+            'record_id': record_id,
+            'timestamp': datetime.datetime.now().isoformat()
+        }
+    
+    @classmethod
+    def process_submission_batch(cls, items):
+        """複数の送信データを検証し、有効なものを1トランザクションで保存する
         
-        # JavaScript プロトコルを除去
-        sanitized = re.sub(r'javascript:', '', sanitized, flags=re.IGNORECASE)
+        重複判定はバッチ内の先行する項目も対象にする。結果は項目毎に
+        index・success と record_id または errors を返す。
+        """
+        if not items:
+            raise ApiError(400, 'Empty batch')
+        if len(items) > SUBMIT_BATCH_MAX_ITEMS:
+            raise ApiError(413, f'Too many items (max {SUBMIT_BATCH_MAX_ITEMS})')
         
-        # 長すぎる入力を制限(DoS攻撃対策)
-        if len(sanitized) > 10000:
-            sanitized = sanitized[:10000]
+        results = [None] * len(items)
+        accepted = []
+        for index, data in enumerate(items):
+            errors = INVALID_JSON_ERRORS if data is INVALID_JSON_ITEM else RECORD_SCHEMA.validate(data)
+            if errors:
+                results[index] = {'index': index, 'success': False, 'errors': errors}
+            else:
+                accepted.append((index, data))
         
-        return sanitized.strip()
-    
-    def validate_submission_data(self, data):
-        """送信データのバリデーション(強化版)"""
-        required_fields = [
-            'user_id_hash', 'consent', 'mode', 'event_tag', 
-            'meaning_text', 'rt_ms'
-        ]
+        batch_hashes = set()
+        for index, data in accepted:
+            cls.enhance_quality_flags(data, batch_hashes)
         
-        # 必須フィールドの存在確認
-        for field in required_fields:
-            if field not in data:
-                return False
+        if accepted:
+            db = DatabaseManager.shared()
+            record_ids = db.insert_records([data for _, data in accepted])
+            for (index, _), record_id in zip(accepted, record_ids):
+                results[index] = {'index': index, 'success': True, 'record_id': record_id}
         
-        # データ型の検証
-        if not isinstance(data['consent'], bool):
-            return False
-        
-        if not isinstance(data['rt_ms'], int) or data['rt_ms'] < 0:
-            return False
+        return {
+            'success': len(accepted) == len(items),
+            'inserted': len(accepted),
+            'failed': len(items) - len(accepted),
+            'results': results,
+            'timestamp': datetime.datetime.now().isoformat()
+        }
+    
+    @classmethod
+    def process_update_saw_alt_meanings(cls, data):
+        """saw_alt_meaningsフラグを更新してレスポンスを返す"""
+        record_id = data.get('record_id')
+        saw_alt_meanings = data.get('saw_alt_meanings', False)
         
-        # テキストフィールドのサニタイゼーション
-        text_fields = ['event_text', 'meaning_text', 'meaning_tag', 'user_id_hash', 'event_tag']
-        for field in text_fields:
-            if field in data and data[field]:
-                data[field] = self.sanitize_input(data[field])
+        if not record_id:
+            raise ApiError(400, 'record_id required')
         
-        # 意味づけテキストの長さチェック
-        if len(data['meaning_text'].strip()) < 5:
-            return False
+        db = DatabaseManager.shared()
+        if not db.update_saw_alt_meanings(record_id, saw_alt_meanings):
+            raise ApiError(404, 'Record not found')
         
-        # モードの値チェック
-        if data['mode'] not in ['solo', 'social']:
-            return False
+        return {'success': True}
+    
+    @classmethod
+    def process_research(cls, query_string, db_path='kotoiminiki.db'):
+        """研究者向け分析を実行して結果を返す"""
+        from research_analyzer import DEFAULT_DISTANCE_MODE, DISTANCE_MODES, MeaningDiversityAnalyzer
+        from text_distance import DEFAULT_SAMPLE_PAIRS
         
-        # event_tag の検証(許可されたタグのみ)
-        allowed_event_tags = [
-            'work_late', 'work_praised', 'work_failed', 'work_success', 'work_conflict',
-            'relationship_fight', 'relationship_support', 'relationship_betrayal', 
-            'relationship_love', 'relationship_breakup',
-            'health_sick', 'health_injury', 'health_recovery', 'health_tired',
-            'money_loss', 'money_gain', 'money_debt', 'money_purchase',
-            'weather_rain', 'weather_storm', 'weather_sunny', 'weather_cold',
-            'accident_minor', 'accident_loss', 'accident_broken', 'accident_delay',
-            'achievement_goal', 'achievement_recognition', 'achievement_skill',
-            'loss_opportunity', 'loss_mistake', 'loss_rejection',
-            'surprise_news', 'surprise_meeting', 'surprise_discovery',
-            'other'
-        ]
+        params = parse_qs(query_string)
+        analysis_type = params.get('type', ['diversity'])[0]
+        event_tag = params.get('event_tag', [None])[0]
         
-        if data['event_tag'] not in allowed_event_tags:
-            return False
+        # 平均意味距離: distance=exact|estimate, pairs=抽出する組数, target_se=目標標準誤差, seed
+        distance_mode = params.get('distance', [DEFAULT_DISTANCE_MODE])[0]
+        if distance_mode not in DISTANCE_MODES:
+            raise ApiError(400, 'Invalid distance mode')
+        try:
+            sample_pairs = int(params.get('pairs', [DEFAULT_SAMPLE_PAIRS])[0])
+            target_se = params.get('target_se', [None])[0]
+            target_se = float(target_se) if target_se is not None else None
+            seed = params.get('seed', [None])[0]
+            seed = int(seed) if seed is not None else None
+        except ValueError:
+            raise ApiError(400, 'Invalid distance parameters')
+        if sample_pairs < 2 or (target_se is not None and not target_se > 0):
+            raise ApiError(400, 'Invalid distance parameters')
         
-        # user_id_hash の形式確認
-        if not re.match(r'^anon_[a-z0-9_]+$', data['user_id_hash']):
-            return False
+        DatabaseManager.shared(db_path)
+        analyzer = MeaningDiversityAnalyzer(db_path, distance_mode=distance_mode,
+                                            sample_pairs=sample_pairs, target_se=target_se,
+                                            seed=seed)
         
-        return True
+        if analysis_type == 'diversity':
+            return analyzer.analyze_event_diversity(event_tag)
+        elif analysis_type == 'mode_comparison':
+            return analyzer.compare_solo_vs_social(event_tag)
+        elif analysis_type == 'revision_impact':
+            return analyzer.analyze_revision_impact(event_tag)
+        elif analysis_type == 'comprehensive':
+            return analyzer.generate_comprehensive_report()
+        else:
+            raise ApiError(400, 'Invalid analysis type')
     
-    def enhance_quality_flags(self, data):
-        """品質フラグの追加処理"""
-        quality_flags = json.loads(data.get('quality_flags', '{}'))
+    @classmethod
+    def process_fetch(cls, query_string):
+        """分布データを取得して返す"""
+        params = parse_qs(query_string)
+        event_tag = params.get('event_tag', [''])[0]
+        
+        if not event_tag:
+            raise ApiError(400, 'event_tag parameter required')
         
+        # 分布・件数・リザーバーは書き込みがあるまでキャッシュから返し、
+        # 表示するサンプルはリクエスト毎に引き直す
+        db = DatabaseManager.shared()
+        snapshot = get_response_cache().get_or_compute(
+            ('/fetch', event_tag), ('fetch', event_tag),
+            lambda: db.get_distribution_snapshot(event_tag)
+        )
+        return DatabaseManager.distribution_response(snapshot)
+    
+    @classmethod
+    def process_diagnostics(cls):
+        """運用診断情報を返す"""
+        db = DatabaseManager.shared()
+        return {
+            'storage': storage_diagnostics(),
+            'write_queue': writer_stats(),
+            'static': static_cache_stats(),
+            'responses': response_stats(),
+            'response_cache': response_cache_stats(),
+            'dedup': db.dedup.stats(),
+            'rate_limit': cls.rate_limiter.stats(),
+            'generated_at': datetime.datetime.now().isoformat()
+        }
+    
+    @staticmethod
+    def sanitize_input(text):
+        """入力値のサニタイゼーション"""
+        return sanitize_text(text)
+    
+    @classmethod
+    def validate_submission_data(cls, data):
+        """送信データのバリデーション(エラーが無ければ True)"""
+        return RECORD_SCHEMA.is_valid(data)
+    
+    @staticmethod
+    def enhance_quality_flags(data, batch_hashes=None):
+        """品質フラグの追加処理(batch_hashes: 同じバッチで先に処理した項目の content_hash)"""
         # 重複チェック
-        db = DatabaseManager()
+        db = DatabaseManager.shared()
         is_duplicate = db.check_duplicate(
             data['user_id_hash'], 
             data['event_tag'], 
             data['meaning_text']
         )
-        quality_flags['duplicate'] = is_duplicate
-        
-        # スパム検出(反応時間ベース)
-        if data['rt_ms'] < 500:
-            quality_flags['spam'] = True
+        if batch_hashes is not None:
+            record_hash = content_hash(data['user_id_hash'], data['event_tag'], data['meaning_text'])
+            is_duplicate = is_duplicate or record_hash in batch_hashes
+            batch_hashes.add(record_hash)
         
-        # 短すぎる意味づけ
-        if len(data['meaning_text'].strip()) < 10:
-            quality_flags['too_short'] = True
-        
-        data['quality_flags'] = json.dumps(quality_flags)
+        # スパム(反応時間)・短すぎる意味づけ
+        apply_quality_flags(data, is_duplicate)
     
-    def send_json_response(self, data):
-        """JSON レスポンスを送信"""
-        json_data = json.dumps(data, ensure_ascii=False, indent=2)
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json_data.encode('utf-8'))
+    def send_json_response(self, data, status=200):
+        """JSON レスポンスを送信(コンパクト表記、?pretty=1 で整形、大きければ gzip)"""
+        parsed_path = urlparse(self.path)
+        body, headers = encode_json_response(
+            data,
+            route=parsed_path.path if status < 400 else None,
+            query_string=parsed_path.query,
+            accept_encoding=self.headers.get('Accept-Encoding')
+        )
+        self.send_body(body, None, status=status, headers=headers)
+    
+    def send_api_error(self, error):
+        """ApiError を送信(フィールド単位のエラーがあれば JSON、無ければエラーページ)"""
+        if error.errors:
+            self.send_json_response(error.to_json(), status=error.status)
+        else:
+            self.send_error(error.status, error.message)
+
+def _add_legacy_record_columns(conn):
+    """初期版のDBに存在しない列を追加"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(records)')}
+    if 'original_meaning' not in columns:
+        conn.execute('ALTER TABLE records ADD COLUMN original_meaning TEXT')
+    if 'revision_count' not in columns:
+        conn.execute('ALTER TABLE records ADD COLUMN revision_count INTEGER DEFAULT 0')
+
+
+RECORD_INSERT_SQL = '''
+    INSERT INTO records (
+        id, user_id_hash, timestamp, consent, mode,
+        event_text, event_tag, meaning_text, meaning_tag,
+        rt_ms, saw_alt_meanings, changed_after_view,
+        quality_flags, locale, original_meaning, revision_count,
+        is_spam, is_duplicate, is_too_short, content_hash, received_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def record_values(record_id, data, record_hash=None, received_at=None):
+    """検証済みの送信データを RECORD_INSERT_SQL のパラメータにする"""
+    return (
+        record_id,
+        data['user_id_hash'],
+        data['timestamp'],
+        data['consent'],
+        data['mode'],
+        data.get('event_text', ''),
+        data['event_tag'],
+        data['meaning_text'],
+        data.get('meaning_tag', ''),
+        data['rt_ms'],
+        data.get('saw_alt_meanings', False),
+        data.get('changed_after_view', False),
+        data.get('quality_flags', '{}'),
+        data.get('locale', 'ja-JP'),
+        data.get('original_meaning', ''),
+        data.get('revision_count', 0),
+        *quality_flag_values(data.get('quality_flags', '{}')),
+        record_hash or content_hash(data['user_id_hash'], data['event_tag'], data['meaning_text']),
+        received_at or time.time()
+    )
+
+
+def split_meaning_tags(meaning_tag):
+    """meaning_tag(カンマ区切り)を分布の集計単位に分割(未設定は「その他」)"""
+    return parse_meaning_tags(meaning_tag) if meaning_tag else ['その他']
+
+
+def apply_distribution_delta(conn, event_tag, meaning_tag, delta):
+    """1レコード分の増減を分布カウンタに反映(トランザクションは呼び出し側)"""
+    for tag in split_meaning_tags(meaning_tag):
+        conn.execute('''
+            INSERT INTO distribution_counts (event_tag, tag, count) VALUES (?, ?, ?)
+            ON CONFLICT(event_tag, tag) DO UPDATE SET count = count + excluded.count
+        ''', (event_tag, tag, delta))
+    conn.execute('''
+        INSERT INTO distribution_totals (event_tag, total) VALUES (?, ?)
+        ON CONFLICT(event_tag) DO UPDATE SET total = total + excluded.total
+    ''', (event_tag, delta))
+    if delta < 0:
+        conn.execute(
+            'DELETE FROM distribution_counts WHERE event_tag = ? AND count <= 0', (event_tag,)
+        )
+        conn.execute(
+            'DELETE FROM distribution_totals WHERE event_tag = ? AND total <= 0', (event_tag,)
+        )
+
+
+def rebuild_distribution_counts(conn):
+    """records から分布カウンタを計算し直す(トランザクションは呼び出し側)"""
+    counts = {}
+    totals = {}
+    rows = conn.execute('''
+        SELECT event_tag, meaning_tag, consent, quality_flags FROM records
+    ''')
+    for event_tag, meaning_tag, consent, quality_flags in rows:
+        if not is_high_quality(consent, quality_flags):
+            continue
+        totals[event_tag] = totals.get(event_tag, 0) + 1
+        for tag in split_meaning_tags(meaning_tag):
+            key = (event_tag, tag)
+            counts[key] = counts.get(key, 0) + 1
+
+    conn.execute('DELETE FROM distribution_counts')
+    conn.execute('DELETE FROM distribution_totals')
+    conn.executemany(
+        'INSERT INTO distribution_counts (event_tag, tag, count) VALUES (?, ?, ?)',
+        [(event_tag, tag, count) for (event_tag, tag), count in counts.items()]
+    )
+    conn.executemany(
+        'INSERT INTO distribution_totals (event_tag, total) VALUES (?, ?)',
+        list(totals.items())
+    )
+    return sum(totals.values())
+
+
+def _add_content_hash_columns(conn):
+    """重複判定用の content_hash / received_at 列を追加"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(records)')}
+    if 'content_hash' not in columns:
+        conn.execute('ALTER TABLE records ADD COLUMN content_hash TEXT')
+    if 'received_at' not in columns:
+        conn.execute('ALTER TABLE records ADD COLUMN received_at REAL')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_records_content_hash
+        ON records(content_hash, received_at)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_records_received_at ON records(received_at)')
+    
+    # 従来の判定(timestamp が1日以内)で対象になり得た記録だけハッシュを付ける
+    # 受信時刻は不明なので、安全側に倒して移行時刻とする
+    now = time.time()
+    rows = conn.execute('''
+        SELECT id, user_id_hash, event_tag, meaning_text FROM records
+        WHERE content_hash IS NULL AND timestamp > datetime('now', '-1 day')
+    ''').fetchall()
+    conn.executemany(
+        'UPDATE records SET content_hash = ?, received_at = ? WHERE id = ?',
+        [(content_hash(user_id_hash, event_tag, meaning_text), now, record_id)
+         for record_id, user_id_hash, event_tag, meaning_text in rows]
+    )
+
+
+def _create_distribution_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS distribution_counts (
+            event_tag TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (event_tag, tag)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS distribution_totals (
+            event_tag TEXT PRIMARY KEY,
+            total INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    rebuild_distribution_counts(conn)
+
+
+# records スキーマのマイグレーション(i番目がバージョン i+1)
+RECORDS_MIGRATIONS = [
+    # v1: records テーブルとインデックス
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS records (
+            id TEXT PRIMARY KEY,
+            user_id_hash TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            consent BOOLEAN NOT NULL,
+            mode TEXT NOT NULL,
+            event_text TEXT,
+            event_tag TEXT NOT NULL,
+            meaning_text TEXT NOT NULL,
+            meaning_tag TEXT,
+            rt_ms INTEGER NOT NULL,
+            saw_alt_meanings BOOLEAN DEFAULT FALSE,
+            changed_after_view BOOLEAN DEFAULT FALSE,
+            quality_flags TEXT,
+            locale TEXT DEFAULT 'ja-JP',
+            original_meaning TEXT,
+            revision_count INTEGER DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_event_tag ON records(event_tag)',
+        'CREATE INDEX IF NOT EXISTS idx_timestamp ON records(timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_consent ON records(consent)',
+    ],
+    # v2: original_meaning / revision_count 追加前に作られたDBの補完
+    _add_legacy_record_columns,
+    # v3: /fetch 用の分布カウンタ(既存レコードから初期値を計算)
+    _create_distribution_tables,
+    # v4: 品質フラグの整数列と部分インデックス(既存レコードはオンラインでバックフィル)
+    add_quality_flag_columns,
+    # v5: meaning_tag を1タグ1行に正規化した索引(既存レコードから作成)
+    create_record_tags,
+    # v6: /fetch のサンプル用リザーバー(既存レコードから初期化)
+    create_sample_reservoir,
+    # v7: 重複判定用のハッシュ列と受信時刻
+    _add_content_hash_columns,
+]
+
 
 class DatabaseManager:
     """データベース管理クラス"""
     
+    _shared_instances = {}
+    _shared_lock = threading.Lock()
+    # このプロセスがDBへの書き込みを全て行う(単一プロセス)なら、
+    # メモリ上の重複判定ウィンドウに無いことをもって「重複なし」と判定できる
+    dedup_authoritative = False
+    
     def __init__(self, db_path='kotoiminiki.db'):
         self.db_path = db_path
+        # 同じDBファイルを使うインスタンス間で接続プール・書き込みキューを共有
+        self.pool = get_pool(db_path)
+        self.writer = get_writer(db_path)
+        # 引き直しを依頼済みのリザーバー(同じ出来事を重ねて依頼しない)
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
         self.init_database()
+        self.dedup = DuplicateWindow(authoritative=self.dedup_authoritative)
+        self.load_dedup_window()
+        # v4 より前のレコードの品質フラグ列を稼働中に埋める
+        start_backfill(self.pool, self.writer)
+    
+    @classmethod
+    def shared(cls, db_path='kotoiminiki.db'):
+        """プロセス内で共有するインスタンスを取得(ハンドラーから再利用する)"""
+        with cls._shared_lock:
+            instance = cls._shared_instances.get(db_path)
+            if instance is None:
+                instance = cls(db_path)
+                cls._shared_instances[db_path] = instance
+            return instance
+    
+    @classmethod
+    def reset_shared(cls):
+        """共有インスタンスを破棄(接続プールを作り直すとき用)"""
+        with cls._shared_lock:
+            cls._shared_instances.clear()
     
     def init_database(self):
-        """データベースとテーブルの初期化"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # records テーブルの作成
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS records (
-                id TEXT PRIMARY KEY,
-                user_id_hash TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                consent BOOLEAN NOT NULL,
-                mode TEXT NOT NULL,
-                event_text TEXT,
-                event_tag TEXT NOT NULL,
-                meaning_text TEXT NOT NULL,
-                meaning_tag TEXT,
-                rt_ms INTEGER NOT NULL,
-                saw_alt_meanings BOOLEAN DEFAULT FALSE,
-                changed_after_view BOOLEAN DEFAULT FALSE,
-                quality_flags TEXT,
-                locale TEXT DEFAULT 'ja-JP',
-                original_meaning TEXT,
-                revision_count INTEGER DEFAULT 0
-            )
-        ''')
-        
-        # インデックスの作成
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_event_tag ON records(event_tag)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON records(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consent ON records(consent)')
-        
-        conn.commit()
-        conn.close()
+        """データベースとテーブルの初期化(プロセス内で初回のみDDLを実行)"""
+        bootstrap_schema(self.pool, 'records', RECORDS_MIGRATIONS)
     
     def insert_record(self, data):
-        """レコードの挿入"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """レコードの挿入(同時に届いた挿入とまとめてグループコミット)"""
         # レコードIDの生成
         record_id = self.generate_record_id()
         
-        cursor.execute('''
-            INSERT INTO records (
-                id, user_id_hash, timestamp, consent, mode,
-                event_text, event_tag, meaning_text, meaning_tag,
-                rt_ms, saw_alt_meanings, changed_after_view,
-                quality_flags, locale, original_meaning, revision_count
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            record_id,
-            data['user_id_hash'],
-            data['timestamp'],
-            data['consent'],
-            data['mode'],
-            data.get('event_text', ''),
-            data['event_tag'],
-            data['meaning_text'],
-            data.get('meaning_tag', ''),
-            data['rt_ms'],
-            data.get('saw_alt_meanings', False),
-            data.get('changed_after_view', False),
-            data.get('quality_flags', '{}'),
-            data.get('locale', 'ja-JP'),
-            data.get('original_meaning', ''),
-            data.get('revision_count', 0)
-        ))
-        
-        conn.commit()
-        conn.close()
+        received_at = time.time()
+        record_hash = content_hash(data['user_id_hash'], data['event_tag'], data['meaning_text'])
         
+        self.writer.execute(
+            lambda conn: self._insert_record(conn, record_id, data, record_hash, received_at)
+        )
+        self.dedup.add(record_hash, received_at)
+        get_response_cache().invalidate(('fetch', data['event_tag']))
+        return record_id
+    
+    def insert_records(self, items):
+        """複数レコードを1トランザクションで挿入し、レコードIDのリストを返す"""
+        received_at = time.time()
+        prepared = [
+            (self.generate_record_id(), data,
+             content_hash(data['user_id_hash'], data['event_tag'], data['meaning_text']))
+            for data in items
+        ]
+        
+        def insert_all(conn):
+            for record_id, data, record_hash in prepared:
+                self._insert_record(conn, record_id, data, record_hash, received_at)
+        
+        self.writer.execute(insert_all)
+        cache = get_response_cache()
+        for _, data, record_hash in prepared:
+            self.dedup.add(record_hash, received_at)
+        for event_tag in {data['event_tag'] for data in items}:
+            cache.invalidate(('fetch', event_tag))
+        return [record_id for record_id, _, _ in prepared]
+    
+    def _insert_record(self, conn, record_id, data, record_hash=None, received_at=None):
+        """トランザクション内でレコードを挿入(コミットは呼び出し側)"""
+        conn.execute(RECORD_INSERT_SQL, record_values(record_id, data, record_hash, received_at))
+        # 分布カウンタ・タグ索引も同じトランザクションで更新
+        high_quality = is_high_quality(data['consent'], data.get('quality_flags', '{}'))
+        if high_quality:
+            apply_distribution_delta(conn, data['event_tag'], data.get('meaning_tag', ''), 1)
+            offer_sample(conn, data['event_tag'], record_id, data['meaning_text'])
+        index_record_tags(conn, record_id, data['event_tag'], data['mode'],
+                          data.get('meaning_tag', ''), data['consent'], high_quality)
         return record_id
     
+    def update_quality_flags(self, record_id, quality_flags):
+        """品質フラグを更新し、分布カウンタに反映する(見つからなければFalse)"""
+        if not isinstance(quality_flags, str):
+            quality_flags = json.dumps(quality_flags)
+        event_tag = self.writer.execute(
+            lambda conn: self._update_quality_flags(conn, record_id, quality_flags)
+        )
+        if event_tag is None:
+            return False
+        get_response_cache().invalidate(('fetch', event_tag))
+        return True
+    
+    def _update_quality_flags(self, conn, record_id, quality_flags):
+        row = conn.execute('''
+            SELECT event_tag, meaning_tag, consent, quality_flags, meaning_text
+            FROM records WHERE id = ?
+        ''', (record_id,)).fetchone()
+        if row is None:
+            return None
+        
+        event_tag, meaning_tag, consent, old_flags, meaning_text = row
+        conn.execute('''
+            UPDATE records
+            SET quality_flags = ?, is_spam = ?, is_duplicate = ?, is_too_short = ?
+            WHERE id = ?
+        ''', (quality_flags, *quality_flag_values(quality_flags), record_id))
+        
+        was_counted = is_high_quality(consent, old_flags)
+        is_counted = is_high_quality(consent, quality_flags)
+        if was_counted != is_counted:
+            apply_distribution_delta(conn, event_tag, meaning_tag, 1 if is_counted else -1)
+            set_record_tags_quality(conn, record_id, is_counted)
+            if is_counted:
+                offer_sample(conn, event_tag, record_id, meaning_text)
+            else:
+                discard_sample(conn, record_id)
+        return event_tag
+    
+    def rebuild_distribution(self):
+        """分布カウンタを records から再計算し、数えたレコード数を返す"""
+        counted = self.writer.execute(rebuild_distribution_counts)
+        get_response_cache().invalidate()
+        return counted
+    
+    def rebuild_tag_index(self):
+        """タグ索引(record_tags)を records から作り直し、タグ数を返す"""
+        return self.writer.execute(rebuild_record_tags)
+    
+    def rebuild_sample_reservoirs(self):
+        """全ての出来事のサンプルリザーバーを引き直し、出来事数を返す"""
+        events = self.writer.execute(rebuild_sample_reservoirs)
+        get_response_cache().invalidate()
+        return events
+    
+    def schedule_reservoir_refresh(self, event_tag):
+        """リザーバーの引き直しを書き込みキューに依頼する(完了は待たない)"""
+        with self._refreshing_lock:
+            if event_tag in self._refreshing:
+                return
+            self._refreshing.add(event_tag)
+        
+        def done(future):
+            with self._refreshing_lock:
+                self._refreshing.discard(event_tag)
+            # 引き直したサンプルを次の /fetch から使う
+            get_response_cache().invalidate(('fetch', event_tag))
+        
+        self.writer.submit(lambda conn: refresh_reservoir(conn, event_tag)).add_done_callback(done)
+    
     def get_distribution_data(self, event_tag):
-        """分布データの取得"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 品質の良いデータのみを取得
-        cursor.execute('''
-            SELECT meaning_tag, meaning_text, quality_flags
-            FROM records 
-            WHERE event_tag = ? AND consent = TRUE
-        ''', (event_tag,))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # 品質フィルタリング
-        filtered_rows = []
-        for row in rows:
-            quality_flags = json.loads(row[2] or '{}')
-            if not (quality_flags.get('spam', False) or 
-                   quality_flags.get('duplicate', False)):
-                filtered_rows.append(row)
-        
-        # 分布の計算
-        distribution = {}
-        meaning_texts = []
-        
-        for row in filtered_rows:
-            meaning_tag = row[0] if row[0] else 'その他'
-            meaning_text = row[1]
-            
-            # タグが複数ある場合は分割
-            tags = meaning_tag.split(',') if meaning_tag else ['その他']
-            for tag in tags:
-                tag = tag.strip()
-                if tag:
-                    distribution[tag] = distribution.get(tag, 0) + 1
+        """分布データの取得(分布は挿入時に更新済みのカウンタから読む)"""
+        return self.distribution_response(self.get_distribution_snapshot(event_tag))
+    
+    def get_distribution_snapshot(self, event_tag):
+        """分布・件数・リザーバー内の意味づけ(/fetch のキャッシュ対象、変更しないこと)"""
+        with self.pool.connection() as conn:
+            distribution = dict(conn.execute('''
+                SELECT tag, count FROM distribution_counts WHERE event_tag = ?
+            ''', (event_tag,)).fetchall())
+            row = conn.execute('''
+                SELECT total FROM distribution_totals WHERE event_tag = ?
+            ''', (event_tag,)).fetchone()
+            total_count = row[0] if row else 0
             
-            meaning_texts.append(meaning_text)
+            # 代表的な意味づけはリザーバー(出来事毎に固定件数)からランダムサンプリング
+            reservoir, refreshed_at = reservoir_samples(conn, event_tag)
         
-        # 代表的な意味づけをランダムサンプリング
-        import random
-        sample_size = min(3, len(meaning_texts))
-        sample_meanings = random.sample(meaning_texts, sample_size) if meaning_texts else []
+        # 古くなったリザーバーは最近のデータから引き直す(このリクエストは今のリザーバーで返す)
+        if needs_refresh(refreshed_at):
+            self.schedule_reservoir_refresh(event_tag)
         
         return {
             'distribution': distribution,
-            'samples': sample_meanings,
-            'total_count': len(filtered_rows)
+            'total_count': total_count,
+            'reservoir': tuple(reservoir)
         }
     
+    @staticmethod
+    def distribution_response(snapshot):
+        """スナップショットから代表的な意味づけをランダムに選んでレスポンスにする"""
+        reservoir = snapshot['reservoir']
+        return {
+            'distribution': snapshot['distribution'],
+            'samples': random.sample(reservoir, min(3, len(reservoir))),
+            'total_count': snapshot['total_count']
+        }
+    
+    def load_dedup_window(self):
+        """直近の content_hash をDBから重複判定ウィンドウに読み込む"""
+        now = time.time()
+        since = now - self.dedup.window
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT content_hash, received_at FROM records
+                WHERE received_at > ? AND content_hash IS NOT NULL
+                ORDER BY received_at DESC LIMIT ?
+            ''', (since, self.dedup.max_entries)).fetchall()
+        
+        # 上限で切った場合は読み込めた最古の時刻以降だけが揃っている
+        complete_since = rows[-1][1] if len(rows) >= self.dedup.max_entries else since
+        self.dedup.load(reversed(rows), complete_since)
+    
     def check_duplicate(self, user_id_hash, event_tag, meaning_text):
-        """重複チェック"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """重複チェック(24時間以内に同じユーザーが同じ出来事で同じ意味づけを送ったか)"""
+        record_hash = content_hash(user_id_hash, event_tag, meaning_text)
+        now = time.time()
         
-        # 同じユーザーが同じ出来事カテゴリで似た意味づけをしているかチェック
-        cursor.execute('''
-            SELECT COUNT(*) FROM records 
-            WHERE user_id_hash = ? AND event_tag = ? 
-            AND meaning_text = ?
-            AND timestamp > datetime('now', '-1 day')
-        ''', (user_id_hash, event_tag, meaning_text))
+        # ほとんどはメモリ上のウィンドウだけで判定できる
+        found = self.dedup.lookup(record_hash, now)
+        if found is not None:
+            return found
         
-        count = cursor.fetchone()[0]
-        conn.close()
+        with self.pool.connection() as conn:
+            received_at = conn.execute('''
+                SELECT MAX(received_at) FROM records
+                WHERE content_hash = ? AND received_at > ?
+            ''', (record_hash, now - self.dedup.window)).fetchone()[0]
         
-        return count > 0
+        if received_at is None:
+            return False
+        # 他のプロセスが書き込んだ記録もウィンドウに入れておく
+        self.dedup.add(record_hash, received_at)
+        return True
     
     def generate_record_id(self):
         """レコードIDの生成"""
@@ -677,25 +1053,95 @@ class DatabaseManager:
     
     def update_saw_alt_meanings(self, record_id, saw_alt_meanings):
         """saw_alt_meaningsフラグの更新"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE records 
-            SET saw_alt_meanings = ?
-            WHERE id = ?
-        ''', (saw_alt_meanings, record_id))
-        
-        rows_affected = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE records 
+                SET saw_alt_meanings = ?
+                WHERE id = ?
+            ''', (saw_alt_meanings, record_id))
+            
+            rows_affected = cursor.rowcount
+            conn.commit()
         
         return rows_affected > 0
 
-def run_server(port=8000, host='0.0.0.0'):
+class SingleConnectionServer(MeaningDiversityServer):
+    """逐次処理・ワーカープールモード用ハンドラー
+    
+    どちらも処理できる接続数が固定なので、keep-alive でアイドルの接続が
+    処理枠を占有して他のクライアントを待たせないよう、HTTP/1.0 として
+    1接続1リクエストで閉じる。
+    """
+    protocol_version = 'HTTP/1.0'
+
+
+class WorkerPoolHTTPServer(HTTPServer):
+    """固定サイズのワーカープールでリクエストを処理するHTTPサーバー"""
+    
+    def __init__(self, server_address, RequestHandlerClass, pool_size=8, bind_and_activate=True):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.pool_size = pool_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix='kotoimi-worker'
+        )
+    
+    def process_request(self, request, client_address):
+        """受け付けた接続をワーカープールに渡す"""
+        self._executor.submit(self._process_request_worker, request, client_address)
+    
+    def _process_request_worker(self, request, client_address):
+        """ワーカースレッド内でリクエストを処理(ThreadingMixInと同じ手順)"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+# 並行処理モード: single=逐次処理(HTTP/1.0), thread=接続毎にスレッド, pool=固定ワーカープール(HTTP/1.0)
+CONCURRENCY_MODES = ('single', 'thread', 'pool')
+DEFAULT_POOL_SIZE = 8
+
+
+def create_http_server(server_address, concurrency='thread', pool_size=DEFAULT_POOL_SIZE,
+                       reuse_port=False):
+    """並行処理モードに応じたHTTPサーバーを生成"""
+    if concurrency == 'thread':
+        httpd = ThreadingHTTPServer(server_address, MeaningDiversityServer, bind_and_activate=False)
+        httpd.daemon_threads = True
+    elif concurrency == 'pool':
+        if pool_size < 1:
+            raise ValueError('pool_size must be >= 1')
+        httpd = WorkerPoolHTTPServer(server_address, SingleConnectionServer,
+                                     pool_size=pool_size, bind_and_activate=False)
+    elif concurrency == 'single':
+        httpd = HTTPServer(server_address, SingleConnectionServer, bind_and_activate=False)
+    else:
+        raise ValueError(f'Unknown concurrency mode: {concurrency}')
+    
+    try:
+        if reuse_port:
+            # 複数のワーカープロセスが同じポートで待ち受け、カーネルが接続を振り分ける
+            httpd.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        httpd.server_bind()
+        httpd.server_activate()
+    except Exception:
+        httpd.server_close()
+        raise
+    return httpd
+
+
+def run_server(port=8000, host='0.0.0.0', concurrency='thread', pool_size=DEFAULT_POOL_SIZE,
+               reuse_port=False):
     """サーバーの起動"""
     server_address = (host, port)
-    httpd = HTTPServer(server_address, MeaningDiversityServer)
+    httpd = create_http_server(server_address, concurrency, pool_size, reuse_port)
     
     # Railway用のキープアライブ設定
     httpd.timeout = None  # タイムアウトを無効化
@@ -703,6 +1149,10 @@ def run_server(port=8000, host='0.0.0.0'):
     print(f"ことイミ日記サーバーを起動しました")
     print(f"URL: http://{host}:{port}")
     print(f"データベース: kotoiminiki.db")
+    if concurrency == 'pool':
+        print(f"並行処理モード: {concurrency} (ワーカー数: {pool_size})")
+    else:
+        print(f"並行処理モード: {concurrency}")
     print("Ctrl+C で停止できます")
     
     try:
@@ -713,30 +1163,188 @@ def run_server(port=8000, host='0.0.0.0'):
         httpd.server_close()
         print("サーバーが停止しました")
 
-if __name__ == '__main__':
-    import sys
+
+# 起動直後に終了したワーカーを再起動するまでの待ち時間(秒)
+WORKER_RESTART_BACKOFF = 1.0
+# pre-fork の親子で停止に使うシグナル
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+def reset_process_state():
+    """プロセス内で共有しているDB接続・書き込みスレッドを破棄する
+
+    SQLite接続やスレッド・距離計算のプロセスプールはforkした子プロセスへ持ち越せないため、
+    fork前に親プロセスで呼び出す。
+    """
+    close_all_writers()
+    close_all_pools()
+    close_distance_executors()
+    DatabaseManager.reset_shared()
+    simple_server = sys.modules.get('simple_server')
+    if simple_server is not None:
+        simple_server.DatabaseManager.reset_shared()
+
+
+def run_prefork(workers, serve_worker):
+    """N個のワーカープロセスをforkし、終了したワーカーを再起動しながら監視する
     
-    # Railway環境変数の確実な取得（Railwayはデフォルトで動的ポートを割り当て）
-    port = int(os.environ.get('PORT', 8000))
-    host = '0.0.0.0'  # Railway必須設定
+    serve_worker(slot) は子プロセス内で呼ばれ、SO_REUSEPORT 付きでサーバーを起動する。
+    """
+    if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError('--workers requires os.fork and SO_REUSEPORT (Linux / macOS)')
     
-    print(f"Environment PORT: {os.environ.get('PORT', 'Not set')}")
-    print(f"Using port: {port}, host: {host}")
+    # スキーマはfork前に親で確定させ、子は接続を作り直す
+    DatabaseManager.shared()
+    reset_process_state()
     
-    if len(sys.argv) > 1:
+    children = {}
+    stopping = False
+    
+    def spawn(slot):
+        # fork から children への登録までに届いた停止シグナルは保留し、
+        # stop() が知らないワーカーや親のハンドラーのままの子が残らないようにする
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
         try:
-            port = int(sys.argv[1])
-            print(f"Port overridden by command line: {port}")
-        except ValueError:
-            print("ポート番号は数値で指定してください")
-            sys.exit(1)
+            if stopping:
+                return
+            pid = os.fork()
+            if pid == 0:
+                # 子プロセス: SIGTERM でも Ctrl+C と同じ手順で停止する
+                signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+                exit_code = 0
+                try:
+                    serve_worker(slot)
+                except KeyboardInterrupt:
+                    pass
+                except Exception as e:
+                    print(f"ワーカー {os.getpid()} エラー: {e}")
+                    exit_code = 1
+                finally:
+                    # os._exit は atexit を呼ばないので書き込みキューをここで流し切る
+                    close_all_writers()
+                    os._exit(exit_code)
+            children[pid] = (slot, time.monotonic())
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        print(f"ワーカー {slot} を起動しました (pid={pid})")
+    
+    def stop(signum=None, frame=None):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    for slot in range(workers):
+        spawn(slot)
     
-    if len(sys.argv) > 2:
-        host = sys.argv[2]
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except KeyboardInterrupt:
+            print("\nワーカーを停止しています...")
+            stop()
+            continue
+        
+        slot, started_at = children.pop(pid, (None, None))
+        if slot is None or stopping:
+            continue
+        
+        print(f"ワーカー {slot} (pid={pid}) が終了しました (status={status})、再起動します")
+        # 起動直後に落ち続けるワーカーで再起動が空回りしないよう間隔を空ける
+        if time.monotonic() - started_at < WORKER_RESTART_BACKOFF:
+            time.sleep(WORKER_RESTART_BACKOFF)
+        spawn(slot)
     
-    # データベースの初期化
-    db = DatabaseManager()
+    print("サーバーが停止しました")
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def parse_args(argv=None):
+    """コマンドライン引数の解析"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='ことイミ日記サーバー')
+    # Railway環境変数の確実な取得（Railwayはデフォルトで動的ポートを割り当て）
+    parser.add_argument('port', nargs='?', type=int, default=int(os.environ.get('PORT', 8000)),
+                        help='待ち受けポート(既定: 環境変数PORT または 8000)')
+    parser.add_argument('host', nargs='?', default='0.0.0.0',
+                        help='待ち受けホスト(Railway必須設定: 0.0.0.0)')
+    parser.add_argument('--engine', choices=('http.server', 'asyncio'),
+                        default=os.environ.get('SERVER_ENGINE', 'http.server'),
+                        help='サーバーエンジン(asyncio はアイドル接続にスレッドを使わない)')
+    parser.add_argument('--concurrency', choices=CONCURRENCY_MODES,
+                        default=os.environ.get('SERVER_CONCURRENCY', 'thread'),
+                        help='並行処理モード(既定: 環境変数SERVER_CONCURRENCY または thread)')
+    parser.add_argument('--pool-size', type=int,
+                        default=int(os.environ.get('SERVER_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                        help='poolモードのワーカースレッド数(asyncioエンジンではDB処理スレッド数)')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('SERVER_WORKERS', 1)),
+                        help='SO_REUSEPORT で同じポートを共有するワーカープロセス数(pre-fork)')
+    parser.add_argument('--rate-limit-backend', choices=tuple(RATE_LIMIT_BACKENDS),
+                        default=DEFAULT_RATE_LIMIT_BACKEND or None,
+                        help='レート制限の状態の置き場所(既定: 単一プロセスは memory、--workers 使用時は shm)')
+    parser.add_argument('--rebuild-distribution', action='store_true',
+                        help='/fetch 用の分布カウンタ・タグ索引・サンプルリザーバーを records から再計算して終了')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    print(f"Environment PORT: {os.environ.get('PORT', 'Not set')}")
+    
+    args = parse_args()
+    print(f"Using port: {args.port}, host: {args.host}")
+    
+    # データベースの初期化(スキーマのブートストラップは起動時の一度だけ)
+    # 単一プロセスなら重複判定はメモリ上のウィンドウだけで完結できる
+    DatabaseManager.dedup_authoritative = args.workers <= 1
+    db = DatabaseManager.shared()
     print("データベースを初期化しました")
     
+    if args.rebuild_distribution:
+        counted = db.rebuild_distribution()
+        print(f"分布カウンタを再計算しました(対象レコード数: {counted})")
+        tags = db.rebuild_tag_index()
+        print(f"タグ索引を再作成しました(タグ数: {tags})")
+        events = db.rebuild_sample_reservoirs()
+        print(f"サンプルリザーバーを引き直しました(出来事数: {events})")
+        sys.exit(0)
+    
+    # 静的ファイルを読み込み gzip 版を作っておく(pre-fork のワーカーにも引き継がれる)
+    get_static_cache().preload()
+    
+    # レート制限の状態はワーカー間で共有する(shm は fork 前に作って子プロセスに引き継ぐ)
+    rate_limit_backend = args.rate_limit_backend or ('shm' if args.workers > 1 else 'memory')
+    if rate_limit_backend != 'memory':
+        MeaningDiversityServer.configure_rate_limiter(rate_limit_backend)
+    print(f"レート制限バックエンド: {rate_limit_backend}")
+    
     # サーバーの起動
-    run_server(port, host)
\ No newline at end of file
+    reuse_port = args.workers > 1
+    
+    def serve_worker(slot=0):
+        if args.engine == 'asyncio':
+            from async_server import run_async_server
+            run_async_server(args.port, args.host, executor_workers=args.pool_size,
+                             reuse_port=reuse_port)
+        else:
+            run_server(args.port, args.host, args.concurrency, args.pool_size,
+                       reuse_port=reuse_port)
+    
+    if args.workers > 1:
+        if db.pool.storage_settings['journal_mode'].upper() != 'WAL':
+            print("警告: 複数プロセスでは WAL のストレージプロファイル(durable / throughput)を推奨します")
+        print(f"pre-fork モード: ワーカープロセス数 {args.workers}")
+        run_prefork(args.workers, serve_worker)
+    else:
+        serve_worker()
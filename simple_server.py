@@ -3,53 +3,157 @@
 
 import os
 import json
-import sqlite3
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import datetime
 import hashlib
+import threading
+
+from db_pool import get_pool, storage_diagnostics
+from schema import bootstrap_schema
+from write_queue import get_writer, writer_stats
+from response_encoding import encode_json_response, response_stats
+from tag_index import create_meaning_tag_index, index_meaning_tags, meaning_tag_counts
+from response_cache import get_response_cache, response_cache_stats
+from submission_schema import MEANING_SCHEMA
+
+# meanings スキーマのマイグレーション(i番目がバージョン i+1)
+MEANINGS_MIGRATIONS = [
+    # v1: meanings / research_logs テーブル
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS meanings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_description TEXT NOT NULL,
+            personal_meaning TEXT NOT NULL,
+            context_situation TEXT,
+            emotional_response TEXT,
+            event_category TEXT,
+            meaning_tags TEXT,
+            mode TEXT DEFAULT 'solo',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS research_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            analysis_type TEXT NOT NULL,
+            parameters TEXT,
+            result_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # v2: meaning_tags を1タグ1行に正規化した索引(既存エントリから作成)
+    create_meaning_tag_index,
+]
 
 class DatabaseManager:
     """データベース管理クラス"""
     
+    _shared_instances = {}
+    _shared_lock = threading.Lock()
+    
     def __init__(self, db_path="kotoiminiki.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.writer = get_writer(db_path)
         self.init_database()
     
+    @classmethod
+    def shared(cls, db_path="kotoiminiki.db"):
+        """プロセス内で共有するインスタンスを取得"""
+        with cls._shared_lock:
+            instance = cls._shared_instances.get(db_path)
+            if instance is None:
+                instance = cls(db_path)
+                cls._shared_instances[db_path] = instance
+            return instance
+    
+    @classmethod
+    def reset_shared(cls):
+        """共有インスタンスを破棄(接続プールを作り直すとき用)"""
+        with cls._shared_lock:
+            cls._shared_instances.clear()
+    
     def init_database(self):
-        """データベースの初期化"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # meanings テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS meanings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_description TEXT NOT NULL,
-                personal_meaning TEXT NOT NULL,
-                context_situation TEXT,
-                emotional_response TEXT,
-                event_category TEXT,
-                meaning_tags TEXT,
-                mode TEXT DEFAULT 'solo',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        """データベースの初期化(プロセス内で初回のみDDLを実行)"""
+        bootstrap_schema(self.pool, 'meanings', MEANINGS_MIGRATIONS)
+    
+    def list_entries(self, exclude_samples=False):
+        """エントリ一覧を取得（研究用フィルタ対応）"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            # 研究用フィルタリング：サンプルデータ除外
+            if exclude_samples:
+                # 実際のユーザーデータのみ（ASCII範囲外の文字を含む意味のあるデータ）
+                cursor.execute("""
+                    SELECT * FROM meanings 
+                    WHERE (personal_meaning NOT LIKE '%?%' OR personal_meaning LIKE '%予稿%' OR personal_meaning LIKE '%15分%')
+                    ORDER BY created_at DESC LIMIT 100
+                """)
+            else:
+                cursor.execute("SELECT * FROM meanings ORDER BY created_at DESC LIMIT 100")
+            
+            rows = cursor.fetchall()
         
-        # research_logs テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS research_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                analysis_type TEXT NOT NULL,
-                parameters TEXT,
-                result_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        entries = []
+        for row in rows:
+            entries.append({
+                "id": row[0],
+                "event_description": row[1],
+                "personal_meaning": row[2],
+                "context_situation": row[3],
+                "emotional_response": row[4],
+                "event_category": row[5],
+                "meaning_tags": row[6],
+                "mode": row[7],
+                "created_at": row[8]
+            })
         
-        conn.commit()
-        conn.close()
+        return {
+            "status": "success", 
+            "entries": entries,
+            "data_type": "research_only" if exclude_samples else "all_data",
+            "total_entries": len(entries)
+        }
+    
+    def insert_entry(self, data):
+        """新しいエントリを保存してIDを返す(グループコミット)"""
+        entry_id = self.writer.execute(lambda conn: self._insert_entry(conn, data))
+        get_response_cache().invalidate('analysis')
+        return entry_id
+    
+    def _insert_entry(self, conn, data):
+        """トランザクション内でエントリを挿入(コミットは呼び出し側)"""
+        cursor = conn.execute('''
+            INSERT INTO meanings (
+                event_description, personal_meaning, context_situation,
+                emotional_response, event_category, meaning_tags, mode
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            data.get('event_description', ''),
+            data.get('personal_meaning', ''),
+            data.get('context_situation', ''),
+            data.get('emotional_response', ''),
+            data.get('event_category', ''),
+            data.get('meaning_tags', ''),
+            data.get('mode', 'solo')
+        ))
+        # タグ索引も同じトランザクションで更新
+        index_meaning_tags(conn, cursor.lastrowid, data.get('meaning_tags', ''))
+        return cursor.lastrowid
+    
+    def clear_all(self):
+        """全データを削除(管理者用)"""
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM meanings")
+            conn.execute("DELETE FROM meaning_tag_index")
+            conn.execute("DELETE FROM research_logs")
+            conn.commit()
+        get_response_cache().invalidate('analysis')
 
 class MeaningDiversityAnalyzer:
     """意味づけデータの分析クラス"""
@@ -58,15 +162,21 @@ class MeaningDiversityAnalyzer:
         self.db_path = db_path
     
     def get_connection(self):
-        """データベース接続を取得"""
-        return sqlite3.connect(self.db_path)
+        """データベース接続を取得(接続プールから借りる)"""
+        return get_pool(self.db_path).connection()
+    
+    def cached_event_diversity(self, exclude_samples=False):
+        """analyze_event_diversity の結果を書き込みがあるまでキャッシュから返す"""
+        return get_response_cache().get_or_compute(
+            ('/api/analysis', self.db_path, exclude_samples), 'analysis',
+            lambda: self.analyze_event_diversity(exclude_samples=exclude_samples)
+        )
     
     def analyze_event_diversity(self, exclude_samples=False):
         """イベントの意味づけ多様性を分析"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
             # サンプルデータ除外オプション
             if exclude_samples:
                 # 今日以降のデータのみ（実ユーザーデータ）
@@ -87,18 +197,8 @@ class MeaningDiversityAnalyzer:
                 cursor.execute("SELECT event_category, COUNT(*) FROM meanings GROUP BY event_category")
             categories = dict(cursor.fetchall())
             
-            # 意味づけタグ分布
-            if exclude_samples:
-                cursor.execute("SELECT meaning_tags FROM meanings WHERE meaning_tags IS NOT NULL AND DATE(created_at) >= DATE('now')")
-            else:
-                cursor.execute("SELECT meaning_tags FROM meanings WHERE meaning_tags IS NOT NULL")
-            tag_counts = {}
-            for row in cursor.fetchall():
-                tags = row[0].split(',') if row[0] else []
-                for tag in tags:
-                    tag = tag.strip()
-                    if tag:
-                        tag_counts[tag] = tag_counts.get(tag, 0) + 1
+            # 意味づけタグ分布(タグ索引を GROUP BY で集計)
+            tag_counts = meaning_tag_counts(conn, today_only=exclude_samples)
             
             return {
                 "status": "success",
@@ -107,12 +207,11 @@ class MeaningDiversityAnalyzer:
                 "tag_distribution": tag_counts,
                 "data_type": "research_only" if exclude_samples else "all_data"
             }
-        finally:
-            conn.close()
 
 class APIHandler(BaseHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
-        self.db_manager = DatabaseManager()
+        # リクエスト毎にスキーマ初期化しないよう共有インスタンスを使う
+        self.db_manager = DatabaseManager.shared()
         self.analyzer = MeaningDiversityAnalyzer()
         super().__init__(*args, **kwargs)
     
@@ -128,107 +227,68 @@ class APIHandler(BaseHTTPRequestHandler):
         self.send_cors_headers()
         self.end_headers()
 
+    def send_json(self, data, status=200):
+        """JSON レスポンスを送信(コンパクト表記、?pretty=1 で整形、大きければ gzip)"""
+        parsed_url = urlparse(self.path)
+        body, headers = encode_json_response(
+            data,
+            route=parsed_url.path if status < 400 else None,
+            query_string=parsed_url.query,
+            accept_encoding=self.headers.get('Accept-Encoding')
+        )
+        self.send_response(status)
+        self.send_cors_headers()
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET(self):
         """GET リクエストの処理"""
         parsed_url = urlparse(self.path)
         path = parsed_url.path
         
-        # CORS ヘッダーを設定
-        self.send_response(200)
-        self.send_cors_headers()
+        # クエリパラメータ解析（研究用フィルタ）
+        query_params = parse_qs(parsed_url.query)
+        exclude_samples = query_params.get('exclude_samples', ['false'])[0].lower() == 'true'
         
         if path == '/':
             # ヘルスチェック
+            body = b'Railway Server Running - OK'
+            self.send_response(200)
+            self.send_cors_headers()
             self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(b'Railway Server Running - OK')
+            self.wfile.write(body)
             
         elif path == '/api/entries':
             # エントリ一覧取得（研究用フィルタ対応）
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            # クエリパラメータ解析
-            parsed_url = urlparse(self.path)
-            query_params = parse_qs(parsed_url.query)
-            exclude_samples = query_params.get('exclude_samples', ['false'])[0].lower() == 'true'
-            
-            conn = sqlite3.connect(self.db_manager.db_path)
-            cursor = conn.cursor()
-            
-            # 研究用フィルタリング：サンプルデータ除外
-            if exclude_samples:
-                # 実際のユーザーデータのみ（ASCII範囲外の文字を含む意味のあるデータ）
-                cursor.execute("""
-                    SELECT * FROM meanings 
-                    WHERE (personal_meaning NOT LIKE '%?%' OR personal_meaning LIKE '%予稿%' OR personal_meaning LIKE '%15分%')
-                    ORDER BY created_at DESC LIMIT 100
-                """)
-            else:
-                cursor.execute("SELECT * FROM meanings ORDER BY created_at DESC LIMIT 100")
-            
-            rows = cursor.fetchall()
-            
-            entries = []
-            for row in rows:
-                entries.append({
-                    "id": row[0],
-                    "event_description": row[1],
-                    "personal_meaning": row[2],
-                    "context_situation": row[3],
-                    "emotional_response": row[4],
-                    "event_category": row[5],
-                    "meaning_tags": row[6],
-                    "mode": row[7],
-                    "created_at": row[8]
-                })
-            
-            conn.close()
-            
-            response = {
-                "status": "success", 
-                "entries": entries,
-                "data_type": "research_only" if exclude_samples else "all_data",
-                "total_entries": len(entries)
-            }
-            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            self.send_json(self.db_manager.list_entries(exclude_samples=exclude_samples))
             
         elif path == '/api/clear':
             # 管理者用：テストデータクリアエンドポイント
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            conn = sqlite3.connect(self.db_manager.db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM meanings")
-            cursor.execute("DELETE FROM research_logs")
-            conn.commit()
-            conn.close()
-            
-            response = {"status": "success", "message": "全データをクリアしました"}
-            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            self.db_manager.clear_all()
+            self.send_json({"status": "success", "message": "全データをクリアしました"})
             
         elif path == '/api/analysis':
             # 分析データ取得（研究用フィルタ対応）
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            # クエリパラメータ解析
-            parsed_url = urlparse(self.path)
-            query_params = parse_qs(parsed_url.query)
-            exclude_samples = query_params.get('exclude_samples', ['false'])[0].lower() == 'true'
+            self.send_json(self.analyzer.cached_event_diversity(exclude_samples=exclude_samples))
             
-            analysis = self.analyzer.analyze_event_diversity(exclude_samples=exclude_samples)
-            self.wfile.write(json.dumps(analysis, ensure_ascii=False).encode('utf-8'))
+        elif path == '/api/diagnostics':
+            # 運用診断（ストレージ設定・接続プール統計・レスポンスサイズ）
+            self.send_json({
+                "status": "success",
+                "storage": storage_diagnostics(),
+                "write_queue": writer_stats(),
+                "responses": response_stats(),
+                "response_cache": response_cache_stats()
+            })
             
         else:
             # 404 エラー
-            self.send_response(404)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            error = {"status": "error", "message": "Not Found"}
-            self.wfile.write(json.dumps(error, ensure_ascii=False).encode('utf-8'))
+            self.send_json({"status": "error", "message": "Not Found"}, status=404)
 
     def do_POST(self):
         """POST リクエストの処理"""
@@ -242,56 +302,21 @@ class APIHandler(BaseHTTPRequestHandler):
         try:
             data = json.loads(post_data.decode('utf-8'))
         except json.JSONDecodeError:
-            self.send_response(400)
-            self.send_cors_headers()
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            error = {"status": "error", "message": "Invalid JSON"}
-            self.wfile.write(json.dumps(error, ensure_ascii=False).encode('utf-8'))
+            self.send_json({"status": "error", "message": "Invalid JSON"}, status=400)
             return
         
         if path == '/api/entries':
-            # 新しいエントリを保存
-            self.send_response(200)
-            self.send_cors_headers()
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            conn = sqlite3.connect(self.db_manager.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO meanings (
-                    event_description, personal_meaning, context_situation,
-                    emotional_response, event_category, meaning_tags, mode
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                data.get('event_description', ''),
-                data.get('personal_meaning', ''),
-                data.get('context_situation', ''),
-                data.get('emotional_response', ''),
-                data.get('event_category', ''),
-                data.get('meaning_tags', ''),
-                data.get('mode', 'solo')
-            ))
-            
-            conn.commit()
-            entry_id = cursor.lastrowid
-            conn.close()
-            
-            response = {"status": "success", "id": entry_id, "message": "エントリが保存されました"}
-            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            # 新しいエントリを検証して保存
+            errors = MEANING_SCHEMA.validate(data)
+            if errors:
+                self.send_json({"status": "error", "message": "Invalid data", "errors": errors}, status=400)
+                return
+            entry_id = self.db_manager.insert_entry(data)
+            self.send_json({"status": "success", "id": entry_id, "message": "エントリが保存されました"})
             
         else:
             # 404 エラー
-            self.send_response(404)
-            self.send_cors_headers()
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.end_headers()
-            
-            error = {"status": "error", "message": "Not Found"}
-            self.wfile.write(json.dumps(error, ensure_ascii=False).encode('utf-8'))
+            self.send_json({"status": "error", "message": "Not Found"}, status=404)
 
 if __name__ == '__main__':
     # Railway環境変数取得
@@ -299,6 +324,7 @@ if __name__ == '__main__':
     host = '0.0.0.0'
     
     print(f"Starting server on {host}:{port}")
+    DatabaseManager.shared()
     print("Database initialized...")
     
     # サーバー起動
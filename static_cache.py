@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 静的ファイルのメモリキャッシュ
+HTMLを起動時に一度だけ読み込み、ETag / 304 と gzip 済みの変種をメモリから返す
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+
+# 起動時に読み込む静的ファイルと Content-Type
+STATIC_ASSETS = {
+    'index.html': 'text/html; charset=utf-8',
+    'research_dashboard.html': 'text/html; charset=utf-8',
+}
+
+# これより小さいファイルは圧縮しない(ヘッダー分で得にならない)
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 9
+
+# ブラウザに毎回 If-None-Match で再検証させる(デプロイ直後に古いHTMLを使わせない)
+CACHE_CONTROL = 'no-cache'
+
+
+def accepts_gzip(accept_encoding):
+    """Accept-Encoding で gzip が受け入れられるか(q=0 は拒否、gzip の指定は * より優先)"""
+    if not accept_encoding:
+        return False
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if coding not in ('gzip', '*'):
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        qualities.setdefault(coding, quality)
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def etag_matches(if_none_match, etags):
+    """If-None-Match のいずれかが ETag と一致するか(弱い比較)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return True
+    return False
+
+
+class StaticAsset:
+    """読み込み済みの静的ファイル(無圧縮と gzip の2つの表現を持つ)"""
+
+    def __init__(self, path, content_type, body, mtime_ns, size):
+        self.path = path
+        self.content_type = content_type
+        self.body = body
+        self.mtime_ns = mtime_ns
+        self.size = size
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_body = None
+        self.gzip_etag = None
+        if len(body) >= GZIP_MIN_SIZE:
+            # mtime=0 で出力を固定し、同じ内容なら同じバイト列・ETagになるようにする
+            compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+                self.gzip_etag = f'"{digest}-gz"'
+
+    def is_stale(self, stat):
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+
+class StaticFileCache:
+    """静的ファイルキャッシュ
+
+    リクエスト毎には stat だけを行い、mtime・サイズが変わったファイルのみ読み直す。
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self._assets = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'loads': 0,
+            'not_modified': 0,
+            'gzip_responses': 0,
+            'bytes_sent': 0,
+            'bytes_saved': 0,
+        }
+
+    def _resolve(self, filename):
+        return os.path.join(self.root, filename) if self.root else filename
+
+    def _load(self, path, content_type):
+        """ファイルを読み込んでキャッシュに登録(見つからなければNone)"""
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        asset = StaticAsset(path, content_type, body, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            self._assets[path] = asset
+            self._stats['loads'] += 1
+        return asset
+
+    def get(self, filename, content_type):
+        """最新の StaticAsset を返す(ファイルが無ければNone)"""
+        path = self._resolve(filename)
+        asset = self._assets.get(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if asset is not None:
+                with self._lock:
+                    self._assets.pop(path, None)
+            return None
+        if asset is None or asset.is_stale(stat) or asset.content_type != content_type:
+            return self._load(path, content_type)
+        with self._lock:
+            self._stats['hits'] += 1
+        return asset
+
+    def preload(self, assets=None):
+        """起動時に静的ファイルを読み込み gzip 版を作っておく"""
+        for filename, content_type in (assets or STATIC_ASSETS).items():
+            self.get(filename, content_type)
+
+    def respond(self, filename, content_type, if_none_match=None, accept_encoding=None):
+        """(ステータス, ヘッダーのリスト, ボディ) を返す(ファイルが無ければNone)"""
+        asset = self.get(filename, content_type)
+        if asset is None:
+            return None
+
+        use_gzip = asset.gzip_body is not None and accepts_gzip(accept_encoding)
+        etag = asset.gzip_etag if use_gzip else asset.etag
+        headers = [
+            ('ETag', etag),
+            ('Cache-Control', CACHE_CONTROL),
+            ('Vary', 'Accept-Encoding'),
+        ]
+
+        body = asset.gzip_body if use_gzip else asset.body
+        if etag_matches(if_none_match, (asset.etag, asset.gzip_etag)):
+            # 304 はボディを送らないが、Content-Length は 200 で送るはずだった長さにする
+            headers.append(('Content-Length', str(len(body))))
+            with self._lock:
+                self._stats['not_modified'] += 1
+                self._stats['bytes_saved'] += len(body)
+            return 304, headers, b''
+
+        headers.append(('Content-Type', asset.content_type))
+        if use_gzip:
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        with self._lock:
+            self._stats['bytes_sent'] += len(body)
+            if use_gzip:
+                self._stats['gzip_responses'] += 1
+                self._stats['bytes_saved'] += len(asset.body) - len(body)
+        return 200, headers, body
+
+    def stats(self):
+        """統計カウンタとキャッシュ中のファイル(診断用)"""
+        with self._lock:
+            stats = dict(self._stats)
+            assets = list(self._assets.values())
+        stats['assets'] = {
+            asset.path: {
+                'size': len(asset.body),
+                'gzip_size': len(asset.gzip_body) if asset.gzip_body is not None else None,
+                'etag': asset.etag,
+            }
+            for asset in assets
+        }
+        return stats
+
+
+_static_cache = StaticFileCache()
+
+
+def get_static_cache():
+    """プロセス内で共有される静的ファイルキャッシュを取得"""
+    return _static_cache
+
+
+def static_cache_stats():
+    """静的ファイルキャッシュの統計(診断用)"""
+    return _static_cache.stats()
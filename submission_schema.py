@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 送信データのスキーマ
+フィールドの宣言から検証関数を一度だけ組み立て、/submit(records)と
+/api/entries(meanings)の検証に使う
+"""
+
+import re
+
+from sanitizer import sanitize_text
+
+# 許可された出来事タグ
+ALLOWED_EVENT_TAGS = frozenset([
+    'work_late', 'work_praised', 'work_failed', 'work_success', 'work_conflict',
+    'relationship_fight', 'relationship_support', 'relationship_betrayal',
+    'relationship_love', 'relationship_breakup',
+    'health_sick', 'health_injury', 'health_recovery', 'health_tired',
+    'money_loss', 'money_gain', 'money_debt', 'money_purchase',
+    'weather_rain', 'weather_storm', 'weather_sunny', 'weather_cold',
+    'accident_minor', 'accident_loss', 'accident_broken', 'accident_delay',
+    'achievement_goal', 'achievement_recognition', 'achievement_skill',
+    'loss_opportunity', 'loss_mistake', 'loss_rejection',
+    'surprise_news', 'surprise_meeting', 'surprise_discovery',
+    'other',
+])
+MODES = frozenset(['solo', 'social'])
+
+_MISSING = object()
+
+ERROR_MESSAGES = {
+    'required': 'required',
+    'type': 'must be {type}',
+    'choice': 'not an allowed value',
+    'pattern': 'invalid format',
+    'min_length': 'must be at least {min_length} characters',
+    'minimum': 'must be >= {minimum}',
+}
+
+
+class Field:
+    """1フィールドの宣言
+
+    type: str / int / bool
+        str  は数値を文字列に変換する(sanitize=True なら空でない値をサニタイズ)
+        int  は変換しない(従来の /submit と同じく文字列・小数は不可、bool も不可)
+        bool は変換しない
+    default を指定したフィールドは、無い場合と null の場合に default を使う。
+    """
+
+    def __init__(self, type, required=False, default=_MISSING, choices=None, pattern=None,
+                 min_length=None, minimum=None, sanitize=False):
+        self._options = dict(required=required, default=default, choices=choices, pattern=pattern,
+                             min_length=min_length, minimum=minimum, sanitize=sanitize)
+        self.type = type
+        self.required = required
+        self.default = default
+        self.choices = frozenset(choices) if choices is not None else None
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.min_length = min_length
+        self.minimum = minimum
+        self.sanitize = sanitize
+
+    def replace(self, **changes):
+        """一部の設定を変えたコピー"""
+        return Field(self.type, **dict(self._options, **changes))
+
+    def error(self, name, code):
+        message = ERROR_MESSAGES[code].format(
+            type=self.type.__name__, min_length=self.min_length, minimum=self.minimum
+        )
+        return {'field': name, 'code': code, 'message': message}
+
+    def compile(self, name):
+        """値を検証・変換する関数 check(value) -> (value, error) を返す"""
+        coerce = _COERCIONS[self.type]
+        choices = self.choices
+        fullmatch = self.pattern.fullmatch if self.pattern is not None else None
+        min_length = self.min_length
+        minimum = self.minimum
+        sanitize = sanitize_text if self.sanitize else None
+        errors = {code: self.error(name, code) for code in ERROR_MESSAGES}
+
+        def check(value):
+            value = coerce(value)
+            if value is _MISSING:
+                return None, errors['type']
+            if sanitize is not None and value:
+                value = sanitize(value)
+            if choices is not None and value not in choices:
+                return value, errors['choice']
+            if fullmatch is not None and fullmatch(value) is None:
+                return value, errors['pattern']
+            if min_length is not None and len(value.strip()) < min_length:
+                return value, errors['min_length']
+            if minimum is not None and value < minimum:
+                return value, errors['minimum']
+            return value, None
+
+        return check
+
+
+def _coerce_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return _MISSING
+
+
+def _coerce_int(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return _MISSING
+
+
+def _coerce_bool(value):
+    return value if isinstance(value, bool) else _MISSING
+
+
+_COERCIONS = {
+    str: _coerce_str,
+    int: _coerce_int,
+    bool: _coerce_bool,
+}
+
+
+class SubmissionSchema:
+    """フィールド宣言をまとめ、検証関数に組み立てたもの"""
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self._checks = tuple(
+            (name, field.required, field.default, field.compile(name),
+             field.error(name, 'required'))
+            for name, field in self.fields.items()
+        )
+
+    def validate(self, data):
+        """data を検証し、変換後の値で上書きする(エラーのリストを返す、空なら成功)
+
+        宣言していないキーはそのまま残す。
+        """
+        if not isinstance(data, dict):
+            return [{'field': None, 'code': 'type', 'message': 'must be an object'}]
+        errors = []
+        for name, required, default, check, required_error in self._checks:
+            value = data.get(name)
+            if value is None:
+                if default is not _MISSING:
+                    data[name] = default
+                elif required:
+                    errors.append(required_error)
+                continue
+            value, error = check(value)
+            if error is not None:
+                errors.append(error)
+            else:
+                data[name] = value
+        return errors
+
+    def is_valid(self, data):
+        return not self.validate(data)
+
+    def without_sanitize(self):
+        """サニタイズしないスキーマ(サニタイズ済みで保存されたデータの再投入用)"""
+        return SubmissionSchema({
+            name: field.replace(sanitize=False) for name, field in self.fields.items()
+        })
+
+
+# /submit(records テーブル)
+RECORD_SCHEMA = SubmissionSchema({
+    'user_id_hash': Field(str, required=True, sanitize=True, pattern=r'anon_[a-z0-9_]+'),
+    'timestamp': Field(str, required=True),
+    'consent': Field(bool, required=True),
+    'mode': Field(str, required=True, choices=MODES),
+    'event_tag': Field(str, required=True, sanitize=True, choices=ALLOWED_EVENT_TAGS),
+    'meaning_text': Field(str, required=True, sanitize=True, min_length=5),
+    'rt_ms': Field(int, required=True, minimum=0),
+    'event_text': Field(str, sanitize=True),
+    'meaning_tag': Field(str, sanitize=True),
+})
+
+# /api/entries(meanings テーブル、simple_server.py)
+#   未指定・null の項目は従来どおり空文字で保存する
+MEANING_SCHEMA = SubmissionSchema({
+    'event_description': Field(str, default=''),
+    'personal_meaning': Field(str, default=''),
+    'context_situation': Field(str, default=''),
+    'emotional_response': Field(str, default=''),
+    'event_category': Field(str, default=''),
+    'meaning_tags': Field(str, default=''),
+    'mode': Field(str, default='solo', choices=MODES),
+})
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 意味づけタグの索引テーブル
+カンマ区切りの meaning_tag を1タグ1行に正規化し、タグ集計を GROUP BY で行う
+"""
+
+from quality_flags import is_high_quality
+
+# records.meaning_tag の索引
+#   consent / high_quality は records からの複製で、集計時に records を引かずに済ませる
+#   (high_quality は品質フラグの更新時に合わせて書き換える)
+RECORD_TAGS_DDL = [
+    '''
+    CREATE TABLE IF NOT EXISTS record_tags (
+        record_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        event_tag TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        consent INTEGER NOT NULL,
+        high_quality INTEGER NOT NULL,
+        PRIMARY KEY (record_id, position)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_record_tags_event_tag ON record_tags(event_tag, tag)',
+    'CREATE INDEX IF NOT EXISTS idx_record_tags_tag ON record_tags(tag)',
+    # 研究用の集計(品質の良いデータのみ)はこちらのインデックスだけで完結する
+    '''
+    CREATE INDEX IF NOT EXISTS idx_record_tags_high_quality
+    ON record_tags(event_tag, mode, tag) WHERE high_quality = 1
+    ''',
+]
+
+# meanings.meaning_tags(simple_server.py)の索引
+MEANING_TAG_INDEX_DDL = [
+    '''
+    CREATE TABLE IF NOT EXISTS meaning_tag_index (
+        meaning_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        tag TEXT NOT NULL,
+        created_at TIMESTAMP,
+        PRIMARY KEY (meaning_id, position)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_meaning_tag_index_tag ON meaning_tag_index(tag)',
+]
+
+
+def parse_meaning_tags(meaning_tag):
+    """カンマ区切りのタグを前後の空白を除いたリストにする(空のタグは除く)"""
+    if not meaning_tag:
+        return []
+    return [tag.strip() for tag in meaning_tag.split(',') if tag.strip()]
+
+
+# --- records ---
+
+def index_record_tags(conn, record_id, event_tag, mode, meaning_tag, consent, high_quality):
+    """1レコード分のタグを索引に追加(トランザクションは呼び出し側)"""
+    conn.executemany('''
+        INSERT INTO record_tags (record_id, position, event_tag, mode, tag, consent, high_quality)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (record_id, position, event_tag, mode, tag, 1 if consent == 1 else 0, 1 if high_quality else 0)
+        for position, tag in enumerate(parse_meaning_tags(meaning_tag))
+    ])
+
+
+def set_record_tags_quality(conn, record_id, high_quality):
+    """品質フラグの変更を索引に反映"""
+    conn.execute(
+        'UPDATE record_tags SET high_quality = ? WHERE record_id = ?',
+        (1 if high_quality else 0, record_id)
+    )
+
+
+def rebuild_record_tags(conn):
+    """records から索引を作り直し、索引に入れたタグ数を返す(トランザクションは呼び出し側)"""
+    conn.execute('DELETE FROM record_tags')
+    rows = conn.execute('''
+        SELECT id, event_tag, mode, meaning_tag, consent, quality_flags FROM records
+    ''').fetchall()
+    for record_id, event_tag, mode, meaning_tag, consent, quality_flags in rows:
+        index_record_tags(conn, record_id, event_tag, mode, meaning_tag, consent,
+                          is_high_quality(consent, quality_flags))
+    return conn.execute('SELECT COUNT(*) FROM record_tags').fetchone()[0]
+
+
+def create_record_tags(conn):
+    """record_tags の作成と既存レコードの索引付け(マイグレーション用)"""
+    for statement in RECORD_TAGS_DDL:
+        conn.execute(statement)
+    rebuild_record_tags(conn)
+
+
+def record_tag_counts(conn, event_tag=None, mode=None):
+    """品質の良い同意済みデータのタグ出現回数 {tag: count}"""
+    conditions = ['high_quality = 1']
+    params = []
+    if event_tag:
+        conditions.append('event_tag = ?')
+        params.append(event_tag)
+    if mode:
+        conditions.append('mode = ?')
+        params.append(mode)
+    return dict(conn.execute(f'''
+        SELECT tag, COUNT(*) FROM record_tags
+        WHERE {" AND ".join(conditions)}
+        GROUP BY tag
+    ''', params).fetchall())
+
+
+# --- meanings ---
+
+def index_meaning_tags(conn, meaning_id, meaning_tags):
+    """1エントリ分のタグを索引に追加(created_at は meanings の値を写す)"""
+    conn.executemany('''
+        INSERT INTO meaning_tag_index (meaning_id, position, tag, created_at)
+        SELECT id, ?, ?, created_at FROM meanings WHERE id = ?
+    ''', [
+        (position, tag, meaning_id)
+        for position, tag in enumerate(parse_meaning_tags(meaning_tags))
+    ])
+
+
+def create_meaning_tag_index(conn):
+    """meaning_tag_index の作成と既存エントリの索引付け(マイグレーション用)"""
+    for statement in MEANING_TAG_INDEX_DDL:
+        conn.execute(statement)
+    conn.execute('DELETE FROM meaning_tag_index')
+    rows = conn.execute(
+        'SELECT id, meaning_tags FROM meanings WHERE meaning_tags IS NOT NULL'
+    ).fetchall()
+    for meaning_id, meaning_tags in rows:
+        index_meaning_tags(conn, meaning_id, meaning_tags)
+
+
+def meaning_tag_counts(conn, today_only=False):
+    """meanings のタグ出現回数 {tag: count}(today_only で今日以降の登録のみ)"""
+    where = "WHERE DATE(created_at) >= DATE('now')" if today_only else ''
+    return dict(conn.execute(f'''
+        SELECT tag, COUNT(*) FROM meaning_tag_index {where} GROUP BY tag
+    ''').fetchall())
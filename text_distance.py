@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - 意味づけテキストの編集距離
+Myers / Hyyrö のビット並列アルゴリズムでレーベンシュタイン距離を求める
+
+パターン(片方の文字列)の各文字の出現位置をビットマスクにしておき、もう片方の
+文字列を1文字進める毎に DP 表の1列分をビット演算でまとめて更新する。Python の
+int は任意長なので、機械語1語に収まらない長い文字列も複数語のビット列として
+同じ式でそのまま扱える(ブロック分割や帯状DPへの切り替えは要らない)。
+"""
+
+import atexit
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import statistics
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fractions import Fraction
+
+# 推定モードで使う組数の上限(全組数がこれ以下なら全組を計算する)
+DEFAULT_SAMPLE_PAIRS = int(os.environ.get('SEMANTIC_DISTANCE_SAMPLE_PAIRS', 10000))
+DEFAULT_CONFIDENCE = 0.95
+# 目標標準誤差で打ち切る前に最低限引く組数
+MIN_SAMPLE_PAIRS = 30
+# 全組計算に使うプロセス数(1 なら呼び出し元のプロセスだけで計算する)
+DEFAULT_WORKERS = int(os.environ.get('SEMANTIC_DISTANCE_WORKERS', 1))
+# これより組数が少なければプロセスを起動せずに計算する
+PARALLEL_MIN_PAIRS = int(os.environ.get('SEMANTIC_DISTANCE_PARALLEL_MIN_PAIRS', 20000))
+# 1プロセスあたりのブロック数(行毎の組数の偏りをならす)
+BLOCKS_PER_WORKER = 4
+# ワーカープロセスの起動方法。スレッドやDBのロックを持つサーバープロセスを
+# そのまま fork しないよう、既定は forkserver(使えない環境では spawn)
+DEFAULT_START_METHOD = os.environ.get(
+    'SEMANTIC_DISTANCE_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+
+def pattern_masks(pattern):
+    """文字 -> パターン中の出現位置のビットマスク"""
+    masks = {}
+    bit = 1
+    for char in pattern:
+        masks[char] = masks.get(char, 0) | bit
+        bit <<= 1
+    return masks
+
+
+def bit_parallel_distance(masks, length, text):
+    """pattern_masks(pattern) と len(pattern) を使って pattern と text の編集距離を求める"""
+    if length == 0:
+        return len(text)
+    all_ones = (1 << length) - 1
+    last = 1 << (length - 1)
+    positive = all_ones  # 縦方向の差分 +1 の位置
+    negative = 0         # 縦方向の差分 -1 の位置
+    score = length
+    get = masks.get
+    for char in text:
+        eq = get(char, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        hp = negative | ~(xh | positive)
+        hn = positive & xh
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        # 1行目(空のパターン)との差分は常に +1
+        hp = (hp << 1) | 1
+        hn <<= 1
+        positive = (hn | ~(xv | hp)) & all_ones
+        negative = hp & xv
+    return score
+
+
+def levenshtein(s1, s2):
+    """レーベンシュタイン距離"""
+    if s1 == s2:
+        return 0
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    return bit_parallel_distance(pattern_masks(s2), len(s2), s1)
+
+
+def normalized_distance(text1, text2):
+    """小文字にした文字列の編集距離を元の長い方の文字数で割った値(0〜)"""
+    max_len = max(len(text1), len(text2))
+    if max_len == 0:
+        return 0
+    return levenshtein(text1.lower(), text2.lower()) / max_len
+
+
+def pairwise_distances(texts):
+    """全ての組 (i < j) の normalized_distance を i, j の順に返す
+
+    各テキストのビットマスクは一度だけ作り、後ろの全テキストとの比較に使い回す。
+    """
+    lowered = [text.lower() for text in texts]
+    lengths = [len(text) for text in texts]
+    return _row_distances(lowered, lengths, 0, len(texts))
+
+
+def _row_distances(lowered, lengths, start, stop):
+    """行 start <= i < stop の組 (i, j) (i < j) の距離"""
+    for i in range(start, stop):
+        pattern = lowered[i]
+        masks = pattern_masks(pattern)
+        pattern_length = len(pattern)
+        length_i = lengths[i]
+        for j in range(i + 1, len(lowered)):
+            max_len = max(length_i, lengths[j])
+            if max_len == 0:
+                yield 0
+                continue
+            text = lowered[j]
+            if text == pattern:
+                distance = 0
+            else:
+                distance = bit_parallel_distance(masks, pattern_length, text)
+            yield distance / max_len
+
+
+def mean_pairwise_distance(texts, workers=1):
+    """全ての組の normalized_distance の平均(2件未満は 0)
+
+    workers が2以上で組数が PARALLEL_MIN_PAIRS 以上なら複数プロセスで計算する。
+    結果は1プロセスで計算した場合と同じ値になる。
+    """
+    if len(texts) < 2:
+        return 0
+    total_pairs = len(texts) * (len(texts) - 1) // 2
+    if workers > 1 and total_pairs >= PARALLEL_MIN_PAIRS:
+        return parallel_mean_pairwise_distance(texts, workers)
+    return statistics.mean(pairwise_distances(texts))
+
+
+def row_blocks(count, blocks):
+    """行 0..count-1 を組数がほぼ等しい連続区間 (start, stop) に分ける
+
+    行 i の組数は count - 1 - i なので、前の行ほど区間を短くする。
+    """
+    total_pairs = count * (count - 1) // 2
+    bounds = []
+    start = 0
+    done = 0
+    for block in range(1, blocks + 1):
+        target = total_pairs * block // blocks
+        stop = start
+        while stop < count and done < target:
+            done += count - 1 - stop
+            stop += 1
+        if stop > start:
+            bounds.append((start, stop))
+        start = stop
+    if start < count - 1:
+        bounds.append((start, count))
+    return bounds
+
+
+def exact_sum(values):
+    """浮動小数点数の和を誤差なく求める({分母: 分子の和} と件数)
+
+    各値を整数比にして分母(2の累乗)毎に分子を足す。整数の加算なので
+    ブロック毎に求めた結果をどの順で合わせても同じ値になる。
+    """
+    partials = {}
+    count = 0
+    for value in values:
+        numerator, denominator = value.as_integer_ratio()
+        partials[denominator] = partials.get(denominator, 0) + numerator
+        count += 1
+    return partials, count
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_distance_executor(workers, start_method=DEFAULT_START_METHOD):
+    """ワーカー数毎に1つのプロセスプールを作って使い回す"""
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(start_method)
+            )
+            _executors[workers] = executor
+        return executor
+
+
+def discard_distance_executor(workers, executor):
+    """壊れたプロセスプールを使い回しの対象から外して停止する(次の取得で作り直す)"""
+    with _executors_lock:
+        if _executors.get(workers) is executor:
+            del _executors[workers]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def close_distance_executors():
+    """全てのプロセスプールを停止する(fork 前・終了時に呼ぶ)"""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+atexit.register(close_distance_executors)
+
+
+# ワーカープロセス内で最後に読み込んだテキスト (呼び出しの識別子, 小文字にしたテキスト, 文字数)
+_worker_texts = (None, None, None)
+
+
+def _load_worker_texts(path, call_id):
+    global _worker_texts
+    if _worker_texts[0] != call_id:
+        with open(path, 'rb') as f:
+            texts = pickle.load(f)
+        _worker_texts = (call_id, [text.lower() for text in texts], [len(text) for text in texts])
+    return _worker_texts[1], _worker_texts[2]
+
+
+def _block_sum(path, call_id, start, stop):
+    lowered, lengths = _load_worker_texts(path, call_id)
+    return exact_sum(_row_distances(lowered, lengths, start, stop))
+
+
+def parallel_mean_pairwise_distance(texts, workers=DEFAULT_WORKERS):
+    """mean_pairwise_distance をプロセスプールで計算する
+
+    プールは呼び出しをまたいで使い回すため、テキストは一時ファイルに1度だけ書き出し、
+    各タスクにはそのパスと行の区間だけを渡す(各ワーカーは呼び出し毎に1度だけ読む)。
+    ブロック毎の誤差のない和をブロック順に合わせ、最後に1度だけ割るので
+    statistics.mean で求めた値と一致する。ワーカーの異常終了でプールが壊れた
+    場合は作り直して1度だけやり直し、それでも壊れれば1プロセスで計算する。
+    """
+    if len(texts) < 2:
+        return 0
+    blocks = row_blocks(len(texts), workers * BLOCKS_PER_WORKER)
+    executor = get_distance_executor(workers)
+    fd, path = tempfile.mkstemp(prefix='kotoimi-distance-', suffix='.pickle')
+    # 削除した一時ファイルのパスは再利用され得るので、呼び出し毎の識別子で区別する
+    call_id = uuid.uuid4().hex
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(list(texts), f, protocol=pickle.HIGHEST_PROTOCOL)
+        for retry in (True, False):
+            try:
+                partials, count = _parallel_block_sums(executor, path, call_id, blocks)
+                break
+            except BrokenProcessPool:
+                # ワーカーが異常終了したプールは以後使えないので、作り直して1度だけやり直す
+                discard_distance_executor(workers, executor)
+                if retry:
+                    executor = get_distance_executor(workers)
+        else:
+            # 作り直したプールも壊れた場合は呼び出し元のプロセスで計算する
+            return statistics.mean(pairwise_distances(texts))
+    finally:
+        os.remove(path)
+    total = sum(Fraction(numerator, denominator) for denominator, numerator in partials.items())
+    return float(total / count)
+
+
+def _parallel_block_sums(executor, path, call_id, blocks):
+    """各ブロックの誤差のない和をブロック順に合わせる({分母: 分子の和} と件数)"""
+    futures = [executor.submit(_block_sum, path, call_id, start, stop) for start, stop in blocks]
+    partials = {}
+    count = 0
+    for future in futures:
+        block_partials, block_count = future.result()
+        for denominator, numerator in block_partials.items():
+            partials[denominator] = partials.get(denominator, 0) + numerator
+        count += block_count
+    return partials, count
+
+
+def _distance_summary(estimate, standard_error, pairs_used, total_pairs, exact, confidence):
+    margin = statistics.NormalDist().inv_cdf(0.5 + confidence / 2) * standard_error
+    return {
+        'estimate': estimate,
+        'ci_low': max(estimate - margin, 0.0),
+        'ci_high': estimate + margin,
+        'standard_error': standard_error,
+        'confidence': confidence,
+        'pairs_used': pairs_used,
+        'total_pairs': total_pairs,
+        'exact': exact,
+    }
+
+
+def exact_distance_summary(texts, confidence=DEFAULT_CONFIDENCE, workers=1):
+    """全ての組から求めた平均距離(区間の幅は0)"""
+    total_pairs = len(texts) * (len(texts) - 1) // 2
+    return _distance_summary(mean_pairwise_distance(texts, workers), 0.0, total_pairs,
+                             total_pairs, True, confidence)
+
+
+def estimate_mean_pairwise_distance(texts, max_pairs=DEFAULT_SAMPLE_PAIRS, target_se=None,
+                                    confidence=DEFAULT_CONFIDENCE, rng=None, workers=1):
+    """ランダムに選んだ組の距離から平均距離を推定する
+
+    組は (i, j) を一様に復元抽出し、max_pairs 組を引くか、target_se を指定した
+    場合は標準誤差がそれ以下になった時点で打ち切る。全組数が max_pairs 以下なら
+    全組を計算する(exact=True、workers はこの場合に使う)。推定値・信頼区間・
+    使った組数を辞書で返す。
+    """
+    count = len(texts)
+    total_pairs = count * (count - 1) // 2
+    if total_pairs <= max_pairs:
+        return exact_distance_summary(texts, confidence, workers)
+    if max_pairs < 2:
+        raise ValueError('max_pairs must be >= 2 to estimate a standard error')
+
+    rng = rng or random.Random()
+    lowered = [text.lower() for text in texts]
+    lengths = [len(text) for text in texts]
+    masks = {}
+
+    mean = 0.0
+    squares = 0.0  # 偏差平方和(Welford)
+    pairs_used = 0
+    standard_error = math.inf
+    while pairs_used < max_pairs:
+        i = rng.randrange(count)
+        j = rng.randrange(count - 1)
+        if j >= i:
+            j += 1
+        max_len = max(lengths[i], lengths[j])
+        if max_len == 0 or lowered[i] == lowered[j]:
+            distance = 0.0
+        else:
+            if i not in masks:
+                masks[i] = pattern_masks(lowered[i])
+            distance = bit_parallel_distance(masks[i], len(lowered[i]), lowered[j]) / max_len
+
+        pairs_used += 1
+        delta = distance - mean
+        mean += delta / pairs_used
+        squares += delta * (distance - mean)
+        if pairs_used > 1:
+            standard_error = math.sqrt(squares / (pairs_used - 1) / pairs_used)
+        if target_se is not None and pairs_used >= MIN_SAMPLE_PAIRS and standard_error <= target_se:
+            break
+
+    return _distance_summary(mean, standard_error, pairs_used, total_pairs, False, confidence)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+ことイミ日記 - グループコミット書き込みキュー
+同時に届いた複数の書き込みを1トランザクション(1回のfsync)にまとめてコミットする
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db_pool import get_pool
+
+# 1トランザクションにまとめる最大件数と、後続の書き込みを待つ最大時間(環境変数で上書き可能)
+DEFAULT_MAX_BATCH = int(os.environ.get('WRITE_BATCH_SIZE', 64))
+DEFAULT_MAX_WAIT_MS = float(os.environ.get('WRITE_MAX_WAIT_MS', 5))
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """バックグラウンドスレッドで書き込みをまとめてコミットするライター
+
+    submit() に渡す操作は接続を受け取る関数で、戻り値(レコードIDなど)が
+    Future の結果になる。1件の失敗はセーブポイントで巻き戻し、
+    同じバッチの他の書き込みには影響させない。
+    """
+
+    def __init__(self, pool, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        if max_batch < 1:
+            raise ValueError('max_batch must be >= 1')
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._stats = {
+            'submitted': 0,
+            'committed': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_batch_seen': 0,
+        }
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='kotoimi-group-commit', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, operation):
+        """書き込み操作をキューに積み、結果の Future を返す"""
+        if self._closed:
+            raise RuntimeError('writer is closed')
+        future = Future()
+        self._ensure_started()
+        with self._lock:
+            self._stats['submitted'] += 1
+        self._queue.put((operation, future))
+        return future
+
+    def execute(self, operation, timeout=None):
+        """書き込み操作を実行し、コミット後に結果を返す"""
+        return self.submit(operation).result(timeout)
+
+    def _collect_batch(self, first):
+        """最初の1件に続く書き込みを最大件数・最大待ち時間まで集める"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # 停止要求は今のバッチを書き終えてから処理する
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect_batch(first)
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        """バッチを1トランザクションで書き込む"""
+        # キャンセル済みの書き込みは除外
+        batch = [(operation, future) for operation, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        results = []
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for operation, future in batch:
+                        conn.execute('SAVEPOINT group_commit_item')
+                        try:
+                            result = operation(conn)
+                        except Exception as e:
+                            conn.execute('ROLLBACK TO group_commit_item')
+                            conn.execute('RELEASE group_commit_item')
+                            results.append((future, None, e))
+                        else:
+                            conn.execute('RELEASE group_commit_item')
+                            results.append((future, result, None))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            # コミット自体が失敗した場合はバッチ全体を失敗として通知
+            for operation, future in batch:
+                future.set_exception(e)
+            with self._lock:
+                self._stats['failed'] += len(batch)
+                self._stats['batches'] += 1
+            return
+
+        # コミット完了後に各リクエストへ結果を通知
+        committed = 0
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+                committed += 1
+            else:
+                future.set_exception(error)
+        with self._lock:
+            self._stats['committed'] += committed
+            self._stats['failed'] += len(results) - committed
+            self._stats['batches'] += 1
+            self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(batch))
+
+    def stats(self):
+        """統計カウンタを返す"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['max_batch'] = self.max_batch
+        stats['max_wait_ms'] = self.max_wait * 1000.0
+        stats['avg_batch'] = stats['committed'] / stats['batches'] if stats['batches'] else 0
+        return stats
+
+    def close(self, timeout=5.0):
+        """キューに残った書き込みを処理してから停止"""
+        self._closed = True
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path):
+    """DBファイル毎に共有されるグループコミットライターを取得"""
+    key = os.path.abspath(db_path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = GroupCommitWriter(get_pool(db_path))
+            _writers[key] = writer
+        return writer
+
+
+def writer_stats():
+    """全ライターの統計(診断用)"""
+    with _writers_lock:
+        writers = list(_writers.items())
+    return {path: writer.stats() for path, writer in writers}
+
+
+def close_all_writers():
+    """全ライターを停止"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_all_writers)